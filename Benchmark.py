@@ -0,0 +1,498 @@
+# system libs
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from BitBoard import BitBoard, get_geometry
+from OpeningBook import book_positions
+from Player import AIPlayer, Board
+
+
+# Fixed positions given as the columns played from an empty board, player 1
+# moving first
+CORPUS = {
+    'opening': '33',
+    'early': '3324',
+    'middlegame': '332415502',
+    'late_middlegame': '33241550266411',
+    'near_endgame': '016006262131402222601344616544',
+    # column 5 makes two threats at once
+    'tactical': '0633324334215',
+}
+
+# Seconds every throughput measurement keeps calling its function
+MIN_TIME = 0.2
+# Relative slowdown compare reports as a regression
+THRESHOLD = 0.10
+# Results of run with its default settings, what run --baseline compares
+# against when given no file. The timings are the machine's that wrote it, on
+# another machine write a new one with run --output benchmark_baseline.json
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'benchmark_baseline.json')
+
+
+def position_from_moves(moves, rows=6, cols=7):
+    """
+    Builds a board in the Game encoding from a string of column digits.
+
+    RETURNS:
+    (board, player to move)
+    """
+    board = np.zeros([rows, cols]).astype(np.uint8)
+    player = 1
+    for move in moves:
+        col = int(move)
+        row = rows - 1 - np.count_nonzero(board[:, col])
+        board[row, col] = player
+        player = 3 - player
+    return board, player
+
+
+def state_from_moves(moves, rows=6, cols=7):
+    # The same position as position_from_moves on a BitBoard
+    state = BitBoard(rows, cols)
+    for i, move in enumerate(moves):
+        state.play(int(move), i % 2 + 1)
+    return state
+
+
+@contextlib.contextmanager
+def quiet():
+    # The search reports every move on stdout, keep that out of the results
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def scaling(depth, worker_counts, mode='alpha_beta'):
+    """
+    Searches every corpus position to a fixed depth with each number of root
+    search workers.
+
+    RETURNS:
+    A list of dicts with the workers, time to depth and nodes per second
+    """
+    results = []
+    for workers in worker_counts:
+        elapsed = 0
+        nodes = 0
+        for name, moves in CORPUS.items():
+            board, player = position_from_moves(moves)
+            # the solver would time a single process for near_endgame
+            ai = AIPlayer(player, depth=depth, workers=workers, solver_cells=None)
+            search = ai.get_alpha_beta_move
+            if mode == 'expectimax':
+                search = ai.get_expectimax_move
+            try:
+                with quiet():
+                    if workers > 1:
+                        # keep starting the processes out of the timing
+                        ai.start_workers()
+                    start = time.time()
+                    search(board)
+                elapsed += time.time() - start
+                nodes += ai.stats.nodes
+            finally:
+                ai.close()
+        results.append({'workers': workers,
+                        'depth': depth,
+                        'mode': mode,
+                        'time_to_depth': elapsed,
+                        'nodes': nodes,
+                        'nodes_per_sec': nodes / elapsed if elapsed else 0})
+    return results
+
+
+def throughput(function, repeats=3):
+    """
+    Calls function again and again for MIN_TIME seconds, repeats times.
+
+    RETURNS:
+    The best number of calls per second
+    """
+    best = 0
+    for _ in range(repeats):
+        calls = 0
+        start = time.perf_counter()
+        elapsed = 0
+        while elapsed < MIN_TIME:
+            function()
+            calls += 1
+            elapsed = time.perf_counter() - start
+        best = max(best, calls / elapsed)
+    return best
+
+
+def metric(value, unit, higher_is_better):
+    # higher_is_better None marks counts that are reported, never judged
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def evaluation_metrics(name, moves, repeats):
+    # Positions scored per second by the bitboard and the numpy evaluator
+    board, player = position_from_moves(moves)
+    state = state_from_moves(moves)
+    ai = AIPlayer(player, log_level='quiet')
+    numpy_board = Board(board)
+    return {
+        'eval/bitboard/' + name: metric(
+            throughput(lambda: ai.evaluation_function(state), repeats),
+            'evals/s', True),
+        'eval/numpy/' + name: metric(
+            throughput(lambda: ai.evaluation_function(numpy_board), repeats),
+            'evals/s', True),
+    }
+
+
+def movegen_metrics(name, moves, repeats):
+    # Moves generated per second, the bitboard ones also played and undone
+    board, player = position_from_moves(moves)
+    state = state_from_moves(moves)
+    numpy_board = Board(board)
+    count = len(state.possible_moves())
+
+    def bitboard_moves():
+        for col in state.possible_moves():
+            state.play(col, player)
+            state.undo()
+
+    return {
+        'movegen/bitboard/' + name: metric(
+            throughput(bitboard_moves, repeats) * count, 'moves/s', True),
+        'movegen/numpy/' + name: metric(
+            throughput(numpy_board.possible_moves, repeats) * count, 'moves/s', True),
+    }
+
+
+def search_metrics(name, moves, mode, depth, repeats):
+    """
+    Best time to depth out of repeats searches with a fresh player, the exact
+    solver is kept out so every position measures the heuristic search.
+    """
+    board, player = position_from_moves(moves)
+    best = None
+    for _ in range(repeats):
+        ai = AIPlayer(player, depth=depth, solver_cells=None, log_level='quiet')
+        if mode == 'expectimax':
+            ai.get_expectimax_move(board)
+        else:
+            ai.get_alpha_beta_move(board)
+        if best is None or ai.stats.time < best.time:
+            best = ai.stats
+    prefix = '{}/{}/'.format(mode, name)
+    return {
+        prefix + 'time_to_depth': metric(best.time, 's', False),
+        prefix + 'nodes_per_sec': metric(best.nodes_per_sec(), 'nodes/s', True),
+        prefix + 'nodes': metric(best.nodes, 'nodes', None),
+    }
+
+
+def suite(depth=5, expectimax_depth=3, repeats=3, positions=None):
+    """
+    Runs every measurement on every corpus position.
+
+    INPUTS:
+    depth            - alpha-beta search depth
+    expectimax_depth - expectimax search depth
+    repeats          - every measurement keeps its best of this many runs
+    positions        - corpus names to use, None for all of them
+
+    RETURNS:
+    A dict with the settings and a dict of metric name: metric
+    """
+    metrics = {}
+    for name in positions or CORPUS:
+        moves = CORPUS[name]
+        metrics.update(evaluation_metrics(name, moves, repeats))
+        metrics.update(movegen_metrics(name, moves, repeats))
+        metrics.update(search_metrics(name, moves, 'alpha_beta', depth, repeats))
+        metrics.update(search_metrics(name, moves, 'expectimax',
+                                      expectimax_depth, repeats))
+    return {'settings': {'depth': depth,
+                         'expectimax_depth': expectimax_depth,
+                         'repeats': repeats,
+                         'positions': sorted(positions or CORPUS),
+                         'python': platform.python_version(),
+                         'numpy': np.__version__,
+                         'machine': platform.machine(),
+                         'host': platform.node(),
+                         'cpus': os.cpu_count(),
+                         'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'metrics': metrics}
+
+
+def memory(depth=5, mode='alpha_beta', positions=None):
+    """
+    Peak memory of a fixed depth search of every corpus position. The
+    player and its transposition table are built before tracing starts, so
+    only what the search itself allocates is counted.
+
+    RETURNS:
+    A list of dicts with the position, the move picked, the nodes searched,
+    the peak traced bytes and the peak of sys.getallocatedblocks over its
+    value before the search, sampled at every evaluation
+    """
+    results = []
+    for name in positions or CORPUS:
+        board, player = position_from_moves(CORPUS[name])
+        ai = AIPlayer(player, depth=depth, solver_cells=None, log_level='quiet')
+        search = ai.get_alpha_beta_move
+        if mode == 'expectimax':
+            search = ai.get_expectimax_move
+        # the geometry tables are built once per board size, not per search
+        get_geometry(*board.shape)
+        blocks = [0]
+        evaluate = ai.evaluation_function
+
+        def sampled(state):
+            blocks[0] = max(blocks[0], sys.getallocatedblocks())
+            return evaluate(state)
+
+        ai.evaluation_function = sampled
+        start_blocks = sys.getallocatedblocks()
+        tracemalloc.start()
+        try:
+            move = search(board)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        results.append({'position': name,
+                        'mode': mode,
+                        'depth': depth,
+                        'move': int(move),
+                        'nodes': ai.stats.nodes,
+                        'peak_bytes': peak,
+                        'peak_blocks': blocks[0] - start_blocks})
+    return results
+
+
+def symmetry(depth=6, mode='alpha_beta', positions=None, book_plies=6):
+    """
+    What storing a position and its mirror image as one entry saves. Every
+    corpus position is searched and then its mirror image with the same
+    player, once with symmetry off and once on, the way a game reaches
+    mirrored transpositions. The book counts the positions of the first
+    book_plies moves with and without mirror images folded together.
+
+    RETURNS:
+    (a list of dicts with the position, symmetry, nodes, table probes and
+    hits and the table entries in use after both searches, a dict with the
+    book position counts)
+    """
+    results = []
+    for name in positions or CORPUS:
+        board, player = position_from_moves(CORPUS[name])
+        for folded in (False, True):
+            ai = AIPlayer(player, depth=depth, solver_cells=None,
+                          log_level='quiet', symmetry=folded)
+            search = ai.get_alpha_beta_move
+            if mode == 'expectimax':
+                search = ai.get_expectimax_move
+            nodes = probes = hits = 0
+            for position in (board, board[:, ::-1].copy()):
+                search(position)
+                nodes += ai.stats.nodes
+                probes += ai.stats.tt_probes
+                hits += ai.stats.tt_hits
+            results.append({'position': name,
+                            'symmetry': folded,
+                            'nodes': nodes,
+                            'tt_probes': probes,
+                            'tt_hits': hits,
+                            'tt_entries': ai.tt.used()})
+
+    canonical = book_positions(book_plies)
+    raw = 0
+    for moves in canonical.values():
+        state = state_from_moves(moves)
+        raw += 1 if state.key == state.mirror_key else 2
+    return results, {'plies': book_plies, 'positions': raw,
+                     'canonical_positions': len(canonical)}
+
+
+def compare(baseline, results, threshold=THRESHOLD):
+    """
+    Compares the metrics two suite runs share.
+
+    RETURNS:
+    A list of (name, baseline value, new value, relative change, status)
+    sorted by name, change is positive when the metric got better and status
+    is 'regression', 'improvement', 'changed' for counts or 'ok'
+    """
+    rows = []
+    for name in sorted(set(baseline['metrics']) & set(results['metrics'])):
+        old = baseline['metrics'][name]
+        new = results['metrics'][name]
+        better = old['higher_is_better']
+        if old['value'] == 0:
+            change = 0.0 if new['value'] == 0 else float('inf')
+        else:
+            change = (new['value'] - old['value']) / old['value']
+        if better is None:
+            status = 'ok' if change == 0 else 'changed'
+        else:
+            if not better:
+                change = -change
+            if change < -threshold:
+                status = 'regression'
+            elif change > threshold:
+                status = 'improvement'
+            else:
+                status = 'ok'
+        rows.append((name, old['value'], new['value'], change, status))
+    return rows
+
+
+def settings_differences(baseline, results):
+    """
+    The settings two suite runs were made with that differ, when of another
+    machine, search depth or corpus their metrics can not be compared.
+
+    RETURNS:
+    A list of (setting, baseline value, new value), empty when they agree
+    """
+    old, new = baseline['settings'], results['settings']
+    return [(name, old.get(name), new.get(name))
+            for name in sorted(set(old) | set(new))
+            if name != 'time' and old.get(name) != new.get(name)]
+
+
+def print_comparison(rows):
+    print('{:45s} {:>12s} {:>12s} {:>8s}'.format('metric', 'baseline', 'new', 'change'))
+    for name, old, new, change, status in rows:
+        print('{:45s} {:12.4g} {:12.4g} {:+7.1%}  {}'.format(
+            name, old, new, change, '' if status == 'ok' else status))
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scale = subparsers.add_parser('scaling',
+                                  help='Time to depth at several worker counts')
+    scale.add_argument('--depth', type=int, default=6)
+    scale.add_argument('--mode', choices=['alpha_beta', 'expectimax'],
+                       default='alpha_beta')
+    scale.add_argument('--workers', type=int, nargs='+',
+                       default=sorted({1, 2, 4, 8, os.cpu_count() or 1}))
+    scale.add_argument('--output', help='Write the results to this JSON file')
+
+    run = subparsers.add_parser('run', help='Run the benchmark suite')
+    run.add_argument('--depth', type=int, default=5)
+    run.add_argument('--expectimax-depth', type=int, default=3)
+    run.add_argument('--repeats', type=int, default=3)
+    run.add_argument('--positions', nargs='+', choices=sorted(CORPUS))
+    run.add_argument('--output', help='Write the results to this JSON file')
+    run.add_argument('--baseline', nargs='?', const=BASELINE,
+                     help='Results JSON file to compare against, the stored '
+                          'baseline when given no file')
+    run.add_argument('--threshold', type=float, default=THRESHOLD,
+                     help='Relative slowdown counted as a regression')
+
+    mem = subparsers.add_parser('memory', help='Peak memory and allocations of a search')
+    mem.add_argument('--depth', type=int, default=5)
+    mem.add_argument('--mode', choices=['alpha_beta', 'expectimax'],
+                     default='alpha_beta')
+    mem.add_argument('--positions', nargs='+', choices=sorted(CORPUS))
+    mem.add_argument('--output', help='Write the results to this JSON file')
+
+    sym = subparsers.add_parser('symmetry',
+                                help='Table and book savings of mirror image folding')
+    sym.add_argument('--depth', type=int, default=6)
+    sym.add_argument('--mode', choices=['alpha_beta', 'expectimax'],
+                     default='alpha_beta')
+    sym.add_argument('--positions', nargs='+', choices=sorted(CORPUS))
+    sym.add_argument('--book-plies', type=int, default=6)
+    sym.add_argument('--output', help='Write the results to this JSON file')
+
+    comp = subparsers.add_parser('compare', help='Compare two results files')
+    comp.add_argument('baseline')
+    comp.add_argument('results')
+    comp.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    if args.command == 'scaling':
+        results = scaling(args.depth, args.workers, args.mode)
+        base = results[0]['time_to_depth']
+        print('workers  time to depth  speedup  nodes/sec')
+        for row in results:
+            speedup = base / row['time_to_depth'] if row['time_to_depth'] else 0
+            print('{:7d}  {:12.3f}s  {:7.2f}  {:9.0f}'.format(
+                row['workers'], row['time_to_depth'], speedup,
+                row['nodes_per_sec']))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    elif args.command == 'memory':
+        results = memory(args.depth, args.mode, args.positions)
+        print('position          move    nodes   peak KiB  peak blocks')
+        for row in results:
+            print('{:16s} {:5d} {:8d} {:10.1f} {:12d}'.format(
+                row['position'], row['move'], row['nodes'],
+                row['peak_bytes'] / 1024, row['peak_blocks']))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    elif args.command == 'symmetry':
+        results, book = symmetry(args.depth, args.mode, args.positions,
+                                 args.book_plies)
+        print('position         symmetry    nodes  hit rate  tt entries')
+        for row in results:
+            rate = row['tt_hits'] / row['tt_probes'] if row['tt_probes'] else 0
+            print('{:16s} {:>8s} {:8d} {:8.1%} {:11d}'.format(
+                row['position'], 'on' if row['symmetry'] else 'off',
+                row['nodes'], rate, row['tt_entries']))
+        for key in ('nodes', 'tt_entries'):
+            off = sum(row[key] for row in results if not row['symmetry'])
+            on = sum(row[key] for row in results if row['symmetry'])
+            print('total {}: {} -> {} ({:+.1%})'.format(key, off, on,
+                                                      on / off - 1 if off else 0))
+        print('book positions after {} plies: {} -> {}'.format(
+            book['plies'], book['positions'], book['canonical_positions']))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'searches': results, 'book': book}, f, indent=2)
+
+    elif args.command in ('run', 'compare'):
+        if args.command == 'run':
+            results = suite(args.depth, args.expectimax_depth, args.repeats,
+                            args.positions)
+            if args.output:
+                with open(args.output, 'w') as f:
+                    json.dump(results, f, indent=2)
+            baseline_path = args.baseline
+        else:
+            with open(args.results) as f:
+                results = json.load(f)
+            baseline_path = args.baseline
+
+        if baseline_path is None:
+            for name, value in sorted(results['metrics'].items()):
+                print('{:45s} {:12.4g} {}'.format(name, value['value'], value['unit']))
+        else:
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+            rows = compare(baseline, results, args.threshold)
+            print_comparison(rows)
+            differences = settings_differences(baseline, results)
+            regressions = [row for row in rows if row[4] == 'regression']
+            if differences:
+                # timings of another machine or search say nothing of the code
+                for name, old, new in differences:
+                    print('{} differs: baseline {}, new {}'.format(name, old, new))
+                print('The runs were made with different settings, the changes '
+                      'are not counted as regressions')
+            elif regressions:
+                print('{} regressions over {:.0%}'.format(len(regressions),
+                                                          args.threshold))
+                sys.exit(1)
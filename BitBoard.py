@@ -0,0 +1,571 @@
+import numpy as np
+import random
+from functools import lru_cache
+
+# Number of discs in a row needed to win, unless a board says otherwise
+CONNECT = 4
+# Worth of a maximal run two discs short of a win, one disc short and of a
+# win, see run_score
+RUN_WEIGHTS = (1, 10, 100)
+
+# Fixed seed so position keys are the same in every process
+ZOBRIST_SEED = 20220131
+
+
+class Geometry:
+    """
+    Precomputed bit layout for a board of a given size. Every column uses
+    rows + 1 bits, the extra bit on top of each column is a sentinel that is
+    never set so shifted masks can not bleed from one column into the next.
+
+    Bit (col * (rows + 1) + r) holds the disc r rows up from the bottom
+    of column col. connect is the number of discs in a row that wins and
+    weights the run weights the heuristic scores lines with.
+    """
+
+    def __init__(self, rows, cols, connect=CONNECT, weights=RUN_WEIGHTS):
+        self.rows = rows
+        self.cols = cols
+        self.connect = connect
+        self.weights = weights
+        self.column_bits = rows + 1
+
+        self.bottom_bits = [col * self.column_bits for col in range(cols)]
+        # distance of every column from the center, for move ordering
+        self.center_rank = [abs(2 * col - (cols - 1)) for col in range(cols)]
+        column_mask = (1 << rows) - 1
+        self.full_mask = 0
+        for col in range(cols):
+            self.full_mask |= column_mask << self.bottom_bits[col]
+        # the bottom cell of every column, for the threat layer
+        self.bottom_mask = sum(1 << bit for bit in self.bottom_bits)
+
+        # (shift, mask) for vertical, horizontal and both diagonals. The
+        # mask only keeps the cells of lines long enough to hold a win, the
+        # same lines Board.get_diagonals hands to the heuristic.
+        self.directions = []
+        # Every scored line as a list of bit indices, and for every bit the
+        # (line, position in line) pairs of the lines going through it
+        total_bits = cols * self.column_bits
+        self.line_cells = []
+        self.cell_lines = [[] for _ in range(total_bits)]
+        for d_col, d_row in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+            shift = d_col * self.column_bits + d_row
+            mask = 0
+            for line in self.lines(d_col, d_row):
+                if d_col == 0 or d_row == 0 or len(line) >= connect:
+                    line_id = len(self.line_cells)
+                    self.line_cells.append([self.index(row, col) for row, col in line])
+                    for pos, (row, col) in enumerate(line):
+                        mask |= self.bit(row, col)
+                        self.cell_lines[self.index(row, col)].append((line_id, pos))
+            self.directions.append((shift, mask))
+        self.shifts = [shift for shift, _ in self.directions]
+
+        # Score and four-in-a-row flag of every disc pattern of every line,
+        # indexed by the pattern read as a binary number
+        self.line_scores = []
+        self.line_wins = []
+        for cells in self.line_cells:
+            scores, wins = line_tables(len(cells), connect, weights)
+            self.line_scores.append(scores)
+            self.line_wins.append(wins)
+
+        # Most one disc can raise its owner's score: quiet_gain for a disc
+        # that does not win, win_gain for one that does. Nothing is played
+        # after a win so these bound how far the heuristic can move
+        self.quiet_gain = 0
+        self.win_gain = 0
+        for lines in self.cell_lines:
+            quiet = win = 0
+            for line_id, pos in lines:
+                line_quiet, line_win = line_gains(len(self.line_cells[line_id]),
+                                                  pos, connect, weights)
+                quiet += line_quiet
+                win += max(line_quiet, line_win)
+            self.quiet_gain = max(self.quiet_gain, quiet)
+            self.win_gain = max(self.win_gain, win)
+
+        # The open columns for every set of full columns, read as a bit mask,
+        # from left to right and from the center out, so listing moves
+        # builds nothing
+        self.open_moves = []
+        self.center_moves = []
+        for full in range(1 << cols):
+            moves = tuple(col for col in range(cols) if not full >> col & 1)
+            self.open_moves.append(moves)
+            self.center_moves.append(tuple(sorted(moves,
+                                                  key=self.center_rank.__getitem__)))
+
+        # Lines grouped by length for the numpy batch evaluator, filled on
+        # first use
+        self._batch_groups = None
+
+        # One random 64 bit number per player and bit, a position key is the
+        # xor of the numbers of every disc on the board
+        rng = random.Random(ZOBRIST_SEED)
+        self.zobrist = [[rng.getrandbits(64) for _ in range(total_bits)]
+                        for _ in range(2)]
+        # The number of the cell mirrored left to right, so the key of the
+        # mirror image can be kept up to date alongside the key
+        self.mirror_bits = [(cols - 1 - i // self.column_bits) * self.column_bits
+                            + i % self.column_bits for i in range(total_bits)]
+        self.mirror_zobrist = [[numbers[self.mirror_bits[i]] for i in range(total_bits)]
+                               for numbers in self.zobrist]
+
+    def index(self, row, col):
+        # row follows the numpy encoding, row 0 is the top of the board
+        return self.bottom_bits[col] + self.rows - 1 - row
+
+    def bit(self, row, col):
+        return 1 << self.index(row, col)
+
+    def batch_groups(self):
+        """
+        The scored lines grouped by length as numpy arrays, for every group:
+        (cells, bits, powers, scores, wins) where cells holds the flat
+        row * cols + col index of every cell of every line, bits the bit
+        index of the same cells, powers the value of each position in a line
+        pattern and scores/wins the pattern tables of that length.
+        """
+        if self._batch_groups is None:
+            by_length = {}
+            for cells in self.line_cells:
+                by_length.setdefault(len(cells), []).append(cells)
+            self._batch_groups = []
+            for length, lines in sorted(by_length.items()):
+                bits = np.array(lines, dtype=np.intp)
+                col = bits // self.column_bits
+                row = self.rows - 1 - bits % self.column_bits
+                scores, wins = line_tables(length, self.connect, self.weights)
+                self._batch_groups.append((row * self.cols + col,
+                                           bits,
+                                           1 << np.arange(length, dtype=np.int64),
+                                           np.array(scores, dtype=self.score_dtype()),
+                                           np.array(wins, dtype=bool)))
+        return self._batch_groups
+
+    def score_dtype(self):
+        # int64 for the default weights, float64 once a weight is a float
+        return np.result_type(np.int64, *[np.asarray(w) for w in self.weights])
+
+    def lines(self, d_col, d_row):
+        # Every maximal line of (row, col) cells going in the given
+        # direction, d_row counts upwards from the bottom of the board
+        lines = []
+        for col in range(self.cols):
+            for up in range(self.rows):
+                prev_col, prev_up = col - d_col, up - d_row
+                if 0 <= prev_col < self.cols and 0 <= prev_up < self.rows:
+                    continue  # not the first cell of its line
+                line = []
+                c, u = col, up
+                while 0 <= c < self.cols and 0 <= u < self.rows:
+                    line.append((self.rows - 1 - u, c))
+                    c, u = c + d_col, u + d_row
+                lines.append(line)
+        return lines
+
+
+@lru_cache(maxsize=None)
+def get_geometry(rows, cols, connect=CONNECT, weights=RUN_WEIGHTS):
+    # Built once per board size and weights, every such board shares it
+    return Geometry(rows, cols, connect, tuple(weights))
+
+
+def run_score(size, connect=CONNECT, weights=RUN_WEIGHTS):
+    """
+    Heuristic worth of a maximal run of size discs: by default 100 once it
+    wins, 10 when one disc short of that and 1 when two short, runs of a
+    single disc count for nothing. With connect 4 these are runs of 4, 3
+    and 2. weights holds the three worths, two short first.
+    """
+    two_short, one_short, win = weights
+    if size >= connect:
+        return win
+    if size < 2:
+        return 0
+    if size == connect - 1:
+        return one_short
+    if size == connect - 2:
+        return two_short
+    return 0
+
+
+def connected_through(board, row, col, player, connect=CONNECT):
+    """
+    Tells if the disc of player at (row, col) of a numpy board in the Game
+    encoding is part of connect in a row, looking only at the lines through
+    that cell.
+    """
+    rows, cols = board.shape
+    for d_row, d_col in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+        count = 1
+        for sign in (1, -1):
+            r, c = row + sign * d_row, col + sign * d_col
+            while 0 <= r < rows and 0 <= c < cols and board[r, c] == player:
+                count += 1
+                r, c = r + sign * d_row, c + sign * d_col
+        if count >= connect:
+            return True
+    return False
+
+
+def batch_heuristic(boards, rows=6, cols=7, connect=CONNECT, weights=RUN_WEIGHTS):
+    """
+    connected_heuristic for many positions at once with numpy.
+
+    INPUTS:
+    boards  - either an (N, rows, cols) stack of boards in the Game encoding
+              or a sequence of N (player 1 bits, player 2 bits) BitBoard masks
+    rows    - board rows, only used for bitboard masks
+    cols    - board columns, only used for bitboard masks
+    connect - discs in a row that win
+    weights - run weights, see run_score
+
+    RETURNS:
+    (scores, wins) - two (N, 2) arrays holding the heuristic score and the
+                     four-in-a-row flag of player 1 and player 2
+    """
+    if isinstance(boards, np.ndarray):
+        geometry = get_geometry(boards.shape[1], boards.shape[2], connect, weights)
+        flat = boards.reshape(boards.shape[0], -1)
+        discs = np.stack([flat == 1, flat == 2], axis=1)
+        use_bits = False
+    else:
+        geometry = get_geometry(rows, cols, connect, weights)
+        # unpack the masks into one 0/1 entry per bit
+        nbytes = (geometry.cols * geometry.column_bits + 7) // 8
+        raw = b''.join(int(bits).to_bytes(nbytes, 'little')
+                       for pair in boards for bits in pair)
+        raw = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 2, nbytes)
+        discs = np.unpackbits(raw, axis=-1, bitorder='little')
+        use_bits = True
+
+    scores = np.zeros(discs.shape[:2], dtype=geometry.score_dtype())
+    wins = np.zeros(discs.shape[:2], dtype=bool)
+    for cells, bits, powers, score_table, win_table in geometry.batch_groups():
+        # (N, 2, lines, length) discs on every line -> line patterns
+        on_lines = discs[:, :, bits if use_bits else cells]
+        patterns = on_lines.astype(np.int64) @ powers
+        scores += score_table[patterns].sum(axis=-1)
+        wins |= win_table[patterns].any(axis=-1)
+    return scores, wins
+
+
+@lru_cache(maxsize=None)
+def line_tables(length, connect=CONNECT, weights=RUN_WEIGHTS):
+    """
+    Scores every pattern of discs on a line of the given length the same way
+    Board.calculate_score does, with run_score.
+
+    RETURNS:
+    (scores, wins) lists indexed by the pattern, bit i set meaning the i-th
+    cell of the line holds a disc
+    """
+    scores = []
+    wins = []
+    for pattern in range(1 << length):
+        score = 0
+        over = 0
+        count = 0
+        for i in range(length + 1):
+            if i < length and pattern >> i & 1:
+                count += 1
+                continue
+            score += run_score(count, connect, weights)
+            if count >= connect:
+                over = 1
+            count = 0
+        scores.append(score)
+        wins.append(over)
+    return scores, wins
+
+
+@lru_cache(maxsize=None)
+def line_gains(length, pos, connect=CONNECT, weights=RUN_WEIGHTS):
+    """
+    Largest score increase a disc at pos of a line can bring while the line
+    holds no winning run yet.
+
+    RETURNS:
+    (gain when the disc does not win, gain when it does)
+    """
+    scores, wins = line_tables(length, connect, weights)
+    quiet = win = 0
+    for pattern in range(1 << length):
+        if wins[pattern] or pattern >> pos & 1:
+            continue
+        after = pattern | 1 << pos
+        gain = scores[after] - scores[pattern]
+        if wins[after]:
+            win = max(win, gain)
+        else:
+            quiet = max(quiet, gain)
+    return quiet, win
+
+
+class BitBoard:
+    """
+    Compact board used by the search. Each player's discs are kept in one
+    integer bit mask and the number of discs in every column is tracked so
+    moves can be made and unmade without copying anything.
+
+    The heuristic score of each player is kept up to date as discs come and
+    go, only the lines through the changed cell are rescored. The moves
+    played are kept in buffers sized for a full board, so play and undo
+    allocate nothing but the new integers.
+
+    INPUTS:
+    rows    - number of rows on the board
+    cols    - number of columns on the board
+    connect - discs in a row that win
+    weights - run weights of the heuristic, see run_score
+    """
+
+    __slots__ = ('geometry', 'rows', 'cols', 'connect', 'bits', 'mask', 'heights', 'full',
+                 'history_cols', 'history_players', 'ply', 'key', 'mirror_key', 'line_bits',
+                 'scores', 'wins')
+
+    def __init__(self, rows=6, cols=7, connect=CONNECT, weights=RUN_WEIGHTS):
+        self.geometry = get_geometry(rows, cols, connect, weights)
+        self.rows = rows
+        self.cols = cols
+        self.connect = connect
+        # bits[0] holds the discs of player 1 and bits[1] those of player 2
+        self.bits = [0, 0]
+        self.mask = 0
+        self.heights = [0] * cols
+        # bit col set once column col is full
+        self.full = 0
+        # column and player of every move played so far, ply of them
+        self.history_cols = [0] * (rows * cols)
+        self.history_players = [0] * (rows * cols)
+        self.ply = 0
+        # Zobrist key of the position, updated by play and undo
+        self.key = 0
+        # key of the same position mirrored left to right
+        self.mirror_key = 0
+        # per player: disc pattern of every line, heuristic score and the
+        # number of lines holding four in a row
+        lines = len(self.geometry.line_cells)
+        self.line_bits = [[0] * lines, [0] * lines]
+        self.scores = [0, 0]
+        self.wins = [0, 0]
+
+    @classmethod
+    def from_array(cls, board, connect=CONNECT, weights=RUN_WEIGHTS):
+        """
+        Builds a bitboard from the numpy encoding used by Game, where row 0
+        is the top of the board, 0 is empty and 1/2 are the player discs.
+        """
+        board = np.asarray(board)
+        state = cls(board.shape[0], board.shape[1], connect, weights)
+        geometry = state.geometry
+        for row, col in zip(*np.nonzero(board)):
+            row, col = int(row), int(col)
+            player = int(board[row, col])
+            index = geometry.index(row, col)
+            state.bits[player - 1] |= 1 << index
+            state.mask |= 1 << index
+            state.heights[col] += 1
+            if state.heights[col] == state.rows:
+                state.full |= 1 << col
+            state.key ^= geometry.zobrist[player - 1][index]
+            state.mirror_key ^= geometry.mirror_zobrist[player - 1][index]
+            state.add_lines(index, player)
+        return state
+
+    def to_array(self):
+        board = np.zeros([self.rows, self.cols]).astype(np.uint8)
+        for row in range(self.rows):
+            for col in range(self.cols):
+                bit = self.geometry.bit(row, col)
+                if self.bits[0] & bit:
+                    board[row, col] = 1
+                elif self.bits[1] & bit:
+                    board[row, col] = 2
+        return board
+
+    def __str__(self):
+        return str(self.to_array())
+
+    def __repr__(self):
+        return 'BitBoard(\n{})'.format(self.to_array())
+
+    def canonical(self):
+        """
+        The key a position and its mirror image share, the smaller of the
+        two keys, and whether it is the mirror image's. Moves stored under
+        a mirrored key are mirrored with mirror_col.
+
+        RETURNS:
+        (canonical key, mirrored)
+        """
+        if self.mirror_key < self.key:
+            return self.mirror_key, True
+        return self.key, False
+
+    def mirror_col(self, col):
+        return self.cols - 1 - col
+
+    def can_play(self, col):
+        return self.heights[col] < self.rows
+
+    def possible_moves(self):
+        # Columns that still have room, from left to right, as a shared tuple
+        return self.geometry.open_moves[self.full]
+
+    def center_moves(self):
+        # The same columns from the center out
+        return self.geometry.center_moves[self.full]
+
+    def play(self, col, player):
+        # drop a disc for player in col, undo() takes it back
+        if self.heights[col] >= self.rows:
+            raise Exception("Attempting to play in a full column")
+        index = self.geometry.bottom_bits[col] + self.heights[col]
+        bit = 1 << index
+        self.bits[player - 1] |= bit
+        self.mask |= bit
+        self.heights[col] += 1
+        if self.heights[col] == self.rows:
+            self.full |= 1 << col
+        self.key ^= self.geometry.zobrist[player - 1][index]
+        self.mirror_key ^= self.geometry.mirror_zobrist[player - 1][index]
+        self.add_lines(index, player)
+        self.history_cols[self.ply] = col
+        self.history_players[self.ply] = player
+        self.ply += 1
+
+    def undo(self):
+        self.ply -= 1
+        col = self.history_cols[self.ply]
+        player = self.history_players[self.ply]
+        self.full &= ~(1 << col)
+        self.heights[col] -= 1
+        index = self.geometry.bottom_bits[col] + self.heights[col]
+        bit = 1 << index
+        self.bits[player - 1] ^= bit
+        self.mask ^= bit
+        self.key ^= self.geometry.zobrist[player - 1][index]
+        self.mirror_key ^= self.geometry.mirror_zobrist[player - 1][index]
+        self.remove_lines(index, player)
+
+    def add_lines(self, index, player):
+        # Rescores the lines through bit index after player put a disc there
+        geometry = self.geometry
+        line_bits = self.line_bits[player - 1]
+        score = 0
+        wins = 0
+        for line, pos in geometry.cell_lines[index]:
+            before = line_bits[line]
+            after = before | (1 << pos)
+            line_bits[line] = after
+            scores = geometry.line_scores[line]
+            score += scores[after] - scores[before]
+            line_wins = geometry.line_wins[line]
+            wins += line_wins[after] - line_wins[before]
+        self.scores[player - 1] += score
+        self.wins[player - 1] += wins
+
+    def remove_lines(self, index, player):
+        geometry = self.geometry
+        line_bits = self.line_bits[player - 1]
+        score = 0
+        wins = 0
+        for line, pos in geometry.cell_lines[index]:
+            before = line_bits[line]
+            after = before ^ (1 << pos)
+            line_bits[line] = after
+            scores = geometry.line_scores[line]
+            score += scores[after] - scores[before]
+            line_wins = geometry.line_wins[line]
+            wins += line_wins[after] - line_wins[before]
+        self.scores[player - 1] += score
+        self.wins[player - 1] += wins
+
+    def child_bits(self, col, player):
+        # (player 1 bits, player 2 bits) after player drops a disc in col,
+        # without changing this board
+        bit = 1 << (self.geometry.bottom_bits[col] + self.heights[col])
+        if player == 1:
+            return self.bits[0] | bit, self.bits[1]
+        return self.bits[0], self.bits[1] | bit
+
+    def is_full(self):
+        return self.mask == self.geometry.full_mask
+
+    def wins_at(self, col):
+        """
+        Tells if the top disc of col is part of a four in a row, only the
+        lines through that disc are looked at.
+        """
+        index = self.geometry.bottom_bits[col] + self.heights[col] - 1
+        if self.bits[0] >> index & 1:
+            bb = self.bits[0]
+        elif self.bits[1] >> index & 1:
+            bb = self.bits[1]
+        else:
+            return False
+        for shift, _ in self.geometry.directions:
+            count = 1
+            i = index + shift
+            while bb >> i & 1:
+                count += 1
+                i += shift
+            i = index - shift
+            while i >= 0 and bb >> i & 1:
+                count += 1
+                i -= shift
+            if count >= self.connect:
+                return True
+        return False
+
+    def has_won(self, player):
+        # A winning run checked with shifts in all four directions
+        bb = self.bits[player - 1]
+        for shift, _ in self.geometry.directions:
+            run = bb
+            for step in range(1, self.connect):
+                run &= bb >> (step * shift)
+            if run:
+                return True
+        return False
+
+    def connected_heuristic(self, player):
+        """
+        Same scoring as Board.connected_heuristic, see run_score: with
+        connect 4 every maximal run of 2 discs is worth 1, of 3 is worth 10
+        and of 4 or more is worth 100. The score is maintained by play and
+        undo so this is a lookup.
+
+        RETURNS:
+        (score, over) where over tells if player has a winning run
+        """
+        return self.scores[player - 1], self.wins[player - 1] > 0
+
+    def rescan_heuristic(self, player):
+        # Scores the whole board from scratch, same result as
+        # connected_heuristic
+        total = 0
+        over = False
+        weights = self.geometry.weights
+        bb = self.bits[player - 1]
+        for shift, line_mask in self.geometry.directions:
+            b = bb & line_mask
+            # runs[k] counts the runs of at least k discs
+            runs = b & ~(b << shift)
+            counts = [0, runs.bit_count()]
+            for size in range(2, self.connect + 1):
+                runs &= b >> ((size - 1) * shift)
+                if not runs:
+                    break
+                counts.append(runs.bit_count())
+            counts += [0] * (self.connect + 2 - len(counts))
+            for size in range(2, self.connect):
+                total += run_score(size, self.connect, weights) * (counts[size] - counts[size + 1])
+            total += run_score(self.connect, self.connect, weights) * counts[self.connect]
+            if counts[self.connect]:
+                over = True
+        return total, over
@@ -2,84 +2,399 @@
 # system libs
 import argparse
 import multiprocessing as mp
+import time
 import tkinter as tk
 
 # 3rd party libs
 import numpy as np
 
 # Local libs
-from Player import AIPlayer, RandomPlayer, HumanPlayer
+from BitBoard import CONNECT, connected_through
+from MCTS import MCTSPlayer
+from Player import AIPlayer, RandomPlayer, HumanPlayer, LOG_LEVELS
+
+# Seconds a cancelled search gets to send back its best move so far
+CANCEL_GRACE = 2
+# Largest side of a board cell in pixels and of the whole board
+CELL_SIZE = 100
+BOARD_SIZE = 800
+# Milliseconds between two looks at a running search
+POLL_MS = 100
+# Milliseconds between two moves when the game plays itself
+AUTOPLAY_DELAY = 500
+
+
+def ai_worker(player, conn, cancel_event):
+    """
+    Runs in its own process for the whole game, so the player keeps its
+    transposition table and other caches from one move to the next.
+
+    INPUTS:
+    player       - the AIPlayer or MCTSPlayer making the moves
+    conn         - pipe end receiving ('move', board, method name),
+                   ('ponder', board, search mode) and ('stop',) messages.
+                   While searching it sends ('progress', (depth, column,
+                   score), None) after every finished depth, every move is
+                   answered with ('move', column, stats) or ('error',
+                   message, None) and every ponder with ('pondered', None,
+                   None)
+    cancel_event - set by the game once the turn time is up or the
+                   opponent has moved
+    """
+    player.cancel_event = cancel_event
+    player.progress = lambda *info: conn.send(('progress', info, None))
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            if message[0] == 'stop':
+                break
+            if message[0] == 'ponder':
+                _, board, mode = message
+                try:
+                    player.ponder(board, mode)
+                except Exception as e:
+                    print('Pondering failed: {!r}'.format(e))
+                conn.send(('pondered', None, None))
+                continue
+            _, board, method = message
+            try:
+                move = getattr(player, method)(board)
+                conn.send(('move', move, player.stats))
+            except Exception as e:
+                conn.send(('error', repr(e), None))
+    finally:
+        # the root search pool and the endgame table belong to this
+        # process, the parent's copy of the player never opened them
+        player.close()
+        conn.close()
+
+
+class AIWorker:
+    """
+    Long lived process searching the moves of one computer player. The
+    process is started once and only started again if it dies.
 
-#https://stackoverflow.com/a/37737985
-def turn_worker(board, send_end, p_func):
-    send_end.send(p_func(board))
+    A move is asked for with request() and collected with poll(), so a GUI
+    can keep handling events while the search runs.
+    """
+    def __init__(self, player):
+        self.player = player
+        self.process = None
+        # SearchStats of the last move the worker sent
+        self.stats = None
+        # (board, method, deadline, attempt) of the move being searched
+        self.pending = None
+        # true from ponder() until the worker confirmed it stopped
+        self.pondering = False
+        self.start()
+
+    def start(self):
+        self.conn, child_conn = mp.Pipe()
+        self.cancel_event = mp.Event()
+        self.process = mp.Process(target=ai_worker,
+                                  args=(self.player, child_conn, self.cancel_event))
+        self.process.start()
+        child_conn.close()
+
+    def restart(self):
+        self.close()
+        self.start()
+
+    def close(self):
+        if self.process is None:
+            return
+        # a running search or ponder stops before reading the message
+        self.cancel_event.set()
+        try:
+            self.conn.send(('stop',))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(CANCEL_GRACE)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+        self.process = None
+        self.pending = None
+        self.pondering = False
+
+    def ponder(self, board, mode):
+        """
+        Lets the player search on the opponent's time, until the next
+        request() or stop_pondering().
+
+        INPUTS:
+        board - the numpy board right after the player's own move
+        mode  - 'alpha_beta' or 'expectimax', the search the next move uses
+        """
+        if self.pending is not None or self.pondering:
+            return
+        if not self.process.is_alive():
+            self.restart()
+        self.cancel_event.clear()
+        try:
+            self.conn.send(('ponder', board, mode))
+        except (BrokenPipeError, ConnectionResetError):
+            self.restart()
+            return
+        self.pondering = True
+
+    def stop_pondering(self):
+        # Cancels pondering and waits until the worker is listening again
+        if not self.pondering:
+            return
+        self.cancel_event.set()
+        try:
+            while self.conn.poll(CANCEL_GRACE):
+                if self.conn.recv()[0] == 'pondered':
+                    self.pondering = False
+                    return
+        except (EOFError, BrokenPipeError, ConnectionResetError):
+            pass
+        self.restart()
+
+    def request(self, board, method, time_limit, attempt=0):
+        """
+        Starts the search of a move and returns right away.
+
+        INPUTS:
+        board      - the numpy board to move on
+        method     - name of the player method searching the move
+        time_limit - seconds the move may take
+        attempt    - how often the search was started again already
+        """
+        self.stop_pondering()
+        if not self.process.is_alive():
+            self.restart()
+        self.cancel_event.clear()
+        deadline = time.time() + time_limit
+        self.pending = (board.copy(), method, deadline, attempt)
+        try:
+            self.conn.send(('move', board, method))
+        except (BrokenPipeError, ConnectionResetError):
+            self.retry()
+
+    def retry(self):
+        # the worker died during the search, try once more on a new one
+        board, method, deadline, attempt = self.pending
+        self.restart()
+        if attempt > 0:
+            raise Exception('AI worker crashed')
+        self.request(board, method, max(0, deadline - time.time()), attempt + 1)
+
+    def poll(self):
+        """
+        Collects what the worker sent since the last call without waiting.
+        When the time limit runs out the search is cancelled and returns
+        the best move it has fully searched, a worker that does not answer
+        even then is restarted.
+
+        RETURNS:
+        (progress, move) where progress is a list of (depth, column, score)
+        and move is the 0 based column to play or None while searching
+        """
+        progress = []
+        while self.pending is not None:
+            try:
+                if not self.conn.poll():
+                    break
+                kind, value, stats = self.conn.recv()
+            except (EOFError, BrokenPipeError, ConnectionResetError):
+                self.retry()
+                continue
+            if kind == 'progress':
+                progress.append(value)
+                continue
+            self.pending = None
+            if kind == 'error':
+                raise Exception(value)
+            self.stats = stats
+            return progress, value
+
+        if self.pending is not None:
+            deadline = self.pending[2]
+            if time.time() > deadline + CANCEL_GRACE:
+                self.restart()
+                raise Exception('Player Exceeded time limit')
+            if time.time() > deadline:
+                # ask the search to stop and hand over its best move
+                self.cancel_event.set()
+        return progress, None
+
+    def get_move(self, board, method, time_limit):
+        """
+        Asks the worker for a move and waits for it.
+
+        INPUTS:
+        board      - the numpy board to move on
+        method     - name of the player method searching the move
+        time_limit - seconds the move may take
+
+        RETURNS:
+        The 0 based index of the column to play
+        """
+        self.request(board, method, time_limit)
+        while True:
+            _, move = self.poll()
+            if move is not None:
+                return move
+            self.conn.poll(POLL_MS / 1000)
 
 
 class Game:
-    def __init__(self, player1, player2, time):
+    def __init__(self, player1, player2, time, rows=6, cols=7, connect=CONNECT,
+                 autoplay=False, ponder=False):
         self.players = [player1, player2]
         self.colors = ['yellow', 'red']
         self.current_turn = 0
-        self.board = np.zeros([6,7]).astype(np.uint8)
+        self.connect = connect
+        self.board = np.zeros([rows, cols]).astype(np.uint8)
         self.gui_board = []
         self.game_over = False
+        self.last_move = None
         self.ai_turn_limit = time
+        # true while a worker searches the move of the current player
+        self.thinking = False
+        # computer players search on their opponent's time
+        self.ponder = ponder
+        # one search process per computer player, kept for the whole game
+        self.workers = [AIWorker(player) if player.type in ('ai', 'mcts') else None
+                        for player in self.players]
 
         #https://stackoverflow.com/a/38159672
         root = tk.Tk()
-        root.title('Connect 4')
+        self.root = root
+        root.title('Connect {}'.format(connect))
         self.player_string = tk.Label(root, text=player1.player_string)
         self.player_string.pack()
-        self.c = tk.Canvas(root, width=700, height=600)
+        self.cell = min(CELL_SIZE, BOARD_SIZE // max(rows, cols))
+        cell = self.cell
+        self.c = tk.Canvas(root, width=cols*cell, height=rows*cell)
         self.c.pack()
+        # a human player clicks the column to play
+        self.c.bind('<Button-1>', self.click)
 
-        for row in range(0, 700, 100):
+        # gui_board[col][row] is the disc drawn at board[row, col]
+        for x in range(0, cols*cell, cell):
             column = []
-            for col in range(0, 700, 100):
-                column.append(self.c.create_oval(row, col, row+100, col+100, fill=''))
+            for y in range(0, rows*cell, cell):
+                column.append(self.c.create_oval(x, y, x+cell, y+cell, fill=''))
             self.gui_board.append(column)
 
+        # depth, best move and score of the running search
+        self.search_string = tk.Label(root, text='')
+        self.search_string.pack()
         tk.Button(root, text='Next Move', command=self.make_move).pack()
-
-        root.mainloop()
+        self.autoplay = tk.BooleanVar(root, value=autoplay)
+        tk.Checkbutton(root, text='Auto play', variable=self.autoplay,
+                       command=self.schedule_move).pack()
+        self.schedule_move()
+
+        try:
+            root.mainloop()
+        finally:
+            for worker in self.workers:
+                if worker is not None:
+                    worker.close()
 
     def make_move(self):
-        if not self.game_over:
-            current_player = self.players[self.current_turn]
-
-            if current_player.type == 'ai':
-
-                if self.players[int(not self.current_turn)].type == 'random':
-                    p_func = current_player.get_expectimax_move
-                else:
-                    p_func = current_player.get_alpha_beta_move
-
-                try:
-                    recv_end, send_end = mp.Pipe(False)
-                    p = mp.Process(target=turn_worker, args=(self.board, send_end, p_func))
-                    p.start()
-                    if p.join(self.ai_turn_limit) is None and p.is_alive():
-                        p.terminate()
-                        raise Exception('Player Exceeded time limit')
-                except Exception as e:
-                    uh_oh = 'Uh oh.... something is wrong with Player {}'
-                    print(uh_oh.format(current_player.player_number))
-                    print(e)
-                    raise Exception('Game Over')
-
-                move = recv_end.recv()
-            else:
-                move = current_player.get_move(self.board)
-
-            if move is not None:
-                self.update_board(int(move), current_player.player_number)
+        if self.game_over or self.thinking:
+            return
+        current_player = self.players[self.current_turn]
+        worker = self.workers[self.current_turn]
+
+        if worker is not None:
+            mode = self.search_mode(self.current_turn)
+            method = 'get_move' if mode is None else 'get_{}_move'.format(mode)
+            try:
+                worker.request(self.board, method, self.ai_turn_limit)
+            except Exception as e:
+                self.player_failed(e)
+                return
+            self.thinking = True
+            self.search_string.configure(text='Thinking...')
+            self.root.after(POLL_MS, self.poll_worker)
+        elif current_player.type == 'random':
+            self.play(current_player.get_move(self.board))
+        else:
+            self.search_string.configure(text='Click a column to play')
+
+    def poll_worker(self):
+        # Runs every POLL_MS while a worker searches, the GUI stays responsive
+        current_player = self.players[self.current_turn]
+        try:
+            progress, move = self.workers[self.current_turn].poll()
+        except Exception as e:
+            self.thinking = False
+            self.player_failed(e)
+            return
+        for depth, col, score in progress:
+            info = 'Depth {}: best column {}, score {}'
+            self.search_string.configure(text=info.format(depth, col, score))
+        if move is None:
+            self.root.after(POLL_MS, self.poll_worker)
+            return
+        self.thinking = False
+        worker = self.workers[self.current_turn]
+        stats = worker.stats
+        if current_player.type == 'ai' and stats is not None:
+            info = 'Played column {} after {:.1f}s, score {}'
+            self.search_string.configure(text=info.format(move, stats.time, stats.score))
+        mode = self.search_mode(self.current_turn)
+        self.play(move)
+        if self.ponder and not self.game_over:
+            worker.ponder(self.board, mode)
+
+    def search_mode(self, turn):
+        # The search a computer player uses, expectimax against random
+        # players and None for mcts players
+        if self.players[turn].type == 'mcts':
+            return None
+        if self.players[int(not turn)].type == 'random':
+            return 'expectimax'
+        return 'alpha_beta'
+
+    def player_failed(self, error):
+        uh_oh = 'Uh oh.... something is wrong with Player {}'
+        print(uh_oh.format(self.players[self.current_turn].player_number))
+        print(error)
+        self.game_over = True
+        self.player_string.configure(text='Game Over')
+
+    def click(self, event):
+        current_player = self.players[self.current_turn]
+        if self.game_over or self.thinking or current_player.type != 'human':
+            return
+        col = event.x // self.cell
+        if 0 <= col < self.board.shape[1] and 0 in self.board[:,col]:
+            self.search_string.configure(text='')
+            self.play(col)
+
+    def play(self, move):
+        current_player = self.players[self.current_turn]
+        if move is not None:
+            self.update_board(int(move), current_player.player_number)
+
+        if self.game_completed(current_player.player_number):
+            self.game_over = True
+            self.player_string.configure(text=self.players[self.current_turn].player_string + ' wins!')
+        elif self.board_full():
+            self.game_over = True
+            self.player_string.configure(text='Draw!')
+        else:
+            self.current_turn = int(not self.current_turn)
+            self.player_string.configure(text=self.players[self.current_turn].player_string)
+            self.schedule_move()
 
-            if self.game_completed(current_player.player_number):
-                self.game_over = True
-                self.player_string.configure(text=self.players[self.current_turn].player_string + ' wins!')
-            else:
-                self.current_turn = int(not self.current_turn)
-                self.player_string.configure(text=self.players[self.current_turn].player_string)
+    def schedule_move(self):
+        # With auto play on, computer players move without a click
+        if not self.autoplay.get() or self.game_over or self.thinking:
+            return
+        if self.players[self.current_turn].type != 'human':
+            self.root.after(AUTOPLAY_DELAY, self.make_move)
 
     def update_board(self, move, player_num):
         if 0 in self.board[:,move]:
@@ -93,6 +408,7 @@ class Game:
 
                 if update_row >= 0:
                     self.board[update_row, move] = player_num
+                    self.last_move = (update_row, move)
                     self.c.itemconfig(self.gui_board[move][update_row],
                                       fill=self.colors[self.current_turn])
                     break
@@ -102,60 +418,52 @@ class Game:
 
 
     def game_completed(self, player_num):
-        player_win_str = '{0}{0}{0}{0}'.format(player_num)
-        board = self.board
-        to_str = lambda a: ''.join(a.astype(str))
-
-        def check_horizontal(b):
-            for row in b:
-                if player_win_str in to_str(row):
-                    return True
-            return False
-
-        def check_verticle(b):
-            return check_horizontal(b.T)
-
-        def check_diagonal(b):
-            for op in [None, np.fliplr]:
-                op_board = op(b) if op else b
-
-                root_diag = np.diagonal(op_board, offset=0).astype(np.int)
-                if player_win_str in to_str(root_diag):
-                    return True
-
-                for i in range(1, b.shape[1]-3):
-                    for offset in [i, -i]:
-                        diag = np.diagonal(op_board, offset=offset)
-                        diag = to_str(diag.astype(np.int))
-                        if player_win_str in diag:
-                            return True
-
+        # Only the lines through the last disc played can hold a new four
+        if self.last_move is None:
             return False
+        row, col = self.last_move
+        return connected_through(self.board, row, col, player_num, self.connect)
 
-        return (check_horizontal(board) or
-                check_verticle(board) or
-                check_diagonal(board))
-
+    def board_full(self):
+        return not (self.board == 0).any()
 
 
-def main(player1, player2, time):
+def main(player1, player2, time, log_level='moves', profile=None,
+         rows=6, cols=7, connect=CONNECT, autoplay=False, ponder=False):
     """
     Creates player objects based on the string paramters that are passed
     to it and calls play_game()
 
     INPUTS:
-    player1 - a string ['ai', 'random', 'human']
-    player2 - a string ['ai', 'random', 'human']
+    player1   - a string ['ai', 'mcts', 'random', 'human']
+    player2   - a string ['ai', 'mcts', 'random', 'human']
+    time      - seconds an ai player gets for each move
+    log_level - how much the ai players print, see Player.LOG_LEVELS
+    profile   - path prefix for cProfile stats of the ai players, player N
+                writes PROFILE.N
+    rows      - board rows
+    cols      - board columns
+    connect   - discs in a row that win
+    autoplay  - computer players move without waiting for Next Move
+    ponder    - computer players search on their opponent's time
     """
     def make_player(name, num):
         if name=='ai':
-            return AIPlayer(num)
+            # the search deepens until the turn limit is nearly used up
+            path = None if profile is None else '{}.{}'.format(profile, num)
+            return AIPlayer(num, time_limit=time, log_level=log_level,
+                            profile=path, connect=connect)
+        elif name=='mcts':
+            # anytime, it stops on its own once the turn limit is nearly used up
+            return MCTSPlayer(num, time_limit=time, log_level=log_level,
+                              connect=connect)
         elif name=='random':
             return RandomPlayer(num)
         elif name=='human':
             return HumanPlayer(num)
 
-    Game(make_player(player1, 1), make_player(player2, 2), time)
+    Game(make_player(player1, 1), make_player(player2, 2), time,
+         rows, cols, connect, autoplay, ponder)
 
 
 def play_game(player1, player2):
@@ -174,7 +482,7 @@ def play_game(player1, player2):
 
 
 if __name__=='__main__':
-    player_types = ['ai', 'random', 'human']
+    player_types = ['ai', 'mcts', 'random', 'human']
     parser = argparse.ArgumentParser()
     parser.add_argument('player1', choices=player_types)
     parser.add_argument('player2', choices=player_types)
@@ -182,6 +490,50 @@ if __name__=='__main__':
                         type=int,
                         default=60,
                         help='Time to wait for a move in seconds (int)')
+    parser.add_argument('--headless',
+                        action='store_true',
+                        help='Play --games games without the GUI, see Tournament.py')
+    parser.add_argument('--games',
+                        type=int,
+                        default=100,
+                        help='Number of headless games')
+    parser.add_argument('--output',
+                        help='Headless results file, .jsonl or .csv')
+    parser.add_argument('--log-level',
+                        choices=LOG_LEVELS,
+                        default='moves',
+                        help='What the ai players print, nodes is slow')
+    parser.add_argument('--profile',
+                        help='Write cProfile stats of ai player N to PROFILE.N')
+    parser.add_argument('--rows',
+                        type=int,
+                        default=6,
+                        help='Board rows')
+    parser.add_argument('--cols',
+                        type=int,
+                        default=7,
+                        help='Board columns')
+    parser.add_argument('--connect',
+                        type=int,
+                        default=CONNECT,
+                        help='Discs in a row that win')
+    parser.add_argument('--autoplay',
+                        action='store_true',
+                        help='Computer players move without clicking Next Move')
+    parser.add_argument('--ponder',
+                        action='store_true',
+                        help='Computer players search on their opponent\'s time')
     args = parser.parse_args()
 
-    main(args.player1, args.player2, args.time)
+    if args.headless:
+        from Tournament import run_tournament, print_summary
+        if 'human' in (args.player1, args.player2):
+            parser.error('headless games need ai, mcts or random players')
+        specs = [p if p == 'random' else '{}:time={}'.format(p, args.time)
+                 for p in (args.player1, args.player2)]
+        print_summary(run_tournament(specs[0], specs[1], args.games, args.output,
+                                     rows=args.rows, cols=args.cols,
+                                     connect=args.connect))
+    else:
+        main(args.player1, args.player2, args.time, args.log_level, args.profile,
+             args.rows, args.cols, args.connect, args.autoplay, args.ponder)
@@ -0,0 +1,667 @@
+# system libs
+import argparse
+import json
+import math
+import os
+import random
+import socket
+import socketserver
+import stat
+import threading
+import time
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from BitBoard import BitBoard, CONNECT
+from OpeningBook import OpeningBook
+from Player import AIPlayer
+from Solver import EndgameTable, Solver
+from Transposition import TranspositionTable
+
+
+# Where the server listens and clients connect unless told otherwise, a
+# path instead of HOST:PORT is a Unix socket
+ADDRESS = '127.0.0.1:7474'
+# Depth of a request that sets no limit, and the most a request may ask for
+DEPTH = 5
+MAX_DEPTH = 20
+MAX_TIME = 30
+# Memory cap of every shared transposition table
+TT_SIZE_MB = 32
+# AIPlayer search mode of every request mode
+MODES = ('alpha_beta', 'expectimax')
+# Latency percentiles the load test reports
+PERCENTILES = (50, 90, 95, 99)
+
+
+def parse_address(address):
+    """
+    RETURNS:
+    (socket family, address) of 'HOST:PORT' or of the path of a Unix socket
+    """
+    host, _, port = address.rpartition(':')
+    if '/' in address or not port.isdigit():
+        return socket.AF_UNIX, address
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+def score_value(score):
+    # Scores as JSON numbers, a search that only saw infinite values has none
+    if score is None or not math.isfinite(score):
+        return None
+    return score
+
+
+def request_position(request):
+    """
+    The position a request asks about, given either as 'moves', the columns
+    played from the empty board like '3324' or [3, 3, 2, 4], or as 'board',
+    rows of 0, 1 and 2 in the Game encoding with row 0 at the top.
+
+    RETURNS:
+    (board in the Game encoding, number of the player to move)
+    """
+    rows = int(request.get('rows', 6))
+    cols = int(request.get('cols', 7))
+    connect = int(request.get('connect', CONNECT))
+    if 'board' in request:
+        board = np.array(request['board'], dtype=np.uint8)
+        if board.ndim != 2 or not np.isin(board, (0, 1, 2)).all():
+            raise ValueError('board must be rows of 0, 1 and 2')
+        ones, twos = int(np.sum(board == 1)), int(np.sum(board == 2))
+        if ones - twos not in (0, 1):
+            raise ValueError('player 1 moves first, the board has {} and {} discs'
+                             .format(ones, twos))
+        state = BitBoard.from_array(board, connect)
+        if state.has_won(1) or state.has_won(2):
+            raise ValueError('the game is over')
+    else:
+        state = BitBoard(rows, cols, connect)
+        for i, col in enumerate(request.get('moves', '')):
+            col = int(col)
+            if not 0 <= col < cols or not state.can_play(col):
+                raise ValueError('move {} plays column {}, which is full or '
+                                 'off the board'.format(i, col))
+            state.play(col, i % 2 + 1)
+            if state.wins_at(col):
+                raise ValueError('the game is over after move {}'.format(i))
+        board = state.to_array()
+    if not state.possible_moves():
+        raise ValueError('the board is full')
+    return board, state.mask.bit_count() % 2 + 1
+
+
+class Engine:
+    """
+    Warm state every session of the server shares: the transposition
+    tables, the opening book and the solver's endgame tables. AIPlayer
+    values are seen from the player searching, so every board size has one
+    table for either player and one for the solver, whose values are seen
+    from the player to move.
+
+    Sessions search in threads. Entries of a TranspositionTable are replaced
+    whole, so sharing one is safe, but the searches take turns on the
+    interpreter: more sessions add no cpu, they keep the tables warm and
+    every request skips starting a process.
+
+    INPUTS:
+    tt_size_mb   - memory cap of every table
+    book         - path of an opening book, None for none
+    endgame      - path of the endgame table .npz of the 6x7 board, the
+                   tables of other boards go next to it, see endgame_file.
+                   Loaded on first use when they exist and saved by close()
+    solver_cells - see AIPlayer
+    weights      - path of an evaluation weights file, None for the built in
+                   weights
+    threats      - see AIPlayer
+    max_depth    - deepest search a request may ask for
+    max_time     - longest search a request may ask for
+    """
+    def __init__(self, tt_size_mb=TT_SIZE_MB, book=None, endgame=None,
+                 solver_cells=16, weights=None, threats=True,
+                 max_depth=MAX_DEPTH, max_time=MAX_TIME):
+        self.tt_size_mb = tt_size_mb
+        self.book_path = book
+        self.book = OpeningBook(book) if book is not None else None
+        self.endgame_path = endgame
+        self.solver_cells = solver_cells
+        self.weights = weights
+        self.threats = threats
+        self.max_depth = max_depth
+        self.max_time = max_time
+        # (name, rows, cols, connect) -> TranspositionTable
+        self.tables = {}
+        # (rows, cols, connect) -> EndgameTable
+        self.endgames = {}
+        # (rows, cols, connect) -> path the endgame table is saved to, None
+        # when it is not saved
+        self.endgame_files = {}
+        self.lock = threading.Lock()
+        self.sessions = 0
+        self.requests = 0
+        self.cancelled = 0
+
+    def table(self, name, rows, cols, connect):
+        # The shared table of name, made on first use
+        with self.lock:
+            key = (name, rows, cols, connect)
+            if key not in self.tables:
+                replacement = 'always' if name == 'solver' else 'depth'
+                self.tables[key] = TranspositionTable(self.tt_size_mb, replacement)
+            return self.tables[key]
+
+    def endgame_file(self, rows, cols, connect):
+        # The 6x7 table is at the endgame path, others at the path with
+        # '-ROWSxCOLSxCONNECT' added before the extension
+        if self.endgame_path is None or (rows, cols, connect) == (6, 7, CONNECT):
+            return self.endgame_path
+        root, ext = os.path.splitext(self.endgame_path)
+        return '{}-{}x{}x{}{}'.format(root, rows, cols, connect, ext)
+
+    def endgame(self, rows, cols, connect):
+        # The shared endgame table of the board, loaded on first use
+        with self.lock:
+            key = (rows, cols, connect)
+            if key not in self.endgames:
+                endgame = EndgameTable(rows=rows, cols=cols, connect=connect)
+                path = self.endgame_file(rows, cols, connect)
+                if path is not None and os.path.exists(path):
+                    try:
+                        endgame.load(path)
+                    except ValueError as e:
+                        # the file holds another board's endgames, it is
+                        # left as it is
+                        print('Endgame table not used: {}'.format(e))
+                        path = None
+                self.endgames[key] = endgame
+                self.endgame_files[key] = path
+            return self.endgames[key]
+
+    def player(self, number, rows, cols, connect):
+        # An AIPlayer searching with the shared tables and book
+        # the player's own table stays a single slot, it uses the engine's
+        player = AIPlayer(number, tt_size_mb=0, book=self.book_path,
+                          solver_cells=self.solver_cells, log_level='quiet',
+                          connect=connect, weights=self.weights,
+                          threats=self.threats)
+        player.tt = self.table('player {}'.format(number), rows, cols, connect)
+        player.book = self.book
+        player.solver = Solver(rows, cols, endgame=self.endgame(rows, cols, connect),
+                               connect=connect,
+                               tt=self.table('solver', rows, cols, connect))
+        return player
+
+    def limits(self, request):
+        """
+        The (time limit, depth) of a request, capped by the engine's. Only a
+        time limit searches as deep as time allows, neither searches to DEPTH.
+        """
+        time_limit = request.get('time')
+        depth = request.get('depth')
+        if time_limit is not None:
+            time_limit = min(float(time_limit), self.max_time)
+            if time_limit <= 0:
+                raise ValueError('time must be positive')
+        elif depth is None:
+            depth = DEPTH
+        if depth is not None:
+            depth = max(0, min(int(depth), self.max_depth))
+        return time_limit, depth
+
+    def stats(self):
+        with self.lock:
+            tables = {' '.join(str(part) for part in key):
+                      dict(table.stats(), used=table.used())
+                      for key, table in self.tables.items()}
+            endgames = {' '.join(str(part) for part in key): len(endgame)
+                        for key, endgame in self.endgames.items()}
+        return {'sessions': self.sessions,
+                'requests': self.requests,
+                'cancelled': self.cancelled,
+                'tables': tables,
+                'book': len(self.book) if self.book is not None else None,
+                'endgames': endgames}
+
+    def close(self):
+        for key, endgame in self.endgames.items():
+            if self.endgame_files[key] is not None:
+                endgame.save(self.endgame_files[key])
+        if self.book is not None:
+            self.book.close()
+
+
+class Session:
+    """
+    One client connection. Requests are JSON objects, one per line, with a
+    'cmd' and an optional 'id' the replies carry back:
+
+    go      - search the position of 'moves' or 'board', see
+              request_position, with optional 'mode' (one of MODES), 'time'
+              in seconds and 'depth'. With 'progress' true every finished
+              depth is sent as {'id', 'info': {'depth', 'move', 'score'}}.
+              Answered with {'id', 'move', 'score', 'depth', 'nodes',
+              'time', 'solved', 'cancelled'} once the search ends
+    stop    - ends the running search, which answers with its best move so
+              far and 'cancelled' true. Answered with {'id', 'stopped'}
+    newgame - forgets the move ordering history of the session
+    stats   - the engine's counters and tables
+    ping    - answered with {'id', 'pong': true}
+    quit    - closes the connection
+
+    A session runs one search at a time, the searches of different
+    sessions run at once. Errors are answered with {'id', 'error'}.
+    """
+    def __init__(self, engine, wfile):
+        self.engine = engine
+        self.wfile = wfile
+        # replies come from the reading thread and the search thread
+        self.write_lock = threading.Lock()
+        # (player number, rows, cols, connect) -> AIPlayer
+        self.players = {}
+        self.cancel_event = threading.Event()
+        self.thread = None
+        # cleared before the search replies, so the client may send the
+        # next go as soon as it has the answer
+        self.searching = False
+
+    def send(self, message):
+        line = json.dumps(message) + '\n'
+        with self.write_lock:
+            try:
+                self.wfile.write(line.encode())
+                self.wfile.flush()
+            except (OSError, ValueError):
+                # the client went away, its search still finishes
+                pass
+
+    def busy(self):
+        return self.searching
+
+    def handle(self, request):
+        """
+        Answers one request.
+
+        RETURNS:
+        False once the session should close
+        """
+        rid = request.get('id')
+        cmd = request.get('cmd')
+        if cmd == 'go':
+            if self.busy():
+                raise ValueError('a search is running, stop it first')
+            self.start(request)
+        elif cmd == 'stop':
+            busy = self.busy()
+            if busy:
+                self.cancel_event.set()
+            self.send({'id': rid, 'stopped': busy})
+        elif cmd == 'newgame':
+            if self.busy():
+                raise ValueError('a search is running, stop it first')
+            self.players = {}
+            self.send({'id': rid, 'ok': True})
+        elif cmd == 'stats':
+            self.send(dict(self.engine.stats(), id=rid))
+        elif cmd == 'ping':
+            self.send({'id': rid, 'pong': True})
+        elif cmd == 'quit':
+            return False
+        else:
+            raise ValueError('Unknown command {}'.format(cmd))
+        return True
+
+    def start(self, request):
+        # Checks a go request and starts its search thread
+        mode = request.get('mode', 'alpha_beta')
+        if mode not in MODES:
+            raise ValueError('Unknown mode {}'.format(mode))
+        board, number = request_position(request)
+        time_limit, depth = self.engine.limits(request)
+        rows, cols = board.shape
+        connect = int(request.get('connect', CONNECT))
+        key = (number, rows, cols, connect)
+        if key not in self.players:
+            self.players[key] = self.engine.player(number, rows, cols, connect)
+        player = self.players[key]
+        player.time_limit = time_limit
+        player.cancel_event = self.cancel_event
+        player.progress = None
+        rid = request.get('id')
+        if request.get('progress'):
+            player.progress = lambda depth, col, score: self.send(
+                {'id': rid, 'info': {'depth': depth, 'move': int(col),
+                                     'score': score_value(score)}})
+        self.cancel_event.clear()
+        self.searching = True
+        self.thread = threading.Thread(target=self.search,
+                                       args=(rid, player, board, mode, depth),
+                                       daemon=True)
+        self.thread.start()
+
+    def search(self, rid, player, board, mode, depth):
+        try:
+            move = player.iterative_deepening(board, mode, depth)
+        except Exception as e:
+            self.searching = False
+            self.send({'id': rid, 'error': repr(e)})
+            return
+        stats = player.stats
+        cancelled = self.cancel_event.is_set()
+        with self.engine.lock:
+            self.engine.requests += 1
+            self.engine.cancelled += cancelled
+        self.searching = False
+        self.send({'id': rid,
+                   'move': int(move),
+                   'score': score_value(stats.score),
+                   'depth': len(stats.iteration_nodes) - 1 if stats.iteration_nodes else None,
+                   'nodes': stats.nodes,
+                   'time': stats.time,
+                   'solved': stats.solved,
+                   'cancelled': cancelled})
+
+    def close(self):
+        # Ends the running search, its reply is still sent if it can be
+        self.cancel_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class EngineHandler(socketserver.StreamRequestHandler):
+    # Serves one connection as a Session
+
+    def handle(self):
+        engine = self.server.engine
+        session = Session(engine, self.wfile)
+        with engine.lock:
+            engine.sessions += 1
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                rid = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('requests are JSON objects')
+                    rid = request.get('id')
+                    if not session.handle(request):
+                        break
+                except Exception as e:
+                    session.send({'id': rid, 'error': str(e)})
+        finally:
+            session.close()
+            with engine.lock:
+                engine.sessions -= 1
+
+
+class EngineTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class EngineUnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(address, engine):
+    """
+    A server answering every connection to address with a Session of
+    engine, started with serve_forever().
+    """
+    family, addr = parse_address(address)
+    if family == socket.AF_UNIX:
+        # a socket file left behind by a server that did not shut down
+        if os.path.exists(addr) and stat.S_ISSOCK(os.stat(addr).st_mode):
+            os.unlink(addr)
+        server = EngineUnixServer(addr, EngineHandler)
+    else:
+        server = EngineTCPServer(addr, EngineHandler)
+    server.engine = engine
+    return server
+
+
+class EngineClient:
+    """
+    Connection to an engine server, see Session for the requests.
+    """
+    def __init__(self, address=ADDRESS, timeout=None):
+        family, addr = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(addr)
+        self.rfile = self.sock.makefile('rb')
+        self.next_id = 0
+
+    def send(self, cmd, **fields):
+        # Sends a request and returns its id
+        self.next_id += 1
+        fields.update(cmd=cmd, id=self.next_id)
+        self.sock.sendall((json.dumps(fields) + '\n').encode())
+        return self.next_id
+
+    def wait(self, rid):
+        # The reply to request rid, other replies and progress are dropped
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                raise ConnectionError('The engine server closed the connection')
+            reply = json.loads(line)
+            if reply.get('id') == rid and 'info' not in reply:
+                return reply
+
+    def request(self, cmd, **fields):
+        return self.wait(self.send(cmd, **fields))
+
+    def go(self, moves='', **fields):
+        """
+        The engine's move for the position after moves, fields may set the
+        limits, mode, or a board instead of moves.
+
+        RETURNS:
+        The reply dict, see Session
+        """
+        return self.request('go', moves=moves, **fields)
+
+    def close(self):
+        try:
+            self.send('quit')
+        except OSError:
+            pass
+        self.rfile.close()
+        self.sock.close()
+
+
+def random_moves(rng, max_plies=20, rows=6, cols=7, connect=CONNECT):
+    # Columns of a random game of up to max_plies moves nobody has won yet
+    state = BitBoard(rows, cols, connect)
+    moves = []
+    for ply in range(rng.randint(0, max_plies)):
+        player = ply % 2 + 1
+        options = []
+        for col in state.possible_moves():
+            state.play(col, player)
+            if not state.wins_at(col):
+                options.append(col)
+            state.undo()
+        if not options:
+            break
+        col = rng.choice(options)
+        state.play(col, player)
+        moves.append(col)
+    return moves
+
+
+def load_test(address=ADDRESS, clients=4, requests=25, depth=None, time_limit=None,
+              mode='alpha_beta', cancel_after=None, max_plies=20, seed=0):
+    """
+    Runs clients connections at once, every one sending requests go
+    requests for random positions one after the other, and times them from
+    sending to the reply.
+
+    INPUTS:
+    address      - the engine server
+    depth        - depth of every request, None leaves it to the server
+    time_limit   - time limit of every request, None for none
+    mode         - one of MODES
+    cancel_after - send stop this many seconds after every request, None
+                   lets every search finish
+    max_plies    - longest random game the positions come from
+    seed         - client i draws its positions with seed + i
+
+    RETURNS:
+    A dict with the latency percentiles, mean and max in seconds, the
+    requests per second and the counts of errors and cancelled searches
+    """
+    limits = {'mode': mode}
+    if depth is not None:
+        limits['depth'] = depth
+    if time_limit is not None:
+        limits['time'] = time_limit
+    latencies = []
+    errors = []
+    cancelled = [0]
+    lock = threading.Lock()
+
+    def run(i):
+        rng = random.Random(seed + i)
+        try:
+            client = EngineClient(address)
+        except OSError as e:
+            with lock:
+                errors.append(repr(e))
+            return
+        try:
+            for _ in range(requests):
+                moves = random_moves(rng, max_plies)
+                start = time.time()
+                rid = client.send('go', moves=moves, **limits)
+                if cancel_after is not None:
+                    time.sleep(cancel_after)
+                    client.send('stop')
+                reply = client.wait(rid)
+                latency = time.time() - start
+                with lock:
+                    if 'error' in reply:
+                        errors.append(reply['error'])
+                    else:
+                        latencies.append(latency)
+                        cancelled[0] += reply['cancelled']
+        except OSError as e:
+            with lock:
+                errors.append(repr(e))
+        finally:
+            client.close()
+
+    start = time.time()
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    result = {'clients': clients,
+              'requests': len(latencies),
+              'errors': len(errors),
+              'cancelled': cancelled[0],
+              'elapsed': elapsed,
+              'requests_per_sec': len(latencies) / elapsed if elapsed else 0}
+    if errors:
+        result['first_error'] = errors[0]
+    if latencies:
+        for p, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+            result['p{}'.format(p)] = float(value)
+        result['mean'] = float(np.mean(latencies))
+        result['max'] = float(np.max(latencies))
+    return result
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve = subparsers.add_parser('serve', help='Run the engine server')
+    serve.add_argument('--address', default=ADDRESS,
+                       help='HOST:PORT, or the path of a Unix socket')
+    serve.add_argument('--tt', type=float, default=TT_SIZE_MB,
+                       help='Memory cap of every shared table in MB')
+    serve.add_argument('--book', help='Opening book written by OpeningBook.py')
+    serve.add_argument('--endgame', help='Endgame table .npz of the 6x7 board, the '
+                       'tables of other boards are saved next to it on exit')
+    serve.add_argument('--solver-cells', type=int, default=16)
+    serve.add_argument('--weights', help='Evaluation weights file written by Tuner.py')
+    serve.add_argument('--no-threats', action='store_true',
+                       help='Search without the threat layer')
+    serve.add_argument('--max-depth', type=int, default=MAX_DEPTH)
+    serve.add_argument('--max-time', type=float, default=MAX_TIME)
+
+    query = subparsers.add_parser('query', help='Ask a running server for a move')
+    query.add_argument('moves', nargs='?', default='',
+                       help='Columns played from the empty board, e.g. 3324')
+    query.add_argument('--address', default=ADDRESS)
+    query.add_argument('--depth', type=int)
+    query.add_argument('--time', type=float)
+    query.add_argument('--mode', choices=MODES, default='alpha_beta')
+
+    load = subparsers.add_parser('loadtest', help='Time many requests at once')
+    load.add_argument('--address', default=ADDRESS)
+    load.add_argument('--clients', type=int, default=4,
+                      help='Connections sending requests at once')
+    load.add_argument('--requests', type=int, default=25,
+                      help='Requests every connection sends')
+    load.add_argument('--depth', type=int)
+    load.add_argument('--time', type=float)
+    load.add_argument('--mode', choices=MODES, default='alpha_beta')
+    load.add_argument('--cancel-after', type=float,
+                      help='Stop every search after this many seconds')
+    load.add_argument('--max-plies', type=int, default=20)
+    load.add_argument('--seed', type=int, default=0)
+    load.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        engine = Engine(args.tt, args.book, args.endgame, args.solver_cells,
+                        args.weights, not args.no_threats, args.max_depth,
+                        args.max_time)
+        server = make_server(args.address, engine)
+        print('Engine server listening on {}'.format(args.address))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            engine.close()
+            if parse_address(args.address)[0] == socket.AF_UNIX:
+                os.unlink(args.address)
+
+    elif args.command == 'query':
+        client = EngineClient(args.address)
+        fields = {'mode': args.mode}
+        if args.depth is not None:
+            fields['depth'] = args.depth
+        if args.time is not None:
+            fields['time'] = args.time
+        print(json.dumps(client.go(args.moves, **fields)))
+        client.close()
+
+    else:
+        result = load_test(args.address, args.clients, args.requests, args.depth,
+                           args.time, args.mode, args.cancel_after,
+                           args.max_plies, args.seed)
+        print('{clients} clients, {requests} requests in {elapsed:.2f}s, '
+              '{requests_per_sec:.1f} requests/s, {errors} errors, '
+              '{cancelled} cancelled'.format(**result))
+        if 'first_error' in result:
+            print('first error: {}'.format(result['first_error']))
+        if result['requests']:
+            print('latency ' + ', '.join('p{} {:.1f}ms'.format(p, result['p{}'.format(p)] * 1000)
+                                         for p in PERCENTILES)
+                  + ', mean {:.1f}ms, max {:.1f}ms'.format(result['mean'] * 1000,
+                                                          result['max'] * 1000))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(result, f, indent=2)
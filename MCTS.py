@@ -0,0 +1,450 @@
+# system libs
+import argparse
+import math
+import multiprocessing as mp
+import time
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from BitBoard import BitBoard, CONNECT
+from Player import LOG_LEVELS, TIME_FRACTION
+
+# Exploration constant of the selection rule
+EXPLORATION = 1.4
+# Random games played from every new leaf at once
+BATCH = 32
+# Search length when there is no time limit
+ITERATIONS = 400
+# Temperature of the softmax turning heuristic scores into PUCT priors
+PRIOR_TEMPERATURE = 10.0
+
+
+class Node:
+    """
+    One position of the search tree. wins and visits count the results of
+    the games played through the node for player, the one who made the move
+    leading to it.
+    """
+    __slots__ = ('move', 'player', 'key', 'parent', 'children', 'visits',
+                 'wins', 'prior', 'terminal')
+
+    def __init__(self, move, player, key, parent=None, prior=1.0):
+        self.move = move
+        self.player = player
+        self.key = key
+        self.parent = parent
+        # None until expanded, then a list of Nodes
+        self.children = None
+        self.visits = 0
+        self.wins = 0.0
+        self.prior = prior
+        # result for player once the game is over here: 1 won, 0.5 drawn
+        self.terminal = None
+
+
+class MCTSStats:
+    """
+    Counters of a single MCTS move, MCTSPlayer.stats holds the ones of the
+    last move. nodes counts the random games played so reports built for
+    AIPlayer read the same.
+    """
+    def __init__(self):
+        self.iterations = 0
+        self.nodes = 0
+        # visits the root had already when the move started, from tree reuse
+        self.reused = 0
+        self.time = 0
+        # share of the games won by the chosen move
+        self.score = None
+
+    def rollouts_per_sec(self):
+        return self.nodes / self.time if self.time else 0
+
+    def as_dict(self):
+        return {'iterations': self.iterations,
+                'rollouts': self.nodes,
+                'reused': self.reused,
+                'time': self.time,
+                'rollouts_per_sec': self.rollouts_per_sec(),
+                'score': self.score}
+
+
+def words_of(bits, words):
+    # A bit mask as uint64 words, lowest word first
+    return [(bits >> (64 * word)) & 0xFFFFFFFFFFFFFFFF for word in range(words)]
+
+
+def shift_down(masks, shift):
+    """
+    masks >> shift for (words, count) arrays of uint64 words holding one
+    mask per column, lowest word first. shift is below 64.
+    """
+    shifted = masks >> np.uint64(shift)
+    shifted[:-1] |= masks[1:] << np.uint64(64 - shift)
+    return shifted
+
+
+def batch_rollouts(state, player, count, rng):
+    """
+    Plays count random games from a BitBoard position at once. Every game is
+    a pair of bit masks laid out like BitBoard, held in as many uint64 words
+    as the board needs, so moves and the winning run check run on whole
+    numpy arrays whatever the board size.
+
+    INPUTS:
+    state  - the BitBoard, left unchanged
+    player - 1 or 2, the player to move
+    count  - number of games
+    rng    - numpy Generator picking the moves
+
+    RETURNS:
+    (games won by player, games drawn)
+    """
+    geometry = state.geometry
+    rows, cols = state.rows, state.cols
+    words = (cols * geometry.column_bits + 63) // 64
+    games = np.arange(count)
+    # bits[player - 1, word, game]
+    bits = np.array([words_of(state.bits[0], words), words_of(state.bits[1], words)],
+                    dtype=np.uint64)[:, :, None].repeat(count, axis=2)
+    heights = np.tile(np.array(state.heights, dtype=np.int64), (count, 1))
+    bottom = np.array(geometry.bottom_bits, dtype=np.int64)
+    shifts = [shift for shift, _ in geometry.directions]
+    active = np.ones(count, dtype=bool)
+    winner = np.zeros(count, dtype=np.int8)
+    mover = player - 1
+
+    for _ in range(rows * cols - state.mask.bit_count()):
+        # a random legal column for every game
+        col = (rng.random((count, cols)) * (heights < rows)).argmax(axis=1)
+        index = bottom[col] + heights[games, col]
+        playing = games[active]
+        bits[mover, index[playing] >> 6, playing] |= np.left_shift(
+            np.uint64(1), (index[playing] & 63).astype(np.uint64))
+        heights[games, col] += active
+
+        discs = bits[mover]
+        won = np.zeros(count, dtype=bool)
+        for shift in shifts:
+            # the starts of runs one disc longer every step
+            line = discs
+            for _ in range(1, state.connect):
+                line = discs & shift_down(line, shift)
+            won |= (line != 0).any(axis=0)
+        won &= active
+        winner[won] = mover + 1
+        active &= ~won
+        if not active.any():
+            break
+        mover = 1 - mover
+
+    return int(np.count_nonzero(winner == player)), int(np.count_nonzero(winner == 0))
+
+
+# The MCTSPlayer of a rollout worker process
+_worker_player = None
+
+
+def _init_worker(config):
+    global _worker_player
+    _worker_player = MCTSPlayer(**config)
+
+
+def _search_worker(board, deadline, iterations, seed):
+    # Grows the worker's own tree for the position and returns the root
+    # children as {col: (visits, wins)} and the games played
+    player = _worker_player
+    player.rng = np.random.default_rng(seed)
+    root = player.grow(BitBoard.from_array(board, player.connect), deadline, iterations)
+    return ({child.move: (child.visits, child.wins) for child in root.children or []},
+            player.stats.nodes)
+
+
+class MCTSPlayer:
+    """
+    Monte Carlo tree search player. Every iteration walks down the tree by
+    the selection rule, expands the leaf it reaches and plays a batch of
+    random games from it.
+
+    INPUTS:
+    player_number - 1 or 2
+    time_limit    - seconds allowed per move, None plays iterations
+    iterations    - iterations per move when there is no time limit
+    policy        - 'uct' or 'puct', PUCT weighs moves by heuristic priors
+    exploration   - exploration constant of the selection rule
+    batch         - random games played from every new leaf
+    workers       - processes growing their own trees whose root visits
+                    are added up, the pool is started on the first move
+    reuse         - keep the subtree of the position reached between moves
+    log_level     - one of Player.LOG_LEVELS
+    seed          - seed of the rollout moves
+    connect       - discs in a row that win
+    """
+    def __init__(self, player_number, time_limit=None, iterations=ITERATIONS,
+                 policy='uct', exploration=EXPLORATION, batch=BATCH,
+                 workers=1, reuse=True, log_level='moves', seed=None,
+                 connect=CONNECT):
+        if policy not in ('uct', 'puct'):
+            raise ValueError('Unknown policy {}'.format(policy))
+        if log_level not in LOG_LEVELS:
+            raise ValueError('Unknown log level {}'.format(log_level))
+        # what a worker process needs to build the same player
+        self.config = {'player_number': player_number,
+                       'policy': policy,
+                       'exploration': exploration,
+                       'batch': batch,
+                       'reuse': reuse,
+                       'log_level': 'quiet',
+                       'connect': connect}
+        self.player_number = player_number
+        self.type = 'mcts'
+        self.player_string = 'Player {}:mcts'.format(player_number)
+        self.time_limit = time_limit
+        self.iterations = iterations
+        self.policy = policy
+        self.exploration = exploration
+        self.batch = batch
+        self.workers = workers
+        self.reuse = reuse
+        self.connect = connect
+        self.log_moves = log_level != 'quiet'
+        self.rng = np.random.default_rng(seed)
+        self.root = None
+        self.pool = None
+        self.stats = MCTSStats()
+        # a multiprocessing Event, once set the running search stops
+        self.cancel_event = None
+
+    def __getstate__(self):
+        # The pool stays with the process that started it
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['root'] = None
+        state['cancel_event'] = None
+        return state
+
+    def start_workers(self):
+        # Starts the worker pool unless it is running already
+        if self.pool is None:
+            self.pool = mp.Pool(self.workers - 1, initializer=_init_worker,
+                                initargs=(self.config,))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def find_root(self, state):
+        """
+        The node of the last search tree holding state, which is at most
+        two moves below its root, or a new root.
+        """
+        if self.reuse and self.root is not None:
+            level = [self.root]
+            for _ in range(3):
+                for node in level:
+                    if node.key == state.key:
+                        node.parent = None
+                        return node
+                level = [child for node in level for child in node.children or []]
+        # the root holds the player who moved into it
+        return Node(None, 2 - state.mask.bit_count() % 2, state.key)
+
+    def expand(self, node, state):
+        # Adds a child for every move, finished games are marked terminal
+        mover = 3 - node.player
+        children = []
+        scores = []
+        for col in state.possible_moves():
+            state.play(col, mover)
+            child = Node(col, mover, state.key, node)
+            if state.wins_at(col):
+                child.terminal = 1.0
+            elif state.is_full():
+                child.terminal = 0.5
+            if self.policy == 'puct':
+                scores.append(state.scores[mover - 1] - state.scores[2 - mover])
+            state.undo()
+            children.append(child)
+        if self.policy == 'puct' and children:
+            # softmax of how much each move improves the mover's heuristic
+            top = max(scores)
+            weights = [math.exp((s - top) / PRIOR_TEMPERATURE) for s in scores]
+            total = sum(weights)
+            for child, weight in zip(children, weights):
+                child.prior = weight / total
+        node.children = children
+
+    def select(self, node):
+        # The child with the best selection score, unvisited ones first
+        log_visits = math.log(node.visits) if node.visits else 0
+        sqrt_visits = math.sqrt(node.visits)
+        best = None
+        best_score = float('-inf')
+        for child in node.children:
+            if child.terminal == 1.0:
+                # the mover takes a win whenever there is one
+                return child
+            if child.visits == 0:
+                score = float('inf') if self.policy == 'uct' else \
+                    self.exploration * child.prior * sqrt_visits
+            else:
+                value = child.wins / child.visits
+                if self.policy == 'uct':
+                    score = value + self.exploration * math.sqrt(log_visits / child.visits)
+                else:
+                    score = value + self.exploration * child.prior * sqrt_visits / (1 + child.visits)
+            if score > best_score:
+                best = child
+                best_score = score
+        return best
+
+    def iterate(self, root, state):
+        # One selection, expansion, rollout and backup step
+        node = root
+        played = 0
+        while node.children is not None and node.terminal is None:
+            node = self.select(node)
+            state.play(node.move, node.player)
+            played += 1
+        if node.terminal is None:
+            self.expand(node, state)
+            if node.children:
+                node = self.select(node)
+                state.play(node.move, node.player)
+                played += 1
+
+        if node.terminal is not None:
+            games = self.batch
+            # results for the player who moved into node
+            wins = node.terminal * games
+        else:
+            games = self.batch
+            to_move = 3 - node.player
+            opponent_wins, draws = batch_rollouts(state, to_move, games, self.rng)
+            wins = games - opponent_wins - draws + draws / 2
+            self.stats.nodes += games
+        for _ in range(played):
+            state.undo()
+
+        while node is not None:
+            node.visits += games
+            node.wins += wins
+            wins = games - wins
+            node = node.parent
+
+    def grow(self, state, deadline, iterations):
+        # Runs iterations on the tree holding state until the deadline or
+        # the iteration count, whichever comes first
+        self.stats = MCTSStats()
+        root = self.find_root(state)
+        self.stats.reused = root.visits
+        done = 0
+        while (deadline is None or time.time() < deadline) and \
+                (iterations is None or done < iterations):
+            self.iterate(root, state)
+            done += 1
+            if root.children is not None and not root.children:
+                break
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                break
+        self.stats.iterations = done
+        self.root = root
+        return root
+
+    def ponder(self, board, mode=None, replies=None):
+        """
+        Grows the tree of board, the position right after this player's
+        move, on the opponent's time until cancel_event is set. The next
+        get_move finds the opponent's reply one level below and keeps its
+        visits. Only the tree of this process is grown.
+
+        INPUTS:
+        board   - the numpy board after this player's move
+        mode    - unused, AIPlayer.ponder takes the search mode
+        replies - unused, the tree spreads its visits over all replies
+        """
+        if not self.reuse or self.cancel_event is None:
+            return
+        state = BitBoard.from_array(board, self.connect)
+        if state.has_won(self.player_number) or not state.possible_moves():
+            return
+        self.grow(state, None, None)
+
+    def get_move(self, board):
+        """
+        INPUTS:
+        board - the numpy board to move on, in the Game encoding
+
+        RETURNS:
+        The 0 based index of the column to play, the most visited move
+        """
+        start = time.time()
+        if self.log_moves:
+            print("Thinking...")
+        state = BitBoard.from_array(board, self.connect)
+        if not state.possible_moves():
+            raise Exception("The board is full, cannot move any longer")
+        deadline = None
+        iterations = self.iterations
+        if self.time_limit is not None:
+            deadline = start + self.time_limit * TIME_FRACTION
+            iterations = None
+
+        pending = None
+        if self.workers > 1:
+            self.start_workers()
+            seeds = self.rng.integers(2**32, size=self.workers - 1)
+            pending = [self.pool.apply_async(_search_worker,
+                                             (board, deadline, iterations, int(seed)))
+                       for seed in seeds]
+        root = self.grow(state, deadline, iterations)
+
+        # visits and wins of every move added up over all the trees
+        totals = {child.move: [child.visits, child.wins] for child in root.children}
+        for result in pending or []:
+            children, games = result.get()
+            self.stats.nodes += games
+            for col, (visits, wins) in children.items():
+                totals[col][0] += visits
+                totals[col][1] += wins
+
+        wins_now = [child.move for child in root.children if child.terminal == 1.0]
+        if wins_now:
+            move = wins_now[0]
+        else:
+            move = max(totals, key=lambda col: totals[col][0])
+        visits, wins = totals[move]
+        self.stats.score = wins / visits if visits else None
+        self.stats.time = time.time() - start
+        if self.log_moves:
+            print(f"Player {self.player_number} picked play at column: {move}")
+            print(f"MCTS: {self.stats.as_dict()}")
+        return move
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('moves', nargs='?', default='',
+                        help='Columns played from the empty board, e.g. 3324')
+    parser.add_argument('--time', type=float, default=1.0)
+    parser.add_argument('--policy', choices=['uct', 'puct'], default='uct')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--rows', type=int, default=6)
+    parser.add_argument('--cols', type=int, default=7)
+    parser.add_argument('--connect', type=int, default=CONNECT)
+    args = parser.parse_args()
+
+    state = BitBoard(args.rows, args.cols, args.connect)
+    for i, col in enumerate(args.moves):
+        state.play(int(col), i % 2 + 1)
+    player = MCTSPlayer(len(args.moves) % 2 + 1, time_limit=args.time,
+                        policy=args.policy, workers=args.workers,
+                        connect=args.connect)
+    try:
+        player.get_move(state.to_array())
+    finally:
+        player.close()
@@ -0,0 +1,192 @@
+# system libs
+import argparse
+import contextlib
+import mmap
+import multiprocessing as mp
+import os
+import struct
+
+# Local libs
+from BitBoard import BitBoard, CONNECT
+
+
+MAGIC = b'C4OB'
+VERSION = 1
+# magic, version, rows, cols, connect, number of entries
+HEADER = struct.Struct('<4sHBBBxI')
+# position key, score of the best move, best move
+ENTRY = struct.Struct('<Qhb')
+
+
+class OpeningBook:
+    """
+    Read only view of a book file written by write_book. The file is
+    memory-mapped, so opening it costs nothing and every process using the
+    same book shares its pages.
+
+    File layout: a HEADER followed by ENTRY records sorted by position key,
+    the Zobrist key kept by BitBoard. generate keeps one of every position
+    and its mirror image, under BitBoard.canonical, lookup finds either.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.rows, self.cols, self.connect, self.size = \
+            HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not an opening book'.format(path))
+
+    def close(self):
+        self.map.close()
+
+    def __len__(self):
+        return self.size
+
+    def entry(self, i):
+        return ENTRY.unpack_from(self.map, HEADER.size + i * ENTRY.size)
+
+    def lookup(self, state):
+        """
+        Binary search for the position of a BitBoard.
+
+        RETURNS:
+        (best move, score) or None when the position is not in the book
+        """
+        if (state.rows, state.cols, state.connect) != (self.rows, self.cols, self.connect):
+            return None
+        found = self.find(state.key)
+        if found is not None:
+            return found
+        # stored as its mirror image
+        found = self.find(state.mirror_key)
+        if found is not None:
+            move, score = found
+            return state.mirror_col(move), score
+        return None
+
+    def find(self, key):
+        # (best move, score) of the entry with key, None when there is none
+        low, high = 0, self.size
+        while low < high:
+            mid = (low + high) // 2
+            mid_key, score, move = self.entry(mid)
+            if mid_key < key:
+                low = mid + 1
+            elif mid_key > key:
+                high = mid
+            else:
+                return move, score
+        return None
+
+
+def write_book(path, entries, rows=6, cols=7, connect=CONNECT):
+    """
+    INPUTS:
+    path    - file to write
+    entries - dict of position key: (best move, score)
+    """
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, rows, cols, connect, len(entries)))
+        for key in sorted(entries):
+            move, score = entries[key]
+            score = max(-2**15, min(2**15 - 1, int(round(score))))
+            f.write(ENTRY.pack(key, score, move))
+
+
+def book_positions(plies, rows=6, cols=7, connect=CONNECT):
+    """
+    Every position reachable in at most plies moves where nobody has won yet.
+
+    Of a position and its mirror image only the one reached first is kept.
+
+    RETURNS:
+    dict of canonical position key: list of the columns played to reach it
+    """
+    positions = {}
+    state = BitBoard(rows, cols, connect)
+
+    def visit(moves):
+        key = state.canonical()[0]
+        if key in positions:
+            return
+        positions[key] = list(moves)
+        if len(moves) == plies:
+            return
+        player = len(moves) % 2 + 1
+        for col in state.possible_moves():
+            state.play(col, player)
+            if not state.wins_at(col):
+                visit(moves + [col])
+            state.undo()
+
+    visit([])
+    return positions
+
+
+def _search_position(task):
+    # Deep search of one book position in a pool process
+    from Player import AIPlayer
+    moves, depth, rows, cols, connect = task
+    state = BitBoard(rows, cols, connect)
+    for i, col in enumerate(moves):
+        state.play(col, i % 2 + 1)
+    player = AIPlayer(len(moves) % 2 + 1, depth=depth, connect=connect)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        move = player.get_alpha_beta_move(state.to_array())
+    key, mirrored = state.canonical()
+    if mirrored:
+        move = state.mirror_col(move)
+    return key, move, player.stats.score
+
+
+def generate(path, plies, depth, processes=None, rows=6, cols=7, connect=CONNECT):
+    """
+    Searches every position of the first plies moves to depth and writes the
+    best moves to a book at path.
+    """
+    positions = book_positions(plies, rows, cols, connect)
+    tasks = [(moves, depth, rows, cols, connect) for moves in positions.values()]
+    entries = {}
+    with mp.Pool(processes) as pool:
+        for done, (key, move, score) in enumerate(
+                pool.imap_unordered(_search_position, tasks, chunksize=4), 1):
+            entries[key] = (move, score)
+            if done % 100 == 0 or done == len(tasks):
+                print('{}/{} positions searched'.format(done, len(tasks)))
+    write_book(path, entries, rows, cols, connect)
+    return len(entries)
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    gen = subparsers.add_parser('generate', help='Build a book with deep searches')
+    gen.add_argument('path')
+    gen.add_argument('--plies', type=int, default=4,
+                     help='Book every position of the first PLIES moves')
+    gen.add_argument('--depth', type=int, default=8,
+                     help='Search depth used for every book position')
+    gen.add_argument('--processes', type=int, default=None)
+    gen.add_argument('--rows', type=int, default=6)
+    gen.add_argument('--cols', type=int, default=7)
+    gen.add_argument('--connect', type=int, default=CONNECT)
+
+    probe = subparsers.add_parser('probe', help='Look up a position')
+    probe.add_argument('path')
+    probe.add_argument('moves', nargs='?', default='',
+                       help='Columns played from the empty board, e.g. 3324')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        size = generate(args.path, args.plies, args.depth, args.processes,
+                        args.rows, args.cols, args.connect)
+        print('Wrote {} positions to {}'.format(size, args.path))
+    else:
+        book = OpeningBook(args.path)
+        state = BitBoard(book.rows, book.cols, book.connect)
+        for i, col in enumerate(args.moves):
+            state.play(int(col), i % 2 + 1)
+        print(book.lookup(state))
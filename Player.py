@@ -1,7 +1,253 @@
+import cProfile
+import json
 import numpy as np
+import multiprocessing as mp
 import random
 import time
 
+from BitBoard import BitBoard, CONNECT, RUN_WEIGHTS, batch_heuristic, run_score
+from OpeningBook import OpeningBook
+from Solver import Solver, SolveTimeout, EndgameTable
+from Threats import Threats, cell_columns, filter_moves, lost, playable, threat_cells, \
+    threat_masks
+from Transposition import TranspositionTable, EXACT, LOWER, UPPER
+
+# Mixed into the key of chance node entries so expectimax values never get
+# mistaken for alpha-beta values of the same position
+EXPECTIMAX_KEY = 0x9E3779B97F4A7C15
+# The same for expectimax values averaged over sampled replies only
+SAMPLED_KEY = 0x6A09E667F3BCC909
+
+# Share of the time limit the search may use, the rest covers starting the
+# worker process and sending the move back
+TIME_FRACTION = 0.8
+# How many nodes are searched between two looks at the clock
+CLOCK_INTERVAL = 1024
+# Share of the move's time the exact solver may take before the heuristic
+# search gets the rest
+SOLVER_FRACTION = 0.5
+
+
+# Move ordering heuristics AIPlayer can combine
+ORDERINGS = ('tt', 'killer', 'history', 'center')
+
+# Replies of the random player an expectimax chance node averages over once
+# the full width search would not finish in time
+EXP_SAMPLES = 3
+
+# What AIPlayer prints: 'quiet' nothing, 'moves' one summary per move,
+# 'nodes' also every won position the search runs into, which is slow
+LOG_LEVELS = ('quiet', 'moves', 'nodes')
+
+# How much the opponent's heuristic counts against the player's own, 1 is
+# the balanced evaluation
+DEFENSE = 1
+
+
+def move_to_front(buffer, front, count, col):
+    """
+    Moves col, when it is among buffer[front:count], to buffer[front] and
+    shifts the columns in between up by one.
+
+    RETURNS:
+    The index after the columns moved to the front so far
+    """
+    for j in range(front, count):
+        if buffer[j] == col:
+            while j > front:
+                buffer[j] = buffer[j - 1]
+                j -= 1
+            buffer[front] = col
+            return front + 1
+    return front
+
+
+def valid_weights(runs, defense):
+    # The weights Tuner searches over, a run closer to a win is worth more
+    two_short, one_short, win = runs
+    return 0 < two_short <= one_short <= win and defense > 0
+
+
+def load_weights(path):
+    """
+    Reads an evaluation weights file written by save_weights, ValueError
+    unless they are valid_weights.
+
+    RETURNS:
+    (run weights, defense, connect), see BitBoard.run_score and DEFENSE
+    """
+    with open(path) as f:
+        data = json.load(f)
+    runs = tuple(data['runs'])
+    if len(runs) != 3:
+        raise ValueError('{} needs three run weights'.format(path))
+    defense = data.get('defense', DEFENSE)
+    if not valid_weights(runs, defense):
+        raise ValueError('{} needs run weights 0 < two short <= one short <= win '
+                         'and a positive defense, not {} and {}'
+                         .format(path, list(runs), defense))
+    return runs, defense, data.get('connect', CONNECT)
+
+
+def save_weights(path, runs, defense=DEFENSE, connect=CONNECT, **info):
+    # Writes evaluation weights AIPlayer can load, info is kept alongside
+    data = {'runs': list(runs), 'defense': defense, 'connect': connect}
+    data.update(info)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.write('\n')
+
+
+class SearchTimeout(Exception):
+    # Raised inside the search once the deadline has passed
+    pass
+
+
+class AlphaRaised(Exception):
+    # Raised inside a root search worker once another worker has found a
+    # better root value than the alpha its move is searched with
+    pass
+
+
+# The AIPlayer and shared alpha of a root search worker process
+_worker_player = None
+_worker_alpha = None
+
+
+def _init_worker(config, shared_alpha):
+    # Each pool process keeps its own AIPlayer, and so its own warm
+    # transposition table, for as long as the pool lives
+    global _worker_player, _worker_alpha
+    _worker_player = AIPlayer(**config)
+    _worker_alpha = shared_alpha
+
+
+def _search_worker(board, col, depth, mode, deadline, samples, search_id):
+    # Searches one root move in a pool process. Returns (col, value, alpha
+    # the move was searched with, SearchStats), value is None on timeout
+    player = _worker_player
+    alpha = _worker_alpha.value
+    state = BitBoard.from_array(board, player.connect, player.weights)
+    # the search state is reset once per move of the parent, every task
+    # only starts its own counters
+    if player.search_id != search_id:
+        player.prepare_search(state)
+        player.search_id = search_id
+    else:
+        player.reset_stats(state)
+    player.root_depth = depth + 1
+    player.deadline = deadline
+    player.interruptible = True
+    player.samples = samples
+    player.pool_alpha = _worker_alpha
+    if samples is not None:
+        player.sample_rng.seed(state.key ^ depth)
+    try:
+        while True:
+            player.root_alpha = alpha
+            try:
+                value = player.child_value(state, col, depth, mode, alpha)
+                break
+            except AlphaRaised:
+                # search again with the better bound, the table keeps what
+                # the interrupted search found
+                alpha = _worker_alpha.value
+    except SearchTimeout:
+        return col, None, alpha, player.finish_stats()
+    finally:
+        player.deadline = None
+        player.interruptible = False
+        player.samples = None
+        player.pool_alpha = None
+
+    # Raise the bound the other workers start their moves with. Only exact
+    # values may do that, a value at or below alpha is just a bound
+    if value > alpha:
+        with _worker_alpha.get_lock():
+            if value > _worker_alpha.value:
+                _worker_alpha.value = value
+    return col, value, alpha, player.finish_stats()
+
+
+class SearchStats:
+    """
+    Counters of a single move search, AIPlayer.stats holds the ones of the
+    last move.
+    """
+    def __init__(self, max_plies=0):
+        self.nodes = 0
+        # nodes visited at every ply below the root, the root's moves are
+        # ply 1
+        self.ply_nodes = [0] * (max_plies + 2)
+        # positions scored by the evaluation function
+        self.eval_calls = 0
+        self.cutoffs = 0
+        # cutoffs caused by the first move tried, the share of these tells
+        # how good the move ordering is
+        self.first_move_cutoffs = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        # nodes visited by each completed depth of iterative deepening and
+        # the seconds each took
+        self.iteration_nodes = []
+        self.iteration_times = []
+        # seconds the whole move took
+        self.time = 0
+        # value of the chosen move at the last completed depth
+        self.score = None
+        # true when the move was found by the exact solver, score is then
+        # the solver score instead of a heuristic value
+        self.solved = False
+        # deepest iteration pondering finished on this position, None when
+        # the opponent's reply was not pondered
+        self.pondered = None
+
+    def branching_factor(self):
+        # Growth of the tree between the last two completed depths
+        if len(self.iteration_nodes) < 2 or self.iteration_nodes[-2] == 0:
+            return None
+        return self.iteration_nodes[-1] / self.iteration_nodes[-2]
+
+    def max_depth(self):
+        # Deepest ply the search reached
+        plies = [ply for ply, nodes in enumerate(self.ply_nodes) if nodes]
+        return plies[-1] if plies else 0
+
+    def nodes_per_sec(self):
+        return self.nodes / self.time if self.time else 0
+
+    def merge(self, other):
+        # Adds the counters of a root search worker's stats
+        self.nodes += other.nodes
+        if len(other.ply_nodes) > len(self.ply_nodes):
+            self.ply_nodes += [0] * (len(other.ply_nodes) - len(self.ply_nodes))
+        for ply, nodes in enumerate(other.ply_nodes):
+            self.ply_nodes[ply] += nodes
+        self.eval_calls += other.eval_calls
+        self.cutoffs += other.cutoffs
+        self.first_move_cutoffs += other.first_move_cutoffs
+        self.tt_probes += other.tt_probes
+        self.tt_hits += other.tt_hits
+
+    def as_dict(self):
+        return {'nodes': self.nodes,
+                'ply_nodes': self.ply_nodes[:self.max_depth() + 1],
+                'max_depth': self.max_depth(),
+                'eval_calls': self.eval_calls,
+                'cutoffs': self.cutoffs,
+                'first_move_cutoffs': self.first_move_cutoffs,
+                'tt_probes': self.tt_probes,
+                'tt_hits': self.tt_hits,
+                'iteration_nodes': list(self.iteration_nodes),
+                'iteration_times': list(self.iteration_times),
+                'branching_factor': self.branching_factor(),
+                'time': self.time,
+                'nodes_per_sec': self.nodes_per_sec(),
+                'score': self.score,
+                'pondered': self.pondered,
+                'solved': self.solved}
+
+
 class Board(np.ndarray):
     """
     A new board class that allows us to have nice methods into important
@@ -15,12 +261,18 @@ class Board(np.ndarray):
             - spaces that are unoccupied are marked as 0
             - spaces that are occupied by player 1 have a 1 in them
             - spaces that are occupied by player 2 have a 2 in them
+    connect - discs in a row that win
     """
 
-    def __new__(cls, a):
+    def __new__(cls, a, connect=CONNECT):
         obj = np.asarray(a).view(cls)
+        obj.connect = connect
         return obj
 
+    def __array_finalize__(self, obj):
+        # views and slices keep the connect length of the board they come from
+        self.connect = getattr(obj, 'connect', CONNECT)
+
     def owner_at(self, row, col):
         # Given the encoding above
         if self[row][col] == 0:
@@ -70,12 +322,8 @@ class Board(np.ndarray):
         over = False
 
         for size in connected_components:
-            if size == 2:
-                score += 1
-            elif size == 3:
-                score += 10
-            elif size >= 4:
-                score += 100
+            score += run_score(size, self.connect)
+            if size >= self.connect:
                 over = True
         return score, over
 
@@ -88,7 +336,7 @@ class Board(np.ndarray):
 
         diagonals = []
         for i in range(offset, largest_side):
-            if len(np.diagonal(self, i)) >= 4:
+            if len(np.diagonal(self, i)) >= self.connect:
                 diagonals.append(np.diagonal(self, i))
                 diagonals.append(np.diagonal(np.fliplr(self), i))
         return diagonals
@@ -129,7 +377,7 @@ class Board(np.ndarray):
     def play(self, row, col, player):
         # play a disc at the specified row, col
         play_board = np.copy(self)
-        state = Board(play_board)
+        state = Board(play_board, self.connect)
         if state.owner_at(row, col) is None:
             state[row][col] = player
             return state
@@ -137,11 +385,235 @@ class Board(np.ndarray):
             raise Exception("Attempting to play at occupied space")
 
 class AIPlayer:
-    def __init__(self, player_number):
+    """
+    INPUTS:
+    player_number  - 1 or 2
+    time_limit     - seconds allowed per move, the search deepens one ply at
+                     a time until it runs out. None searches to depth
+    depth          - search depth used when there is no time limit
+    tt_size_mb     - memory cap of the transposition table
+    tt_replacement - replacement policy of the transposition table
+    batch_leaves   - score the children of the last searched ply with one
+                     numpy batch call instead of one at a time
+    ordering       - move ordering heuristics to use, any of ORDERINGS:
+                     'tt' tries the transposition table move first,
+                     'killer' the moves that last caused a cutoff at the
+                     same ply, 'history' the moves that caused the most
+                     cutoffs so far and 'center' the central columns.
+                     An empty sequence searches columns left to right
+    workers        - number of processes the root moves are split across,
+                     the pool is started on the first move and kept
+    book           - path of an opening book written by OpeningBook.py,
+                     alpha-beta moves found there are played without search
+    solver_cells   - alpha-beta positions with at most this many empty cells
+                     are solved exactly, None never does. With a time limit
+                     it shrinks every time the solver runs out of time
+    endgame        - path of an endgame table .npz for the solver, loaded
+                     when it exists and saved by close()
+    log_level      - one of LOG_LEVELS
+    profile        - path the cProfile stats of every search so far are
+                     written to after each move, None does not profile.
+                     Root search workers are not profiled
+    exp_samples    - with a time limit, expectimax depths that would not
+                     finish in time average each chance node over this many
+                     sampled replies, None always searches every reply
+    connect        - discs in a row that win, the board size is taken from
+                     the boards handed to the search
+    weights        - path of an evaluation weights file, see save_weights,
+                     None keeps the built in weights
+    threats        - let the alpha-beta search look at the threats of every
+                     node first: only a winning move or the forced block is
+                     searched and moves handing the opponent a win are
+                     skipped, see Threats.moves
+    symmetry       - store a position and its mirror image as one
+                     transposition table entry
+    """
+    def __init__(self, player_number, time_limit=None, depth=5,
+                 tt_size_mb=16, tt_replacement='depth', batch_leaves=False,
+                 ordering=ORDERINGS, workers=1, book=None, solver_cells=16,
+                 endgame=None, log_level='moves', profile=None,
+                 exp_samples=EXP_SAMPLES, connect=CONNECT, weights=None,
+                 threats=True, symmetry=True):
+        # what a root search worker needs to build the same player
+        self.config = {'player_number': player_number,
+                       'depth': depth,
+                       'tt_size_mb': tt_size_mb,
+                       'tt_replacement': tt_replacement,
+                       'batch_leaves': batch_leaves,
+                       'ordering': ordering,
+                       'log_level': log_level,
+                       'connect': connect,
+                       'weights': weights,
+                       'threats': threats,
+                       'symmetry': symmetry}
         self.player_number = player_number
         self.type = 'ai'
         self.player_string = 'Player {}:ai'.format(player_number)
+        self.time_limit = time_limit
+        self.depth = depth
+        # shared by the alpha-beta and the expectimax search
+        self.tt = TranspositionTable(tt_size_mb, tt_replacement)
+        self.batch_leaves = batch_leaves
+        for name in ordering:
+            if name not in ORDERINGS:
+                raise ValueError('Unknown move ordering {}'.format(name))
+        self.ordering = tuple(ordering)
+        self.deadline = None
+        # a multiprocessing Event, once set the running search returns its
+        # best move so far just as when the deadline passes
+        self.cancel_event = None
+        # false while the search must finish no matter what, like depth 0
+        self.interruptible = False
+        # in a root search worker the pool's best root value so far and the
+        # alpha the running move is searched with, see _search_worker
+        self.pool_alpha = None
+        self.root_alpha = float('-inf')
+        # counts the move searches, root search workers prepare once for
+        # every one
+        self.search_id = 0
+        self.stats = SearchStats()
+        # depth of the running iteration, ply of a node is root_depth - depth
+        self.root_depth = 0
+        self.killers = []
+        # one buffer of columns per ply, the moves of a node are ordered and
+        # filtered in place there instead of in new lists
+        self.move_buffers = []
+        # history[player - 1][bit index] grows with every cutoff there
+        self.history = [[], []]
+        self.workers = workers
+        self.pool = None
+        self.shared_alpha = None
+        self.book_path = book
+        self.book = None
+        self.solver_cells = solver_cells
+        self.endgame_path = endgame
+        # false while the solver's endgames are not the ones of the file
+        self.save_endgame = False
+        self.solver = None
+        if log_level not in LOG_LEVELS:
+            raise ValueError('Unknown log level {}'.format(log_level))
+        self.log_moves = log_level != 'quiet'
+        # checked before any printing in the search itself
+        self.log_nodes = log_level == 'nodes'
+        self.profile = profile
+        self.profiler = None
+        # transposition table counters when the running search started
+        self.tt_marks = (0, 0)
+        self.exp_samples = exp_samples
+        self.connect = connect
+        self.threats = threats
+        self.symmetry = symmetry
+        # run weights of the heuristic and the weight of the opponent's score
+        self.weights = RUN_WEIGHTS
+        self.defense = DEFENSE
+        if weights is not None:
+            self.weights, self.defense, weights_connect = load_weights(weights)
+            if weights_connect != connect:
+                raise ValueError('{} holds weights for connect {}, not {}'.format(
+                    weights, weights_connect, connect))
+        # replies a chance node samples in the running iteration, None for all
+        self.samples = None
+        self.sample_rng = random.Random()
+        # called with (depth, column, score) after every finished depth,
+        # lets a GUI show the search while it runs
+        self.progress = None
+        # key -> deepest finished iteration of the positions the last
+        # ponder searched
+        self.pondered = {}
+
+    def __getstate__(self):
+        # The pool stays with the process that started it
+        state = self.__dict__.copy()
+        state['pool'] = None
+        state['shared_alpha'] = None
+        state['cancel_event'] = None
+        # the memory map is opened again where it is needed
+        state['book'] = None
+        state['solver'] = None
+        state['profiler'] = None
+        state['progress'] = None
+        return state
+
+    def book_move(self, state):
+        # The book move for state if the opening book has one
+        if self.book_path is None:
+            return None
+        if self.book is None:
+            self.book = OpeningBook(self.book_path)
+        found = self.book.lookup(state)
+        if found is None or not 0 <= found[0] < state.cols or not state.can_play(found[0]):
+            return None
+        self.stats.score = found[1]
+        return found[0]
 
+    def solver_move(self, state, start):
+        """
+        The exact solver's move for state when it is close enough to the end
+        of the game, None when it is not or the solver ran out of time.
+        """
+        empty = state.rows * state.cols - state.mask.bit_count()
+        if self.solver_cells is None or empty > self.solver_cells:
+            return None
+        # the solver tells the player to move from the number of discs
+        if state.mask.bit_count() % 2 + 1 != self.player_number:
+            return None
+        geometry = (state.rows, state.cols, state.connect)
+        if self.solver is not None and \
+                (self.solver.rows, self.solver.cols, self.solver.connect) != geometry:
+            # a board of another size or connect length needs its own solver,
+            # the endgames solved so far are kept first
+            if self.save_endgame:
+                self.solver.endgame.save(self.endgame_path)
+            self.solver = None
+        if self.solver is None:
+            endgame = EndgameTable(rows=state.rows, cols=state.cols,
+                                   connect=state.connect)
+            self.save_endgame = self.endgame_path is not None
+            if self.endgame_path is not None:
+                try:
+                    endgame.load(self.endgame_path)
+                except FileNotFoundError:
+                    pass
+                except ValueError as e:
+                    # the file holds the endgames of another board, it is
+                    # left as it is
+                    self.save_endgame = False
+                    if self.log_moves:
+                        print(f"Endgame table not used: {e}")
+            self.solver = Solver(state.rows, state.cols,
+                                 self.config['tt_size_mb'], endgame, state.connect)
+        deadline = None
+        if self.time_limit is not None:
+            deadline = start + self.time_limit * TIME_FRACTION * SOLVER_FRACTION
+        try:
+            col, score = self.solver.best_move(state, deadline, self.cancel_event)
+        except SolveTimeout:
+            # stopped by cancel_event the position may still be solved in
+            # time, else try again a move later, with one empty cell less
+            if self.cancel_event is None or not self.cancel_event.is_set():
+                self.solver_cells = empty - 1
+            return None
+        self.stats.score = score
+        self.stats.solved = True
+        return col
+
+    def start_workers(self):
+        # Starts the root search pool unless it is running already
+        if self.pool is None:
+            self.shared_alpha = mp.Value('d', float('-inf'))
+            self.pool = mp.Pool(self.workers, initializer=_init_worker,
+                                initargs=(self.config, self.shared_alpha))
+
+    def close(self):
+        # Stops the root search worker processes and keeps the endgames
+        # solved so far
+        if self.solver is not None and self.save_endgame:
+            self.solver.endgame.save(self.endgame_path)
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.shared_alpha = None
 
     def opponent(self, player):
         if player == 1:
@@ -170,6 +642,7 @@ class AIPlayer:
         The utility value for the current board
         """
         #state = Board(board)
+        self.stats.eval_calls += 1
         player = self.player_number
         opponent = self.opponent(player)
 
@@ -177,7 +650,22 @@ class AIPlayer:
         loss_opponent, opponent_won = board.connected_heuristic(opponent)
         # print(f"Player {player} loss: {loss_player}")
         # print(f"Opponent {opponent} loss: {loss_opponent}")
+        loss = self.combine_losses(loss_player, loss_opponent)
 
+        if opponent_won:
+            if self.log_nodes:
+                print(f"I am {player}, opponent won, utility is {loss}")
+            return loss, opponent #f"Winner is opponent: {opponent}"
+        if player_won:
+            if self.log_nodes:
+                print(f"I am {player}, I won and utility is {loss}")
+            return loss, player #f"Winner is player: {player}"
+
+        return loss, None
+
+    def combine_losses(self, loss_player, loss_opponent):
+        # Works on single scores as well as numpy arrays of them
+        player = self.player_number
         dynamic = False
 
         if dynamic:
@@ -195,98 +683,526 @@ class AIPlayer:
             defensive = False
 
         if balanced:
-            loss = loss_player - loss_opponent
+            loss = loss_player - loss_opponent * self.defense
         elif offensive:
             loss = loss_player - (loss_opponent / 2)# encourage offensive play
         elif defensive:
             loss = loss_player - (loss_opponent * 2)# encourage defensive play
+        return loss
 
-        if opponent_won:
-            print(f"I am {player}, opponent won, utility is {loss}")
-            return loss, opponent #f"Winner is opponent: {opponent}"
-        if player_won:
-            print(f"I am {player}, I won and utility is {loss}")
-            return loss, player #f"Winner is player: {player}"
+    def leaf_values(self, state, moves, player):
+        """
+        Utility of every position reached by player dropping a disc in one
+        of moves, scored together by the numpy batch evaluator. These are the
+        values evaluation_function gives the children at depth 0.
+        """
+        pairs = [state.child_bits(col, player) for col in moves]
+        scores, _ = batch_heuristic(pairs, state.rows, state.cols, state.connect,
+                                    state.geometry.weights)
+        me = self.player_number - 1
+        self.stats.nodes += len(moves)
+        self.stats.eval_calls += len(moves)
+        # only called one ply above the leaves
+        self.stats.ply_nodes[self.root_depth] += len(moves)
+        return self.combine_losses(scores[:, me], scores[:, 1 - me]).tolist()
+
+    def check_time(self, depth):
+        self.stats.nodes += 1
+        self.stats.ply_nodes[self.root_depth - depth] += 1
+        if self.interruptible and self.stats.nodes % CLOCK_INTERVAL == 0:
+            if self.deadline is not None and time.time() > self.deadline:
+                raise SearchTimeout()
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                raise SearchTimeout()
+            if self.pool_alpha is not None and self.pool_alpha.value > self.root_alpha:
+                raise AlphaRaised()
+
+    def order_moves(self, state, moves, depth, player, tt_move):
+        """
+        Puts moves in the order they should be searched, the ones most
+        likely to cause a cutoff first.
+        """
+        ordering = self.ordering
+        if not ordering:
+            return moves
+        if 'center' in ordering:
+            # moves are the legal moves of state, already sorted there
+            moves = state.center_moves()
+        if 'history' in ordering:
+            history = self.history[player - 1]
+            bottom_bits = state.geometry.bottom_bits
+            heights = state.heights
+            moves = sorted(moves,
+                           key=lambda col: -history[bottom_bits[col] + heights[col]])
+        first = []
+        if 'tt' in ordering and tt_move in moves:
+            first.append(tt_move)
+        if 'killer' in ordering:
+            for col in self.killers[self.root_depth - depth]:
+                if col in moves and col not in first:
+                    first.append(col)
+        if first:
+            moves = first + [col for col in moves if col not in first]
+        return moves
+
+    def node_moves(self, state, depth, player, tt_move, masks=None):
+        """
+        order_moves and the threat layer for a node of min_value and
+        max_value, done in the move buffer of the node's ply so no list is
+        built: the columns are copied there, sorted by history in place and
+        the tt move and killers are moved to the front. masks are the
+        node's threat_masks when already known.
 
-        return loss, None
+        RETURNS:
+        (buffer, number of moves at its start)
+        """
+        buffer = self.move_buffers[self.root_depth - depth]
+        ordering = self.ordering
+        if 'center' in ordering:
+            moves = state.center_moves()
+        else:
+            moves = state.possible_moves()
+        count = 0
+        for col in moves:
+            buffer[count] = col
+            count += 1
+        if 'history' in ordering:
+            history = self.history[player - 1]
+            bottom_bits = state.geometry.bottom_bits
+            heights = state.heights
+            # insertion sort, stable like sorted
+            for i in range(1, count):
+                col = buffer[i]
+                score = history[bottom_bits[col] + heights[col]]
+                j = i
+                while j and history[bottom_bits[buffer[j - 1]]
+                                    + heights[buffer[j - 1]]] < score:
+                    buffer[j] = buffer[j - 1]
+                    j -= 1
+                buffer[j] = col
+        front = 0
+        if 'tt' in ordering and tt_move is not None:
+            front = move_to_front(buffer, front, count, tt_move)
+        if 'killer' in ordering:
+            for col in self.killers[self.root_depth - depth]:
+                if col is not None:
+                    front = move_to_front(buffer, front, count, col)
+        if self.threats and depth > 1:
+            count = filter_moves(state, player, buffer, count, masks)
+        return buffer, count
+
+    def cutoff(self, state, col, index, depth, player):
+        # Bookkeeping when col, the index-th move tried, cut the node off
+        self.stats.cutoffs += 1
+        if index == 0:
+            self.stats.first_move_cutoffs += 1
+        killers = self.killers[self.root_depth - depth]
+        if col != killers[0] and col != killers[1]:
+            killers[1] = killers[0]
+            killers[0] = col
+        bit = state.geometry.bottom_bits[col] + state.heights[col]
+        self.history[player - 1][bit] += depth * depth
 
     def min_value(self, state, alpha, beta, depth):
+        self.check_time(depth)
         utility, winner = self.evaluation_function(state)
         if winner:
-            print(f"Min call - player {winner} will win at state:")
-            print(state)
+            if self.log_nodes:
+                print(f"Min call - player {winner} will win at state:")
+                print(state)
             return utility
         if depth == 0:
             #print("Depth is 0")
             return utility
+        if state.is_full():
+            # a draw, no moves left to search
+            return utility
+
+        alpha_start, beta_start = alpha, beta
+        tt_move = None
+        key, mirrored = self.table_key(state)
+        entry = self.tt.probe(key)
+        if entry is not None:
+            tt_move = entry[3]
+            if mirrored and tt_move is not None:
+                tt_move = state.mirror_col(tt_move)
+        if entry is not None and entry[0] >= depth:
+            _, stored, flag, _ = entry
+            if flag == EXACT:
+                return stored
+            elif flag == LOWER:
+                alpha = max(alpha, stored)
+            else:
+                beta = min(beta, stored)
+            if alpha >= beta:
+                return stored
+
+        opponent = self.opponent(self.player_number)
+        masks = None
+        if self.threats and depth > 1:
+            masks = threat_masks(state, opponent)
+            forced = self.forced_value(state, depth, opponent, masks)
+            if forced is not None:
+                return self.store_forced(state, key, mirrored, depth, forced)
 
         value = float('inf')
-        for row, col in state.possible_moves():
-            new_state = state.play(row, col, self.opponent(self.player_number))
-            value = min(value, self.max_value(new_state, alpha, beta, depth-1))
+        best_col = None
+        moves, count = self.node_moves(state, depth, opponent, tt_move, masks)
+        leaves = None
+        if depth == 1 and self.batch_leaves and count:
+            leaves = self.leaf_values(state, moves[:count], opponent)
+        for i in range(count):
+            col = moves[i]
+            if leaves is not None:
+                child = leaves[i]
+            else:
+                state.play(col, opponent)
+                child = self.max_value(state, alpha, beta, depth-1)
+                state.undo()
+            if child < value:
+                value = child
+                best_col = col
             # pruning
             if value <= alpha:
-                return value
+                self.cutoff(state, col, i, depth, opponent)
+                break
             beta = min(beta, value)
 
+        if mirrored and best_col is not None:
+            best_col = state.mirror_col(best_col)
+        self.store(key, depth, value, alpha_start, beta_start, best_col)
         return value
 
     def max_value(self, state, alpha, beta, depth):
+        self.check_time(depth)
         utility, winner = self.evaluation_function(state)
         if winner:
-            print(f"Max call - player {winner} will win at state:")
-            print(state)
+            if self.log_nodes:
+                print(f"Max call - player {winner} will win at state:")
+                print(state)
             return utility
         if depth == 0:
             #print("Depth is 0")
             return utility
+        if state.is_full():
+            # a draw, no moves left to search
+            return utility
+
+        alpha_start, beta_start = alpha, beta
+        tt_move = None
+        key, mirrored = self.table_key(state)
+        entry = self.tt.probe(key)
+        if entry is not None:
+            tt_move = entry[3]
+            if mirrored and tt_move is not None:
+                tt_move = state.mirror_col(tt_move)
+        if entry is not None and entry[0] >= depth:
+            _, stored, flag, _ = entry
+            if flag == EXACT:
+                return stored
+            elif flag == LOWER:
+                alpha = max(alpha, stored)
+            else:
+                beta = min(beta, stored)
+            if alpha >= beta:
+                return stored
+
+        masks = None
+        if self.threats and depth > 1:
+            masks = threat_masks(state, self.player_number)
+            forced = self.forced_value(state, depth, self.player_number, masks)
+            if forced is not None:
+                return self.store_forced(state, key, mirrored, depth, forced)
 
         value = float('-inf')
-        for row, col in state.possible_moves():
-            new_state = state.play(row, col, self.player_number)
-            value = max(value, self.min_value(new_state, alpha, beta, depth-1))
+        best_col = None
+        moves, count = self.node_moves(state, depth, self.player_number, tt_move, masks)
+        leaves = None
+        if depth == 1 and self.batch_leaves and count:
+            leaves = self.leaf_values(state, moves[:count], self.player_number)
+        for i in range(count):
+            col = moves[i]
+            if leaves is not None:
+                child = leaves[i]
+            else:
+                state.play(col, self.player_number)
+                child = self.min_value(state, alpha, beta, depth-1)
+                state.undo()
+            if child > value:
+                value = child
+                best_col = col
             # prunning
             if value >= beta:
-                return value
+                self.cutoff(state, col, i, depth, self.player_number)
+                break
             alpha = max(alpha, value)
 
+        if mirrored and best_col is not None:
+            best_col = state.mirror_col(best_col)
+        self.store(key, depth, value, alpha_start, beta_start, best_col)
         return value
 
-    def max_exp_val(self, state, depth):
+    def forced_value(self, state, depth, player, masks):
+        """
+        Value of a node the threats settle without searching its moves, with
+        player to move: player wins at once, or loses whatever it plays as
+        Threats.lost tells. Won positions get the value the search would give
+        them, their evaluation, and each side picks the best for it. Both
+        need depth > 1, the opponent's win comes two plies down. masks are
+        the node's threat_masks.
+
+        RETURNS:
+        (value, column player plays), None when the node is not settled
+        """
+        free, threats, opponent_threats = masks
+        wins = threats & free
+        if wins:
+            return self.win_value(state, wins, depth, player)
+        blocks = opponent_threats & free
+        if not lost(wins, blocks, opponent_threats):
+            return None
+        opponent = self.opponent(player)
+        maximize = player == self.player_number
+        best = None
+        for col in cell_columns(state, blocks):
+            state.play(col, player)
+            value, _ = self.win_value(state, threat_cells(state, opponent) & playable(state),
+                                      depth - 1, opponent)
+            state.undo()
+            if best is None or (value > best[0] if maximize else value < best[0]):
+                best = (value, col)
+        return best
+
+    def win_value(self, state, wins, depth, player):
+        """
+        Best value for player of dropping a disc in one of the playable cells
+        of wins, every one of them winning, depth being the node's.
+
+        RETURNS:
+        (value, column)
+        """
+        maximize = player == self.player_number
+        best = None
+        for col in cell_columns(state, wins):
+            state.play(col, player)
+            self.stats.nodes += 1
+            self.stats.ply_nodes[self.root_depth - depth + 1] += 1
+            value, _ = self.evaluation_function(state)
+            state.undo()
+            if best is None or (value > best[0] if maximize else value < best[0]):
+                best = (value, col)
+        return best
+
+    def store_forced(self, state, key, mirrored, depth, forced):
+        # Stores the exact value forced_value found and returns it
+        value, best_col = forced
+        if mirrored:
+            best_col = state.mirror_col(best_col)
+        self.tt.store(key, depth, value, EXACT, best_col)
+        return value
+
+    def table_key(self, state):
+        # Key the transposition table keeps state under and whether its
+        # moves are stored mirrored
+        if self.symmetry:
+            return state.canonical()
+        return state.key, False
+
+    def store(self, key, depth, value, alpha, beta, best_col):
+        # Records value with the bound it represents given the window the
+        # node was searched with
+        if value <= alpha:
+            flag = UPPER
+        elif value >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.tt.store(key, depth, value, flag, best_col)
+
+    def value_bounds(self, state, depth, my_turn):
+        """
+        Lowest and highest value a search depth plies deep can return. A
+        player's heuristic score never drops while nobody has won, and each
+        of their discs adds at most the geometry's quiet_gain, or win_gain
+        for the last one when it wins.
+        """
+        geometry = state.geometry
+        mine = (depth + my_turn) // 2
+        theirs = depth - mine
+
+        def gain(discs):
+            if discs == 0:
+                return 0
+            return geometry.win_gain + (discs - 1) * geometry.quiet_gain
+
+        me = self.player_number - 1
+        score, opponent_score = state.scores[me], state.scores[1 - me]
+        return (self.combine_losses(score, opponent_score + gain(theirs)),
+                self.combine_losses(score + gain(mine), opponent_score))
+
+    def max_exp_val(self, state, depth, alpha=float('-inf'), beta=float('inf')):
+        self.check_time(depth)
         utility, winner = self.evaluation_function(state)
         if winner:
-            print(f"Max exp call - player {winner} will win at state:")
-            print(state)
+            if self.log_nodes:
+                print(f"Max exp call - player {winner} will win at state:")
+                print(state)
             return utility
         if depth == 0:
             #print("Depth is 0")
             return utility
+        if state.is_full():
+            # a draw, no moves left to search
+            return utility
+
+        alpha_start, beta_start = alpha, beta
+        key, mirrored = self.table_key(state)
+        key ^= EXPECTIMAX_KEY if self.samples is None else SAMPLED_KEY
+        tt_move = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            tt_move = entry[3]
+            if mirrored and tt_move is not None:
+                tt_move = state.mirror_col(tt_move)
+        if entry is not None and entry[0] >= depth:
+            _, stored, flag, _ = entry
+            if flag == EXACT:
+                return stored
+            elif flag == LOWER:
+                alpha = max(alpha, stored)
+            else:
+                beta = min(beta, stored)
+            if alpha >= beta:
+                return stored
 
         v = float('-inf')
-        for row, col in state.possible_moves():
-            new_state = state.play(row, col, self.player_number)
-            v = max(v, self.exp_value(new_state, depth-1))
+        best_col = None
+        moves = state.possible_moves()
+        if tt_move in moves:
+            # a good first value makes the chance nodes after it prune more
+            moves = [tt_move] + [col for col in moves if col != tt_move]
+        leaves = None
+        if depth == 1 and self.batch_leaves and moves:
+            leaves = self.leaf_values(state, moves, self.player_number)
+        for i, col in enumerate(moves):
+            if leaves is not None:
+                child = leaves[i]
+            else:
+                state.play(col, self.player_number)
+                child = self.exp_value(state, depth-1, max(alpha, v), beta)
+                state.undo()
+            if child > v:
+                v = child
+                best_col = col
+            if v >= beta:
+                break
+
+        if mirrored and best_col is not None:
+            best_col = state.mirror_col(best_col)
+        self.store(key, depth, v, alpha_start, beta_start, best_col)
         return v
 
-    def exp_value(self, state, depth):
+    def exp_value(self, state, depth, alpha=float('-inf'), beta=float('inf')):
+        """
+        Chance node of the random opponent. Its value is the average of the
+        replies, so once the replies searched so far and bounds on the rest
+        settle which side of the window the average falls on the node
+        returns early (Star1). The bounds come from value_bounds and the
+        transposition table entries of the replies, which alone can already
+        decide the node (Star2 with the table as the probe).
+        """
+        self.check_time(depth)
         utility, winner = self.evaluation_function(state)
         if winner:
-            print(f"Exp value call - player {winner} will win at state:")
-            print(state)
+            if self.log_nodes:
+                print(f"Exp value call - player {winner} will win at state:")
+                print(state)
             return utility
         if depth == 0:
             #print("Depth is 0")
             return utility
+        if state.is_full():
+            # a draw, no moves left to search
+            return utility
 
-        v = 0
-        count = 0
-        for row, col in state.possible_moves():
-            new_state = state.play(row, col, self.opponent(self.player_number))
-            v += self.max_exp_val(new_state, depth-1)
-            count += 1
-
-        return v / count
+        # chance nodes are memoized the same way
+        salt = EXPECTIMAX_KEY if self.samples is None else SAMPLED_KEY
+        key = self.table_key(state)[0] ^ salt
+        alpha_start, beta_start = alpha, beta
+        entry = self.tt.probe(key)
+        if entry is not None and entry[0] >= depth:
+            _, stored, flag, _ = entry
+            if flag == EXACT:
+                return stored
+            elif flag == LOWER:
+                alpha = max(alpha, stored)
+            else:
+                beta = min(beta, stored)
+            if alpha >= beta:
+                return stored
+
+        opponent = self.opponent(self.player_number)
+        moves = state.possible_moves()
+        if self.samples is not None and len(moves) > self.samples:
+            moves = self.sample_rng.sample(moves, self.samples)
+        count = len(moves)
+        if depth == 1 and self.batch_leaves and moves:
+            v = sum(self.leaf_values(state, moves, opponent)) / count
+            self.store(key, depth, v, alpha_start, beta_start, None)
+            return v
+
+        # bounds on every reply's value, tightened by what the table knows
+        low, high = self.value_bounds(state, depth, False)
+        lows = [low] * count
+        highs = [high] * count
+        zobrist = state.geometry.zobrist[opponent - 1]
+        mirror_zobrist = state.geometry.mirror_zobrist[opponent - 1]
+        bottom_bits = state.geometry.bottom_bits
+        for i, col in enumerate(moves):
+            index = bottom_bits[col] + state.heights[col]
+            child_key = state.key ^ zobrist[index]
+            if self.symmetry:
+                child_key = min(child_key, state.mirror_key ^ mirror_zobrist[index])
+            child = self.tt.probe(child_key ^ salt)
+            if child is not None and child[0] >= depth - 1:
+                if child[2] != UPPER:
+                    lows[i] = max(low, child[1])
+                if child[2] != LOWER:
+                    highs[i] = min(high, child[1])
 
+        total = 0
+        rest_low = sum(lows)
+        rest_high = sum(highs)
+        v = None
+        for i, col in enumerate(moves):
+            rest_low -= lows[i]
+            rest_high -= highs[i]
+            if (total + lows[i] + rest_low) / count >= beta:
+                v = beta
+                break
+            if (total + highs[i] + rest_high) / count <= alpha:
+                v = alpha
+                break
+            # the window this reply must leave for the average to matter
+            child_alpha = alpha * count - total - rest_high
+            child_beta = beta * count - total - rest_low
+            state.play(col, opponent)
+            child = self.max_exp_val(state, depth-1, child_alpha, child_beta)
+            state.undo()
+            total += child
+            # kept on the window's edge so rounding never turns the bound
+            # into something that looks exact
+            if child <= child_alpha:
+                v = min(alpha, (total + rest_high) / count)
+                break
+            if child >= child_beta:
+                v = max(beta, (total + rest_low) / count)
+                break
+        if v is None:
+            v = total / count
+
+        self.store(key, depth, v, alpha_start, beta_start, None)
+        return v
 
     def get_alpha_beta_move(self, board):
         """
@@ -308,34 +1224,7 @@ class AIPlayer:
         RETURNS:
         The 0 based index of the column that represents the next move
         """
-        start = time.time()
-        print("Thinking...")
-        state = Board(board)
-        if len(state.possible_moves()) == 0:
-            raise Exception("The board is full, cannot move any longer")
-
-        alpha = float('-inf')
-        beta  = float('inf')
-        depth = 5
-        best_val = float('-inf')
-        # random col thats avail
-        best_col = random.choice(state.possible_moves())[1]
-        best_row = 0
-
-        for row, col in state.possible_moves():
-            new_state = state.play(row, col, self.player_number)
-            state_value = self.min_value(new_state, alpha, beta, depth)
-            if state_value > best_val:
-                # print(f"Player {self.player_number} found good play at {col}")
-                best_val = state_value
-                best_col = col
-                best_row = row
-
-        print(f"Player {self.player_number} picked play at column: {best_col}")
-        end = time.time()
-        print(f"Time to exectue at depth {depth}: {end - start}s")
-        return best_col
-        raise NotImplementedError('Whoops I don\'t know what to do')
+        return self.run_search(board, 'alpha_beta')
 
     def get_expectimax_move(self, board):
         """
@@ -355,34 +1244,334 @@ class AIPlayer:
                 - spaces that are occupied by player 1 have a 1 in them
                 - spaces that are occupied by player 2 have a 2 in them
 
+        RETURNS:
+        The 0 based index of the column that represents the next move
+        """
+        return self.run_search(board, 'expectimax')
+
+    def run_search(self, board, mode):
+        # Searches a move, under cProfile when a profile path was given
+        if self.profile is None:
+            return self.iterative_deepening(board, mode)
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        try:
+            return self.iterative_deepening(board, mode)
+        finally:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile)
+
+    def prepare_search(self, state):
+        # Resets the per move search state
+        self.search_id += 1
+        self.tt.new_search()
+        self.reset_stats(state)
+        # killers are per ply of this search, history fades between moves
+        total_bits = state.cols * state.geometry.column_bits
+        plies = state.rows * state.cols + 2
+        if len(self.move_buffers) != plies or len(self.move_buffers[0]) != state.cols:
+            self.move_buffers = [[0] * state.cols for _ in range(plies)]
+            # the two latest cutoff moves of every ply, newest first
+            self.killers = [[None, None] for _ in range(plies)]
+        for killers in self.killers:
+            killers[0] = killers[1] = None
+        for player in range(2):
+            if len(self.history[player]) != total_bits:
+                self.history[player] = [0] * total_bits
+            else:
+                self.history[player] = [h // 2 for h in self.history[player]]
+
+    def reset_stats(self, state):
+        # Starts the counters of a search from zero
+        self.tt_marks = (self.tt.hits, self.tt.misses + self.tt.collisions)
+        self.stats = SearchStats(state.rows * state.cols)
+
+    def finish_stats(self):
+        # Adds the transposition table counters of the search, root search
+        # workers have added theirs already
+        hits, misses = self.tt_marks
+        self.stats.tt_hits += self.tt.hits - hits
+        self.stats.tt_probes += (self.tt.hits - hits + self.tt.misses
+                                 + self.tt.collisions - misses)
+        return self.stats
+
+    def child_value(self, state, col, depth, mode, alpha=float('-inf')):
+        # Value of playing col, searched depth plies further
+        state.play(col, self.player_number)
+        try:
+            if mode == 'alpha_beta':
+                return self.min_value(state, alpha, float('inf'), depth)
+            return self.exp_value(state, depth, alpha)
+        finally:
+            state.undo()
+
+    def iterative_deepening(self, board, mode, max_depth=None, prepared=False):
+        """
+        Searches every move at depth 0, 1, 2... keeping the best move of the
+        last fully searched depth. Once the time limit is close the running
+        depth is abandoned. Without a time limit it stops at self.depth.
+
+        INPUTS:
+        board     - the numpy board to move on
+        mode      - 'alpha_beta' or 'expectimax'
+        max_depth - deepest iteration, overrides the limit above
+        prepared  - the caller ran prepare_search already, as ponder does
+                    once for all of its searches, only the stats are reset
+
         RETURNS:
         The 0 based index of the column that represents the next move
         """
         start = time.time()
-        print("Thinking...")
-        state = Board(board)
-        if len(state.possible_moves()) == 0:
+        if self.log_moves:
+            print("Thinking...")
+        # the search makes and unmakes moves on a single bitboard
+        state = BitBoard.from_array(board, self.connect, self.weights)
+        moves = state.possible_moves()
+        if len(moves) == 0:
             raise Exception("The board is full, cannot move any longer")
-
-        depth = 5
-        best_val = float('-inf')
+        if prepared:
+            self.reset_stats(state)
+        else:
+            self.prepare_search(state)
+        self.stats.pondered = self.pondered.get(state.key)
+
+        if mode == 'alpha_beta':
+            move = self.book_move(state)
+            if move is not None:
+                self.stats.time = time.time() - start
+                if self.log_moves:
+                    print(f"Player {self.player_number} played book move: {move}")
+                return move
+            move = self.solver_move(state, start)
+            if move is not None:
+                self.stats.nodes = self.solver.nodes
+                self.stats.time = time.time() - start
+                if self.log_moves:
+                    print(f"Player {self.player_number} solved play at column: {move}")
+                    print(f"Solver: score {self.stats.score}, {self.solver.nodes} nodes")
+                return move
+
+        # no point searching past a full board
+        full_depth = state.rows * state.cols - int(np.count_nonzero(board)) - 1
+        if max_depth is None:
+            max_depth = self.depth if self.time_limit is None else full_depth
+        max_depth = min(max_depth, full_depth)
+        if mode == 'alpha_beta' and self.threats:
+            moves = Threats(state, self.player_number).moves(moves)
+            # a win or the only move that does not lose needs no comparing
+            if len(moves) == 1:
+                max_depth = 0
+        deadline = None
+        if self.time_limit is not None:
+            deadline = start + self.time_limit * TIME_FRACTION
         # random col thats avail
-        best_col = random.choice(state.possible_moves())[1]
-        best_row = 0
+        best_col = random.choice(moves)
+        completed = None
+
+        try:
+            for depth in range(max_depth + 1):
+                # depth 0 always finishes, so there is always a searched move
+                if depth > 0:
+                    self.deadline = deadline
+                    self.interruptible = True
+
+                # the best move of the previous depth is searched first
+                self.root_depth = depth + 1
+                ordered = self.order_moves(state, moves, self.root_depth,
+                                           self.player_number,
+                                           best_col if completed is not None else None)
+                # ordering starts from all legal moves, keep the ones left
+                if len(moves) < len(ordered):
+                    ordered = [col for col in ordered if col in moves]
+                if completed is not None and best_col not in ordered[:1]:
+                    ordered = [best_col] + [c for c in ordered if c != best_col]
+                nodes_before = self.stats.nodes
+                iteration_start = time.time()
+                if mode == 'expectimax' and self.samples is None:
+                    self.samples = self.sample_replies(depth, deadline)
+
+                if self.workers > 1 and depth > 0:
+                    best_col, score = self.parallel_root(board, ordered, depth,
+                                                         mode, self.deadline)
+                else:
+                    best_col, score = self.serial_root(state, ordered, depth, mode)
+                completed = depth
+                self.stats.score = score
+                self.stats.iteration_nodes.append(self.stats.nodes - nodes_before)
+                self.stats.iteration_times.append(time.time() - iteration_start)
+                if self.progress is not None:
+                    self.progress(depth, best_col, score)
+        except SearchTimeout:
+            pass
+        finally:
+            self.deadline = None
+            self.interruptible = False
+            self.samples = None
+
+        self.finish_stats()
+        self.stats.time = time.time() - start
+        if self.log_moves:
+            print(f"Player {self.player_number} picked play at column: {best_col}")
+            print(f"Time to exectue at depth {completed}: {self.stats.time}s")
+            print(f"Transposition table: {self.tt.stats()}")
+            print(f"Search: {self.stats.as_dict()}")
+        return best_col
 
-        for row, col in state.possible_moves():
-            new_state = state.play(row, col, self.player_number)
-            state_value = self.exp_value(new_state, depth)
+    def ponder(self, board, mode='alpha_beta', replies=None):
+        """
+        Searches on the opponent's time until cancel_event is set. board is
+        the position right after this player's move, the positions after the
+        opponent's replies are searched just as a real move would be, so the
+        next real search finds its early iterations and best moves in the
+        transposition table.
+
+        With the expected reply only the best reply of the last search is
+        pondered, as deep as the time allows. With all replies every reply
+        is searched one depth deeper in turn, best reply first.
+
+        INPUTS:
+        board   - the numpy board after this player's move
+        mode    - 'alpha_beta' or 'expectimax'
+        replies - 'expected' or 'all', None picks the expected reply against
+                  alpha-beta and all of them against a random player
+
+        RETURNS:
+        self.pondered, the deepest finished iteration of every pondered
+        position
+        """
+        if replies is None:
+            replies = 'expected' if mode == 'alpha_beta' else 'all'
+        if replies not in ('expected', 'all'):
+            raise ValueError('Unknown ponder replies {}'.format(replies))
+        if self.cancel_event is None:
+            raise ValueError('Pondering stops on cancel_event, it must be set')
+        self.pondered = {}
+        state = BitBoard.from_array(board, self.connect, self.weights)
+        opponent = self.opponent(self.player_number)
+        if state.has_won(self.player_number):
+            return self.pondered
+
+        # the reply our own search expected comes first
+        self.prepare_search(state)
+        key, mirrored = self.table_key(state)
+        entry = self.tt.probe(key)
+        tt_move = entry[3] if entry is not None else None
+        if mirrored and tt_move is not None:
+            tt_move = state.mirror_col(tt_move)
+        children = []
+        for col in self.order_moves(state, state.possible_moves(), 1,
+                                    opponent, tt_move):
+            state.play(col, opponent)
+            # nothing to search after a reply that ends the game
+            if not state.wins_at(col) and state.possible_moves():
+                child = board.copy()
+                row = int(np.count_nonzero(child[:, col] == 0)) - 1
+                child[row, col] = opponent
+                children.append((state.key, child))
+            state.undo()
+        if replies == 'expected':
+            children = children[:1]
+        if not children:
+            return self.pondered
+
+        # pondering has neither a time limit nor the exact solver, which
+        # could not be cancelled
+        saved = (self.time_limit, self.solver_cells, self.log_moves,
+                 self.progress, self.workers)
+        self.time_limit = None
+        self.solver_cells = None
+        self.log_moves = False
+        self.progress = None
+        # the root workers keep their own tables, only ours is reused
+        self.workers = 1
+        empty = board.size - int(np.count_nonzero(board))
+        try:
+            # the expected reply goes as deep as the board allows right away
+            depths = [empty] if replies == 'expected' else range(1, empty)
+            for depth in depths:
+                for key, child in children:
+                    if self.pondered.get(key, -1) >= depth:
+                        continue
+                    self.iterative_deepening(child, mode, depth, prepared=True)
+                    self.pondered[key] = len(self.stats.iteration_nodes) - 1
+                    if self.cancel_event.is_set():
+                        return self.pondered
+        finally:
+            (self.time_limit, self.solver_cells, self.log_moves,
+             self.progress, self.workers) = saved
+        return self.pondered
+
+    def sample_replies(self, depth, deadline):
+        """
+        How many replies expectimax chance nodes should sample at depth,
+        None for all of them. Sampling starts once the growth of the last
+        iterations says the full width search would miss the deadline.
+        """
+        if self.exp_samples is None or deadline is None or depth < 2:
+            return None
+        growth = self.stats.branching_factor() or 0
+        remaining = deadline - time.time()
+        if self.stats.iteration_times[-1] * growth <= remaining:
+            return None
+        self.sample_rng.seed(self.stats.nodes)
+        return self.exp_samples
+
+    def serial_root(self, state, ordered, depth, mode):
+        # Best of the root moves searched one after the other, and its value
+        best_val = float('-inf')
+        best_col = ordered[0]
+        for col in ordered:
+            state_value = self.child_value(state, col, depth, mode, best_val)
             if state_value > best_val:
                 best_val = state_value
                 best_col = col
-                best_row = row
+        return best_col, best_val
 
-        print(f"Player {self.player_number} picked play at column: {best_col}")
-        end = time.time()
-        print(f"Time to exectue at depth {depth}: {end - start}s")
-        return best_col
-        raise NotImplementedError('Whoops I don\'t know what to do')
+    def parallel_root(self, board, ordered, depth, mode, deadline):
+        """
+        Young Brothers Wait at the root: the first move is searched alone to
+        get a bound, then the remaining moves are spread over the pool. The
+        workers share the best exact value found so far as the alpha they
+        start their move with.
+        """
+        self.start_workers()
+        self.shared_alpha.value = float('-inf')
+
+        def collect(pending):
+            results = []
+            for result in pending:
+                timeout = None
+                if deadline is not None:
+                    timeout = max(0, deadline - time.time()) + 1
+                try:
+                    col, value, alpha, stats = result.get(timeout)
+                except mp.TimeoutError:
+                    raise SearchTimeout()
+                self.stats.merge(stats)
+                if value is None:
+                    raise SearchTimeout()
+                results.append((col, value, alpha))
+            return results
+
+        task = (board, ordered[0], depth, mode, deadline, self.samples,
+                self.search_id)
+        results = collect([self.pool.apply_async(_search_worker, task)])
+        results += collect([self.pool.apply_async(_search_worker,
+                                                  (board, col, depth, mode,
+                                                   deadline, self.samples,
+                                                   self.search_id))
+                            for col in ordered[1:]])
+
+        # values at or below the alpha they were searched with are only
+        # upper bounds, never better than the exact value that set alpha
+        best_val = float('-inf')
+        best_col = ordered[0]
+        for col, value, alpha in results:
+            if value > alpha and value > best_val:
+                best_val = value
+                best_col = col
+        return best_col, best_val
 
 class RandomPlayer:
     def __init__(self, player_number):
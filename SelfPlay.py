@@ -0,0 +1,274 @@
+# system libs
+import argparse
+import contextlib
+import glob
+import multiprocessing as mp
+import os
+import random
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from BitBoard import BitBoard, CONNECT
+from Tournament import make_player
+
+
+# Positions kept in memory before they are written out as one shard
+SHARD_SIZE = 10000
+# Moves played at random at the start of every game, so games differ
+RANDOM_PLIES = 4
+# Arrays of every shard, one entry per searched position:
+# boards   - the board in the Game encoding, row 0 at the top
+# to_move  - number of the player who moved from the position
+# values   - value of the best move from the view of to_move
+# solved   - values found by the exact solver instead of the heuristic
+# moves    - the column the search picked
+# outcomes - end of the game for to_move, 1 win, 0 draw, -1 loss
+# games    - index of the game the position was played in
+FIELDS = ('boards', 'to_move', 'values', 'solved', 'moves', 'outcomes', 'games')
+
+
+def play_record_game(player1, player2, random_plies=RANDOM_PLIES,
+                     rows=6, cols=7, connect=CONNECT, rng=None):
+    """
+    Plays one headless alpha-beta game and keeps every searched position.
+
+    INPUTS:
+    player1, player2 - AIPlayers, player1 moves first
+    random_plies     - moves played at random before the players search
+    rows, cols       - board size
+    connect          - discs in a row that win
+    rng              - random.Random for the opening moves
+
+    RETURNS:
+    A dict with FIELDS as keys and numpy arrays as values, games is 0
+    """
+    rng = rng or random.Random()
+    players = [player1, player2]
+    board = np.zeros([rows, cols]).astype(np.uint8)
+    state = BitBoard(rows, cols, connect)
+    boards, to_move, values, solved, moves = [], [], [], [], []
+    winner = 0
+    turn = 0
+
+    while state.possible_moves():
+        player = players[turn]
+        if state.mask.bit_count() < random_plies:
+            move = rng.choice(state.possible_moves())
+        else:
+            boards.append(board.copy())
+            move = int(player.get_alpha_beta_move(board))
+            to_move.append(player.player_number)
+            score = player.stats.score
+            values.append(np.nan if score is None else score)
+            solved.append(player.stats.solved)
+            moves.append(move)
+
+        board[rows - 1 - state.heights[move], move] = player.player_number
+        state.play(move, player.player_number)
+        if state.wins_at(move):
+            winner = player.player_number
+            break
+        turn = 1 - turn
+
+    to_move = np.array(to_move, dtype=np.uint8)
+    outcomes = np.zeros(len(to_move), dtype=np.int8)
+    if winner:
+        outcomes[:] = np.where(to_move == winner, 1, -1)
+    return {'boards': np.array(boards, dtype=np.uint8).reshape(-1, rows, cols),
+            'to_move': to_move,
+            'values': np.array(values, dtype=np.float32),
+            'solved': np.array(solved, dtype=bool),
+            'moves': np.array(moves, dtype=np.int8),
+            'outcomes': outcomes,
+            'games': np.zeros(len(to_move), dtype=np.int32)}
+
+
+def _selfplay_task(task):
+    # One recorded game in a pool process, the search chatter is dropped
+    game, spec1, spec2, seed, random_plies, rows, cols, connect = task
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        players = [make_player(spec1, 1, connect), make_player(spec2, 2, connect)]
+        try:
+            record = play_record_game(*players, random_plies, rows, cols,
+                                      connect, random.Random(seed))
+        finally:
+            for player in players:
+                player.close()
+    record['games'][:] = game
+    return record
+
+
+class ShardWriter:
+    """
+    Collects position records and writes them to compressed .npz shards of
+    shard_size positions, so no more than one shard is held in memory.
+    Shards are named shard-00000.npz, shard-00001.npz... in directory.
+    """
+    def __init__(self, directory, shard_size=SHARD_SIZE, rows=6, cols=7,
+                 connect=CONNECT):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_size = shard_size
+        self.geometry = np.array([rows, cols, connect], dtype=np.int16)
+        self.buffer = {field: [] for field in FIELDS}
+        self.buffered = 0
+        self.shards = len(glob.glob(os.path.join(directory, 'shard-*.npz')))
+        self.positions = 0
+
+    def add(self, record):
+        # Appends the arrays of a play_record_game record
+        for field in FIELDS:
+            self.buffer[field].append(record[field])
+        self.buffered += len(record['moves'])
+        while self.buffered >= self.shard_size:
+            self.flush(self.shard_size)
+
+    def flush(self, count=None):
+        # Writes the first count buffered positions, all of them by default
+        if self.buffered == 0:
+            return
+        count = self.buffered if count is None else count
+        arrays = {field: np.concatenate(self.buffer[field]) for field in FIELDS}
+        path = os.path.join(self.directory, 'shard-{:05d}.npz'.format(self.shards))
+        np.savez_compressed(path, geometry=self.geometry,
+                            **{field: array[:count] for field, array in arrays.items()})
+        self.buffer = {field: [array[count:]] for field, array in arrays.items()}
+        self.buffered -= count
+        self.shards += 1
+        self.positions += count
+
+    def close(self):
+        self.flush()
+
+
+def generate(directory, spec1, spec2, games, shard_size=SHARD_SIZE,
+             processes=None, seed=0, random_plies=RANDOM_PLIES,
+             rows=6, cols=7, connect=CONNECT):
+    """
+    Plays games between two ai specs across a pool of processes and streams
+    their positions into shards in directory as the games finish.
+
+    INPUTS:
+    directory    - where the shards go, new shards follow existing ones
+    spec1, spec2 - ai player specs, see Tournament.make_player
+    games        - number of games to play
+    shard_size   - positions per shard
+    processes    - pool size, defaults to the number of cpus
+    seed         - base seed, game i uses seed + i
+    random_plies - moves played at random at the start of every game
+
+    RETURNS:
+    The number of positions written
+    """
+    for spec in (spec1, spec2):
+        if spec.partition(':')[0] != 'ai':
+            raise ValueError('Self-play records ai players, not {}'.format(spec))
+    tasks = [(game, spec1, spec2, seed + game, random_plies, rows, cols, connect)
+             for game in range(games)]
+    writer = ShardWriter(directory, shard_size, rows, cols, connect)
+    try:
+        with mp.Pool(processes) as pool:
+            for done, record in enumerate(pool.imap_unordered(_selfplay_task, tasks), 1):
+                writer.add(record)
+                if done % 10 == 0 or done == games:
+                    print('{}/{} games played, {} positions'.format(
+                        done, games, writer.positions + writer.buffered))
+    finally:
+        writer.close()
+    return writer.positions
+
+
+class ShardDataset:
+    """
+    Read only view of the shards in a directory for fitting. Compressed
+    arrays cannot be memory-mapped, so every shard is unpacked once into
+    plain .npy files in cache, which are then memory-mapped. Opening the
+    data again costs nothing and only the pages that are read are loaded.
+    """
+    def __init__(self, directory, cache=None):
+        self.directory = directory
+        self.cache = cache or os.path.join(directory, 'cache')
+        os.makedirs(self.cache, exist_ok=True)
+        self.shards = [self.open_shard(path) for path in
+                       sorted(glob.glob(os.path.join(directory, 'shard-*.npz')))]
+        self.geometry = None
+        if self.shards:
+            self.geometry = tuple(int(x) for x in self.shards[0]['geometry'])
+
+    def open_shard(self, path):
+        # The memory-mapped arrays of one shard, unpacked if needed
+        name = os.path.splitext(os.path.basename(path))[0]
+        arrays = {}
+        with np.load(path) as shard:
+            for field in shard.files:
+                npy = os.path.join(self.cache, '{}.{}.npy'.format(name, field))
+                if not os.path.exists(npy) or \
+                        os.path.getmtime(npy) < os.path.getmtime(path):
+                    # written under another name first, a crash never
+                    # leaves half a cache file behind
+                    np.save(npy + '.tmp.npy', shard[field])
+                    os.replace(npy + '.tmp.npy', npy)
+                arrays[field] = np.load(npy, mmap_mode='r')
+        return arrays
+
+    def __len__(self):
+        return sum(len(shard['moves']) for shard in self.shards)
+
+    def batches(self, fields=FIELDS, size=SHARD_SIZE):
+        """
+        Yields dicts of field -> array slices of at most size positions,
+        going through the shards in order. The slices are memory maps.
+        """
+        for shard in self.shards:
+            for start in range(0, len(shard['moves']), size):
+                yield {field: shard[field][start:start + size] for field in fields}
+
+    def array(self, field):
+        # One field of all shards in memory, fine for the small ones
+        return np.concatenate([shard[field] for shard in self.shards])
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    gen = subparsers.add_parser('generate', help='Play and record self-play games')
+    gen.add_argument('directory')
+    gen.add_argument('--player1', default='ai:depth=4',
+                     help="'ai[:depth=N,time=S,workers=N,tt=MB]'")
+    gen.add_argument('--player2', default='ai:depth=4')
+    gen.add_argument('--games', type=int, default=100)
+    gen.add_argument('--shard-size', type=int, default=SHARD_SIZE,
+                     help='Positions per shard')
+    gen.add_argument('--processes', type=int, default=None,
+                     help='Games played at once, defaults to the cpu count')
+    gen.add_argument('--seed', type=int, default=0)
+    gen.add_argument('--random-plies', type=int, default=RANDOM_PLIES,
+                     help='Moves played at random at the start of every game')
+    gen.add_argument('--rows', type=int, default=6)
+    gen.add_argument('--cols', type=int, default=7)
+    gen.add_argument('--connect', type=int, default=CONNECT)
+
+    info = subparsers.add_parser('info', help='Summarize the shards in a directory')
+    info.add_argument('directory')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        count = generate(args.directory, args.player1, args.player2, args.games,
+                         args.shard_size, args.processes, args.seed,
+                         args.random_plies, args.rows, args.cols, args.connect)
+        print('Wrote {} positions to {}'.format(count, args.directory))
+    else:
+        data = ShardDataset(args.directory)
+        outcomes = data.array('outcomes')
+        print('{} shards, {} positions, board {}'.format(len(data.shards),
+                                                         len(data), data.geometry))
+        if len(outcomes):
+            print('outcomes for the player to move: {:.1%} wins, {:.1%} draws, '
+                  '{:.1%} losses'.format(np.mean(outcomes == 1),
+                                         np.mean(outcomes == 0),
+                                         np.mean(outcomes == -1)))
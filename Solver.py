@@ -0,0 +1,346 @@
+# system libs
+import argparse
+import time
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from BitBoard import BitBoard, CONNECT, get_geometry
+from Transposition import TranspositionTable, UPPER
+
+# How many nodes are solved between two looks at the clock
+CLOCK_INTERVAL = 4096
+
+
+class SolveTimeout(Exception):
+    # Raised inside the solver once its deadline has passed
+    pass
+
+
+def winning_cells(bits, shifts, connect=CONNECT):
+    """
+    Cells that would complete connect in a row for the discs in bits. For
+    every direction, after[j] holds the cells followed by j discs in a row
+    and before[j] the cells preceded by j, a cell wins when the two add up
+    to connect - 1. The result may include cells that are taken or off the
+    board.
+    """
+    cells = 0
+    last = connect - 1
+    for shift in shifts:
+        after = [-1]
+        before = [-1]
+        for j in range(1, connect):
+            after.append(after[-1] & bits >> (j * shift))
+            before.append(before[-1] & bits << (j * shift))
+        for j in range(connect):
+            cells |= after[j] & before[last - j]
+    return cells
+
+
+class EndgameTable:
+    """
+    Exact scores of positions with at most cells empty cells, keyed like the
+    solver's transposition table. Entries are never evicted and the table
+    can be saved and loaded so the solved endgames carry over between runs.
+    A key only means a position on one board size and connect length, the
+    file records them and load refuses a table of other ones.
+    """
+
+    def __init__(self, cells=8, path=None, rows=6, cols=7, connect=CONNECT):
+        self.cells = cells
+        self.rows = rows
+        self.cols = cols
+        self.connect = connect
+        self.scores = {}
+        if path is not None:
+            self.load(path)
+
+    def key_bytes(self):
+        # Bytes a key takes, current + mask is at most one bit longer than
+        # the board
+        return (self.cols * (self.rows + 1)) // 8 + 1
+
+    def load(self, path):
+        data = np.load(path)
+        geometry = (self.rows, self.cols, self.connect)
+        if 'geometry' not in data.files:
+            raise ValueError('{} was written without its board size'.format(path))
+        stored = tuple(int(x) for x in data['geometry'])
+        if stored != geometry:
+            raise ValueError('{} holds endgames of rows, cols, connect {}, not {}'.format(
+                path, stored, geometry))
+        self.cells = int(data['cells'])
+        keys = [int.from_bytes(row.tobytes(), 'little') for row in data['keys']]
+        self.scores.update(zip(keys, data['scores'].tolist()))
+
+    def save(self, path):
+        # keys as rows of little endian bytes, they may not fit a uint64
+        size = self.key_bytes()
+        keys = np.frombuffer(b''.join(key.to_bytes(size, 'little') for key in self.scores),
+                             dtype=np.uint8).reshape(len(self.scores), size)
+        scores = np.fromiter(self.scores.values(), dtype=np.int8, count=len(self.scores))
+        np.savez_compressed(path, cells=self.cells, keys=keys, scores=scores,
+                            geometry=np.array([self.rows, self.cols, self.connect]))
+
+    def __len__(self):
+        return len(self.scores)
+
+
+class Solver:
+    """
+    Exact negamax solver working on (current player bits, all discs mask)
+    pairs laid out like BitBoard. Scores follow the usual convention: 0 is a
+    draw, a positive score is a win for the player to move, the sooner the
+    bigger, (cells + 1 - discs the winner has played) / 2 with both sides
+    counted, and a negative score the same for a loss.
+
+    INPUTS:
+    rows, cols - board size
+    tt_size_mb - memory cap of the transposition table
+    endgame    - an EndgameTable, None for none
+    connect    - discs in a row that win
+    tt         - a TranspositionTable to use instead of a new one, solvers
+                 of the same board size may share one, tt_size_mb is then
+                 ignored
+    """
+
+    def __init__(self, rows=6, cols=7, tt_size_mb=16, endgame=None, connect=CONNECT,
+                 tt=None):
+        self.rows = rows
+        self.cols = cols
+        self.connect = connect
+        self.cells = rows * cols
+        geometry = get_geometry(rows, cols, connect)
+        self.column_bits = geometry.column_bits
+        self.shifts = [shift for shift, _ in geometry.directions]
+        self.bottom_mask = 0
+        for col in range(cols):
+            self.bottom_mask |= 1 << (col * self.column_bits)
+        self.board_mask = self.bottom_mask * ((1 << rows) - 1)
+        self.column_masks = [((1 << rows) - 1) << (col * self.column_bits)
+                             for col in range(cols)]
+        # (shift right, shift left) taking column col of a key to the
+        # mirrored column, for canonical keys
+        self.mirror_shifts = [(col * self.column_bits,
+                               (cols - 1 - col) * self.column_bits)
+                              for col in range(cols)]
+        self.column_key_mask = (1 << self.column_bits) - 1
+        self.center_order = sorted(range(cols), key=geometry.center_rank.__getitem__)
+        self.tt = tt if tt is not None else TranspositionTable(tt_size_mb, 'always')
+        if endgame is not None and \
+                (endgame.rows, endgame.cols, endgame.connect) != (rows, cols, connect):
+            raise ValueError('The endgame table is for rows, cols, connect {}, not {}'.format(
+                (endgame.rows, endgame.cols, endgame.connect), (rows, cols, connect)))
+        self.endgame = endgame
+        self.nodes = 0
+        self.deadline = None
+        self.cancel_event = None
+
+    def position(self, state):
+        """
+        (current, mask, discs) of a BitBoard for the player to move, player 1
+        when the number of discs is even.
+        """
+        discs = state.mask.bit_count()
+        return state.bits[discs % 2], state.mask, discs
+
+    def canonical(self, key):
+        """
+        The smaller of key and the key of the mirror image. A key is
+        current + mask, which puts the position of every column in that
+        column's bits, so mirroring moves whole columns.
+        """
+        mirrored = 0
+        column = self.column_key_mask
+        for right, left in self.mirror_shifts:
+            mirrored |= (key >> right & column) << left
+        return mirrored if mirrored < key else key
+
+    def possible(self, mask):
+        return (mask + self.bottom_mask) & self.board_mask
+
+    def winning(self, current, mask):
+        return winning_cells(current, self.shifts, self.connect) & (self.board_mask ^ mask)
+
+    def can_win_next(self, current, mask):
+        return self.winning(current, mask) & self.possible(mask)
+
+    def non_losing_moves(self, current, mask):
+        # Moves that do not let the opponent win right away
+        possible = self.possible(mask)
+        opponent_wins = self.winning(current ^ mask, mask)
+        forced = possible & opponent_wins
+        if forced:
+            if forced & (forced - 1):
+                return 0  # two threats, can not block both
+            possible = forced
+        # never play just below an opponent winning cell
+        return possible & ~(opponent_wins >> 1)
+
+    def negamax(self, current, mask, discs, alpha, beta):
+        # Fail soft negamax, the player to move can not win with one move
+        self.nodes += 1
+        if self.nodes % CLOCK_INTERVAL == 0:
+            if self.deadline is not None and time.time() > self.deadline:
+                raise SolveTimeout()
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                raise SolveTimeout()
+
+        moves = self.non_losing_moves(current, mask)
+        if not moves:
+            return -((self.cells - discs) // 2)
+        if discs >= self.cells - 2:
+            return 0
+
+        key = self.canonical(current + mask)
+        endgame = self.endgame
+        if endgame is not None and self.cells - discs <= endgame.cells:
+            score = endgame.scores.get(key)
+            if score is None:
+                # searched with the widest window the score is exact
+                score = self.expand(current, mask, discs, moves,
+                                    -((self.cells - discs) // 2),
+                                    (self.cells + 1 - discs) // 2)
+                endgame.scores[key] = score
+            return score
+
+        lowest = -((self.cells - 2 - discs) // 2)
+        if alpha < lowest:
+            alpha = lowest
+            if alpha >= beta:
+                return alpha
+        highest = (self.cells - 1 - discs) // 2
+        entry = self.tt.probe(key)
+        if entry is not None:
+            highest = entry[1]
+        if beta > highest:
+            beta = highest
+            if alpha >= beta:
+                return beta
+
+        score = self.expand(current, mask, discs, moves, alpha, beta)
+        if score < beta:
+            # failing low the score is an upper bound of the exact score
+            self.tt.store(key, 0, score, UPPER)
+        return score
+
+    def expand(self, current, mask, discs, moves, alpha, beta):
+        # Searches the given moves, the ones making the most new threats
+        # first and central ones first on ties
+        ordered = []
+        for col in self.center_order:
+            move = moves & self.column_masks[col]
+            if move:
+                threats = self.winning(current | move, mask).bit_count()
+                ordered.append((-threats, len(ordered), move))
+        ordered.sort()
+
+        opponent = current ^ mask
+        for _, _, move in ordered:
+            score = -self.negamax(opponent, mask | move, discs + 1, -beta, -alpha)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def solve(self, current, mask, discs):
+        """
+        Exact score of a position, found with a series of null window
+        searches narrowing down on the score like MTD(f).
+        """
+        if self.can_win_next(current, mask):
+            return (self.cells + 1 - discs) // 2
+        low = -((self.cells - discs) // 2)
+        high = (self.cells + 1 - discs) // 2
+        while low < high:
+            # halfway, but nearer to 0 where most scores are
+            guess = low + (high - low) // 2
+            if guess <= 0 and int(low / 2) < guess:
+                guess = int(low / 2)
+            elif guess >= 0 and high // 2 > guess:
+                guess = high // 2
+            score = self.negamax(current, mask, discs, guess, guess + 1)
+            if score <= guess:
+                high = score
+            else:
+                low = score
+        return low
+
+    def best_move(self, state, deadline=None, cancel_event=None):
+        """
+        Solves every move of a BitBoard position for the player to move.
+        SolveTimeout is raised once deadline passes or cancel_event, a
+        threading.Event, is set.
+
+        RETURNS:
+        (column, score) of the best move
+        """
+        self.deadline = deadline
+        self.cancel_event = cancel_event
+        self.nodes = 0
+        try:
+            current, mask, discs = self.position(state)
+            possible = self.possible(mask)
+            winning = self.winning(current, mask) & possible
+            best_col, best_score = None, None
+            for col in self.center_order:
+                move = possible & self.column_masks[col]
+                if not move:
+                    continue
+                if move & winning:
+                    return col, (self.cells + 1 - discs) // 2
+                score = -self.solve(current ^ mask, mask | move, discs + 1)
+                if best_score is None or score > best_score:
+                    best_col, best_score = col, score
+            return best_col, best_score
+        finally:
+            self.deadline = None
+            self.cancel_event = None
+
+    def moves_to_end(self, score, discs):
+        """
+        Moves left until the winner drops its winning disc under perfect
+        play, counting both players, None for a draw.
+        """
+        if score == 0:
+            return None
+        # the winning disc is played on a board holding cells + 1 - 2|score|
+        # or cells - 2|score| discs, whichever belongs to the winner
+        parity = discs % 2 if score > 0 else 1 - discs % 2
+        for last in (self.cells + 1 - 2 * abs(score), self.cells - 2 * abs(score)):
+            if last % 2 == parity:
+                return last - discs + 1
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('moves', help='Columns played from the empty board, e.g. 3324')
+    parser.add_argument('--endgame', help='Endgame table .npz to use and update')
+    parser.add_argument('--endgame-cells', type=int, default=8)
+    parser.add_argument('--rows', type=int, default=6)
+    parser.add_argument('--cols', type=int, default=7)
+    parser.add_argument('--connect', type=int, default=CONNECT)
+    args = parser.parse_args()
+
+    endgame = EndgameTable(args.endgame_cells, rows=args.rows, cols=args.cols,
+                           connect=args.connect)
+    if args.endgame:
+        try:
+            endgame.load(args.endgame)
+        except FileNotFoundError:
+            pass
+
+    state = BitBoard(args.rows, args.cols, args.connect)
+    for i, col in enumerate(args.moves):
+        state.play(int(col), i % 2 + 1)
+    solver = Solver(args.rows, args.cols, endgame=endgame, connect=args.connect)
+    start = time.time()
+    col, score = solver.best_move(state)
+    print('best move {}, score {}, game over in {} moves, {} nodes in {:.2f}s'.format(
+        col, score, solver.moves_to_end(score, len(args.moves)), solver.nodes,
+        time.time() - start))
+    if args.endgame:
+        endgame.save(args.endgame)
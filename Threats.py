@@ -0,0 +1,174 @@
+# system libs
+import argparse
+
+# Local libs
+from BitBoard import BitBoard, CONNECT
+from Solver import winning_cells
+
+
+def playable(state):
+    # Cells a disc can be dropped in right now, one per open column
+    geometry = state.geometry
+    return (state.mask + geometry.bottom_mask) & geometry.full_mask
+
+
+def threat_cells(state, player):
+    # Empty cells that would give player connect in a row
+    geometry = state.geometry
+    return winning_cells(state.bits[player - 1], geometry.shifts,
+                         state.connect) & (geometry.full_mask ^ state.mask)
+
+
+def threat_masks(state, player):
+    # (playable cells, threats of player, threats of the opponent), what
+    # filter_moves and lost are worked out from
+    return (playable(state), threat_cells(state, player),
+            threat_cells(state, 3 - player))
+
+
+def cell_columns(state, cells):
+    # Columns of a mask of cells, left to right
+    column_bits = state.geometry.column_bits
+    columns = []
+    while cells:
+        low = cells & -cells
+        columns.append((low.bit_length() - 1) // column_bits)
+        cells ^= low
+    return sorted(set(columns))
+
+
+def lost(wins, blocks, opponent_threats):
+    """
+    Tells if the opponent wins next move whatever the player to move does,
+    from the player's playable winning cells, the opponent's playable
+    winning cells and all of the opponent's: the player can not win at once
+    and the opponent has two winning cells to fill, or one with another of
+    its threats right on top, which the block would make playable.
+    """
+    if wins or not blocks:
+        return False
+    if blocks & (blocks - 1):
+        return True
+    return bool(blocks << 1 & opponent_threats)
+
+
+def keep_columns(state, cells, buffer, count, inside=True):
+    """
+    Keeps the columns among the first count of buffer whose next disc lands
+    in cells, or outside of cells when inside is False, in order at the
+    start of buffer. buffer is left as it was when none is kept.
+
+    RETURNS:
+    The number of columns kept
+    """
+    bottom_bits = state.geometry.bottom_bits
+    heights = state.heights
+    kept = 0
+    for i in range(count):
+        col = buffer[i]
+        if (cells >> (bottom_bits[col] + heights[col]) & 1) == inside:
+            buffer[kept] = col
+            kept += 1
+    return kept
+
+
+def filter_moves(state, player, buffer, count, masks=None):
+    """
+    Threats(state, player).moves done in place on the first count columns
+    of buffer, without building a Threats or a list, for every node of the
+    search. masks are the threat_masks of the node when already known.
+
+    RETURNS:
+    The number of moves kept at the start of buffer
+    """
+    free, threats, opponent_threats = masks or threat_masks(state, player)
+    cells = threats & free or opponent_threats & free
+    if cells:
+        return keep_columns(state, cells, buffer, count)
+    unsafe = free & (opponent_threats >> 1)
+    if not unsafe:
+        return count
+    return keep_columns(state, unsafe, buffer, count, False) or count
+
+
+class Threats:
+    """
+    Tactical picture of a BitBoard position for the player to move, built
+    from bit masks only, so it is cheap enough for every search node.
+
+    threats          - empty cells that win for the player to move
+    opponent_threats - the same for the opponent
+    wins             - threats the player can fill right now
+    blocks           - opponent threats the player has to fill right now
+    """
+    __slots__ = ('state', 'player', 'playable', 'threats', 'opponent_threats',
+                 'wins', 'blocks')
+
+    def __init__(self, state, player):
+        self.state = state
+        self.player = player
+        self.playable = playable(state)
+        self.threats = threat_cells(state, player)
+        self.opponent_threats = threat_cells(state, 3 - player)
+        self.wins = self.threats & self.playable
+        self.blocks = self.opponent_threats & self.playable
+
+    def lost(self):
+        # See the module's lost
+        return lost(self.wins, self.blocks, self.opponent_threats)
+
+    def unsafe(self):
+        # Playable cells right below an opponent threat, a disc there lets
+        # the opponent win on top of it
+        return self.playable & (self.opponent_threats >> 1)
+
+    def double_threats(self, player=None):
+        # Cells of player's threats with another of its threats right on
+        # top, whoever is made to fill the lower one loses the upper one
+        threats = self.threats if player in (None, self.player) else self.opponent_threats
+        return threats & (threats >> 1)
+
+    def moves(self, moves):
+        """
+        The moves worth searching, in the order given: the winning moves if
+        there are any, else the forced blocks, else every move that does not
+        hand the opponent a win. When nothing is left all moves are kept,
+        everything loses anyway. The result does not depend on the order of
+        moves, so a position and its mirror image get the same value.
+        """
+        moves = list(moves)
+        count = len(moves)
+        cells = self.wins or self.blocks
+        if cells:
+            count = keep_columns(self.state, cells, moves, count)
+        else:
+            unsafe = self.unsafe()
+            if unsafe:
+                count = keep_columns(self.state, unsafe, moves, count, False) or count
+        return moves[:count]
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('moves', nargs='?', default='',
+                        help='Columns played from the empty board, e.g. 3324')
+    parser.add_argument('--rows', type=int, default=6)
+    parser.add_argument('--cols', type=int, default=7)
+    parser.add_argument('--connect', type=int, default=CONNECT)
+    args = parser.parse_args()
+
+    state = BitBoard(args.rows, args.cols, args.connect)
+    for i, col in enumerate(args.moves):
+        state.play(int(col), i % 2 + 1)
+    player = len(args.moves) % 2 + 1
+    threats = Threats(state, player)
+    print(state)
+    print('Player {} to move'.format(player))
+    print('winning columns: {}'.format(cell_columns(state, threats.wins)))
+    print('forced blocks: {}'.format(cell_columns(state, threats.blocks)))
+    print('lost: {}'.format(threats.lost()))
+    print('moves to search: {}'.format(threats.moves(state.possible_moves())))
+    for p in (1, 2):
+        print('player {}: threats in columns {}, stacked {}'.format(
+            p, cell_columns(state, threat_cells(state, p)),
+            cell_columns(state, threats.double_threats(p))))
@@ -0,0 +1,268 @@
+# system libs
+import argparse
+import contextlib
+import csv
+import json
+import math
+import multiprocessing as mp
+import os
+import random
+import time
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from BitBoard import BitBoard, CONNECT
+from MCTS import MCTSPlayer
+from Player import AIPlayer, RandomPlayer
+
+
+# AIPlayer settings a player spec may change and how to read them
+AI_OPTIONS = {'time': ('time_limit', float),
+              'depth': ('depth', int),
+              'workers': ('workers', int),
+              'tt': ('tt_size_mb', float),
+              'weights': ('weights', str),
+              'threats': ('threats', int)}
+# The same for MCTSPlayer
+MCTS_OPTIONS = {'time': ('time_limit', float),
+                'iterations': ('iterations', int),
+                'policy': ('policy', str),
+                'batch': ('batch', int),
+                'workers': ('workers', int),
+                'c': ('exploration', float)}
+
+CSV_FIELDS = ['game', 'first', 'second', 'winner', 'winner_spec', 'plies',
+              'moves', 'think_times', 'nodes']
+
+
+def make_player(spec, number, connect=CONNECT):
+    """
+    Builds a player from a spec string, either 'random' or 'ai' or 'mcts'
+    optionally followed by settings, e.g. 'ai:depth=3', 'ai:time=0.5,workers=2'
+    or 'mcts:time=0.5,policy=puct'
+
+    INPUTS:
+    spec    - the spec string
+    number  - player number, 1 moves first
+    connect - discs in a row that win
+    """
+    name, _, options = spec.partition(':')
+    if name == 'random':
+        return RandomPlayer(number)
+    if name not in ('ai', 'mcts'):
+        raise ValueError('Players must be ai, mcts or random, not {}'.format(spec))
+    known = AI_OPTIONS if name == 'ai' else MCTS_OPTIONS
+    kwargs = {}
+    for option in filter(None, options.split(',')):
+        key, _, value = option.partition('=')
+        if key not in known:
+            raise ValueError('Unknown {} option {}'.format(name, key))
+        arg, convert = known[key]
+        kwargs[arg] = convert(value)
+    if name == 'mcts':
+        return MCTSPlayer(number, connect=connect, **kwargs)
+    return AIPlayer(number, connect=connect, **kwargs)
+
+
+def play_game(player1, player2, rows=6, cols=7, connect=CONNECT):
+    """
+    Plays one game without a GUI, moves are picked the same way Game does.
+
+    INPUTS:
+    player1 - AIPlayer, MCTSPlayer or RandomPlayer moving first
+    player2 - AIPlayer, MCTSPlayer or RandomPlayer moving second
+
+    RETURNS:
+    A dict with the columns played, the winner (0 for a draw), the time
+    every move took and the nodes searched for it (0 for random moves)
+    """
+    players = [player1, player2]
+    board = np.zeros([rows, cols]).astype(np.uint8)
+    state = BitBoard(rows, cols, connect)
+    moves = []
+    think_times = []
+    nodes = []
+    winner = 0
+    turn = 0
+
+    while state.possible_moves():
+        player = players[turn]
+        start = time.time()
+        if player.type == 'ai':
+            if players[1 - turn].type == 'random':
+                move = player.get_expectimax_move(board)
+            else:
+                move = player.get_alpha_beta_move(board)
+            nodes.append(player.stats.nodes)
+        elif player.type == 'mcts':
+            move = player.get_move(board)
+            nodes.append(player.stats.nodes)
+        else:
+            move = player.get_move(board)
+            nodes.append(0)
+        think_times.append(time.time() - start)
+
+        move = int(move)
+        board[rows - 1 - state.heights[move], move] = player.player_number
+        state.play(move, player.player_number)
+        moves.append(move)
+        if state.wins_at(move):
+            winner = player.player_number
+            break
+        turn = 1 - turn
+
+    return {'moves': moves,
+            'winner': winner,
+            'think_times': think_times,
+            'nodes': nodes}
+
+
+def _play_task(task):
+    # One game in a pool process, the search chatter is dropped
+    game, first, second, seed, verbose, rows, cols, connect = task
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            devnull = stack.enter_context(open(os.devnull, 'w'))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+        players = [make_player(first, 1, connect), make_player(second, 2, connect)]
+        try:
+            record = play_game(*players, rows, cols, connect)
+        finally:
+            for player in players:
+                if player.type in ('ai', 'mcts'):
+                    player.close()
+    record.update({'game': game, 'first': first, 'second': second,
+                   'plies': len(record['moves'])})
+    record['winner_spec'] = [None, first, second][record['winner']]
+    return record
+
+
+def run_tournament(spec1, spec2, games, output=None, processes=None,
+                   swap=True, seed=0, verbose=False, rows=6, cols=7,
+                   connect=CONNECT):
+    """
+    Plays games between two player specs across a pool of processes and
+    streams every finished game to output, a .jsonl or .csv file.
+
+    INPUTS:
+    spec1, spec2 - player specs, see make_player
+    games        - number of games to play
+    output       - path of the results file, None keeps no file
+    processes    - pool size, defaults to the number of cpus
+    swap         - alternate which spec moves first
+    seed         - base seed, game i uses seed + i
+    rows, cols   - board size
+    connect      - discs in a row that win
+
+    RETURNS:
+    The summary dict printed by print_summary
+    """
+    tasks = []
+    # the player number spec1 has in every game
+    spec1_numbers = []
+    for game in range(games):
+        first, second = spec1, spec2
+        spec1_numbers.append(1)
+        if swap and game % 2:
+            first, second = spec2, spec1
+            spec1_numbers[-1] = 2
+        tasks.append((game, first, second, seed + game, verbose, rows, cols, connect))
+
+    writer = None
+    out_file = None
+    if output:
+        out_file = open(output, 'w', newline='')
+        if output.endswith('.csv'):
+            writer = csv.DictWriter(out_file, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+
+    # wins, draws and losses of spec1
+    results = [0, 0, 0]
+    try:
+        with mp.Pool(processes) as pool:
+            for record in pool.imap_unordered(_play_task, tasks):
+                if out_file:
+                    if writer:
+                        writer.writerow({field: json.dumps(record[field])
+                                         if isinstance(record[field], list)
+                                         else record[field]
+                                         for field in CSV_FIELDS})
+                    else:
+                        out_file.write(json.dumps(record) + '\n')
+                    out_file.flush()
+                if record['winner'] == 0:
+                    results[1] += 1
+                elif record['winner'] == spec1_numbers[record['game']]:
+                    results[0] += 1
+                else:
+                    results[2] += 1
+    finally:
+        if out_file:
+            out_file.close()
+    return summarize(spec1, spec2, results, games)
+
+
+def elo_difference(score):
+    # Rating difference that makes score the expected result
+    if score <= 0:
+        return float('-inf')
+    if score >= 1:
+        return float('inf')
+    return 400 * math.log10(score / (1 - score))
+
+
+def summarize(spec1, spec2, record, games):
+    # record holds the wins, draws and losses of spec1
+    wins, draws, losses = record
+    score = (wins + draws / 2) / games if games else 0
+    return {'games': games,
+            'player1': spec1,
+            'player2': spec2,
+            'wins': wins,
+            'draws': draws,
+            'losses': losses,
+            'win_rate': wins / games if games else 0,
+            'score': score,
+            'elo': elo_difference(score)}
+
+
+def print_summary(summary):
+    print('{} vs {}: {} games'.format(summary['player1'], summary['player2'],
+                                      summary['games']))
+    print('  {} wins, {} draws, {} losses'.format(summary['wins'],
+                                                  summary['draws'],
+                                                  summary['losses']))
+    print('  win rate {:.1%}, score {:.1%}'.format(summary['win_rate'],
+                                                   summary['score']))
+    print('  Elo difference {:+.0f}'.format(summary['elo']))
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    players_help = ("'random', 'ai[:depth=N,time=S,workers=N,tt=MB,weights=FILE,threats=0|1]' or "
+                    "'mcts[:time=S,iterations=N,policy=uct|puct,batch=N,workers=N,c=C]'")
+    parser.add_argument('player1', help=players_help)
+    parser.add_argument('player2', help=players_help)
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--output', help='Results file, .jsonl or .csv')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Games played at once, defaults to the cpu count')
+    parser.add_argument('--no-swap', action='store_true',
+                        help='Let player1 move first in every game')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true',
+                        help='Keep the output of the AI search')
+    parser.add_argument('--rows', type=int, default=6)
+    parser.add_argument('--cols', type=int, default=7)
+    parser.add_argument('--connect', type=int, default=CONNECT,
+                        help='Discs in a row that win')
+    args = parser.parse_args()
+
+    print_summary(run_tournament(args.player1, args.player2, args.games,
+                                 args.output, args.processes,
+                                 not args.no_swap, args.seed, args.verbose,
+                                 args.rows, args.cols, args.connect))
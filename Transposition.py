@@ -0,0 +1,84 @@
+# Bound types stored with each value
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# Rough size of one entry below (list slot, tuple and the boxed key and
+# value), used to turn a memory cap into a slot count
+ENTRY_BYTES = 150
+
+
+class TranspositionTable:
+    """
+    Fixed size hash table of searched positions, indexed by the Zobrist key
+    kept up to date by BitBoard.play/undo.
+
+    INPUTS:
+    size_mb     - approximate memory cap of the table in megabytes
+    replacement - 'depth' keeps the deeper entry of the current search when
+                  two positions land in the same slot, 'always' lets the
+                  newest entry win
+    """
+
+    def __init__(self, size_mb=16, replacement='depth'):
+        if replacement not in ('depth', 'always'):
+            raise ValueError('Unknown replacement policy {}'.format(replacement))
+        self.size = max(1, int(size_mb * 1024 * 1024) // ENTRY_BYTES)
+        self.replacement = replacement
+        self.clear()
+
+    def clear(self):
+        # one (key, depth, value, flag, move, generation) tuple per slot,
+        # replaced whole, so threads sharing the table never read half an
+        # entry
+        self.entries = [None] * self.size
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def new_search(self):
+        # entries from earlier searches may always be replaced
+        self.generation += 1
+
+    def probe(self, key):
+        """
+        Looks up a position.
+
+        RETURNS:
+        (depth, value, flag, move) for the stored entry, or None
+        """
+        entry = self.entries[key % self.size]
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] == key:
+            self.hits += 1
+            return entry[1:5]
+        self.collisions += 1
+        return None
+
+    def store(self, key, depth, value, flag, move=None):
+        slot = key % self.size
+        entry = self.entries[slot]
+        if entry is not None and entry[0] != key:
+            if (self.replacement == 'depth' and
+                    entry[5] == self.generation and entry[1] > depth):
+                return
+            self.overwrites += 1
+        self.entries[slot] = (key, depth, value, flag, move, self.generation)
+        self.stores += 1
+
+    def used(self):
+        # Slots holding an entry
+        return self.size - self.entries.count(None)
+
+    def stats(self):
+        return {'size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'collisions': self.collisions,
+                'stores': self.stores,
+                'overwrites': self.overwrites}
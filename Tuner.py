@@ -0,0 +1,195 @@
+# system libs
+import argparse
+import math
+import time
+
+# 3rd party libs
+import numpy as np
+
+# Local libs
+from BitBoard import CONNECT, RUN_WEIGHTS, batch_heuristic
+from Player import DEFENSE, load_weights, save_weights, valid_weights
+from SelfPlay import ShardDataset
+
+
+# Parameters the tuner changes. The win weight stays put: stored positions
+# never hold a win, so the data says nothing about it
+PARAMETERS = ('two_short', 'one_short', 'defense')
+# Relative step coordinate descent starts with and the one it stops at
+STEP = 0.5
+MIN_STEP = 0.01
+# Every HOLDOUT-th game is kept out of the fit to check it
+HOLDOUT = 10
+# Positions turned into features at once
+CHUNK = 100000
+
+
+def features(boards, to_move, connect=CONNECT):
+    """
+    Counts the runs the heuristic scores, for many positions at once.
+
+    INPUTS:
+    boards  - (N, rows, cols) boards in the Game encoding
+    to_move - (N,) number of the player to move
+    connect - discs in a row that win
+
+    RETURNS:
+    (N, 2, 3) int array, [:, 0] for the player to move and [:, 1] for the
+    other one, holding the runs two short of a win, one short and the wins
+    """
+    boards = np.asarray(boards)
+    counts = []
+    # the heuristic with a single weight of 1 counts one kind of run
+    for unit in np.eye(3, dtype=np.int64):
+        scores, _ = batch_heuristic(boards, connect=connect,
+                                    weights=tuple(int(w) for w in unit))
+        counts.append(scores)
+    counts = np.stack(counts, axis=-1)
+    mover = np.asarray(to_move) == 2
+    counts[mover] = counts[mover][:, ::-1]
+    return counts.astype(np.int16)
+
+
+def evaluate(feats, runs, defense):
+    # AIPlayer's balanced evaluation of every position for the player to move
+    runs = np.asarray(runs, dtype=np.float64)
+    return feats[:, 0] @ runs - defense * (feats[:, 1] @ runs)
+
+
+def texel_error(feats, targets, runs, defense, scale):
+    """
+    Mean squared error between the results and the evaluation squashed
+    into a win probability by a logistic curve of the given scale.
+    """
+    values = np.clip(scale * evaluate(feats, runs, defense), -50, 50)
+    return float(np.mean((targets - 1 / (1 + np.exp(-values))) ** 2))
+
+
+def fit_scale(feats, targets, runs, defense):
+    """
+    The logistic scale that fits the results best with the given weights,
+    golden section search over its logarithm.
+    """
+    error = lambda log_scale: texel_error(feats, targets, runs, defense,
+                                          math.exp(log_scale))
+    low, high = math.log(1e-5), math.log(10)
+    ratio = (math.sqrt(5) - 1) / 2
+    for _ in range(60):
+        a = high - ratio * (high - low)
+        b = low + ratio * (high - low)
+        if error(a) < error(b):
+            high = b
+        else:
+            low = a
+    return math.exp((low + high) / 2)
+
+
+def tune(feats, targets, runs=RUN_WEIGHTS, defense=DEFENSE, scale=None,
+         iterations=100, step=STEP, min_step=MIN_STEP, log=True):
+    """
+    Coordinate descent on PARAMETERS: every parameter is multiplied and
+    divided by 1 + step in turn and kept where the error drops. The step
+    halves once no parameter moves. The weights stay ordered, a run closer
+    to a win is worth more.
+
+    INPUTS:
+    feats, targets - features and results (1 win, 0.5 draw, 0 loss) of the
+                     player to move
+    runs, defense  - starting weights
+    scale          - logistic scale, fitted to the starting weights if None
+    iterations     - most passes over the parameters
+    step, min_step - first and last relative step
+    log            - print every pass
+
+    RETURNS:
+    (runs, defense, scale, error)
+    """
+    if scale is None:
+        scale = fit_scale(feats, targets, runs, defense)
+    params = {'two_short': float(runs[0]), 'one_short': float(runs[1]),
+              'defense': float(defense)}
+    win = runs[2]
+
+    def error_of(p):
+        return texel_error(feats, targets, (p['two_short'], p['one_short'], win),
+                           p['defense'], scale)
+
+    def valid(p):
+        return valid_weights((p['two_short'], p['one_short'], win), p['defense'])
+
+    best = error_of(params)
+    for iteration in range(iterations):
+        if step < min_step:
+            break
+        start = time.time()
+        evaluations = 0
+        improved = False
+        for name in PARAMETERS:
+            for factor in (1 + step, 1 / (1 + step)):
+                trial = dict(params, **{name: params[name] * factor})
+                if not valid(trial):
+                    continue
+                error = error_of(trial)
+                evaluations += 1
+                if error < best:
+                    best, params, improved = error, trial, True
+                    break
+        if not improved:
+            step /= 2
+        if log:
+            elapsed = time.time() - start
+            rate = evaluations * len(targets) / elapsed if elapsed else 0
+            print('pass {}: error {:.6f}, {}, step {:g}, {:.0f} positions/s'.format(
+                iteration, best, {k: round(v, 4) for k, v in params.items()},
+                step, rate))
+    runs = (round(params['two_short'], 4), round(params['one_short'], 4), win)
+    return runs, round(params['defense'], 4), scale, best
+
+
+def load_features(data, connect=CONNECT, chunk=CHUNK):
+    """
+    Features, results and game index of every position of a ShardDataset,
+    read chunk positions at a time from the memory maps.
+    """
+    feats, targets, games = [], [], []
+    for batch in data.batches(('boards', 'to_move', 'outcomes', 'games'), chunk):
+        feats.append(features(batch['boards'], batch['to_move'], connect))
+        targets.append((batch['outcomes'].astype(np.float64) + 1) / 2)
+        games.append(np.array(batch['games']))
+    if not feats:
+        raise ValueError('{} holds no positions'.format(data.directory))
+    return np.concatenate(feats), np.concatenate(targets), np.concatenate(games)
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data', help='Directory of SelfPlay.py shards')
+    parser.add_argument('--output', default='weights.json',
+                        help='Weights file to write, AIPlayer(weights=...) reads it')
+    parser.add_argument('--start', help='Weights file to start from')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--step', type=float, default=STEP)
+    args = parser.parse_args()
+
+    data = ShardDataset(args.data)
+    if data.geometry is None:
+        raise ValueError('{} holds no positions'.format(args.data))
+    connect = data.geometry[2]
+    runs, defense = RUN_WEIGHTS, DEFENSE
+    if args.start:
+        runs, defense, _ = load_weights(args.start)
+
+    start = time.time()
+    feats, targets, games = load_features(data, connect)
+    print('{} positions turned into features in {:.1f}s'.format(len(targets),
+                                                                time.time() - start))
+    held = games % HOLDOUT == 0
+    scale = fit_scale(feats[~held], targets[~held], runs, defense)
+    before = texel_error(feats[held], targets[held], runs, defense, scale)
+    runs, defense, scale, error = tune(feats[~held], targets[~held], runs, defense,
+                                       scale, args.iterations, args.step)
+    after = texel_error(feats[held], targets[held], runs, defense, scale)
+    print('held out error {:.6f} -> {:.6f}'.format(before, after))
+    save_weights(args.output, runs, defense, connect, scale=scale,
+                 error=error, holdout_error=after, positions=len(targets))
+    print('Wrote {}'.format(args.output))
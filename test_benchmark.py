@@ -0,0 +1,91 @@
+# system libs
+import json
+import os
+import subprocess
+import sys
+
+# Local libs
+from Benchmark import BASELINE, CORPUS, compare, metric, settings_differences, suite
+
+
+# The benchmark script, run to check its exit status
+BENCHMARK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Benchmark.py')
+
+
+def results(**values):
+    # Suite results holding the given metrics, names ending in nodes are
+    # counts and those ending in time lower is better
+    metrics = {}
+    for name, value in values.items():
+        if name.endswith('nodes'):
+            metrics[name] = metric(value, 'nodes', None)
+        elif name.endswith('time'):
+            metrics[name] = metric(value, 's', False)
+        else:
+            metrics[name] = metric(value, 'evals/s', True)
+    return {'settings': {'depth': 5}, 'metrics': metrics}
+
+
+def test_compare_judges_every_metric():
+    baseline = results(eval_a=100, eval_b=100, eval_c=100, search_time=1.0,
+                       search_nodes=500, only_old=1)
+    new = results(eval_a=85, eval_b=95, eval_c=120, search_time=1.2,
+                  search_nodes=400, only_new=1)
+    status = {name: row_status for name, _, _, _, row_status in compare(baseline, new)}
+    assert status == {'eval_a': 'regression',
+                      'eval_b': 'ok',
+                      'eval_c': 'improvement',
+                      # slower is worse for times
+                      'search_time': 'regression',
+                      # counts are reported, never judged
+                      'search_nodes': 'changed'}
+    assert compare(baseline, new, threshold=0.25)[0][4] == 'ok'
+
+
+def test_suite_measures_every_position():
+    run = suite(depth=2, expectimax_depth=1, repeats=1, positions=['early'])
+    assert run['settings']['depth'] == 2
+    for name in ('eval/bitboard/early', 'eval/numpy/early', 'movegen/bitboard/early',
+                 'alpha_beta/early/time_to_depth', 'expectimax/early/nodes'):
+        assert run['metrics'][name]['value'] > 0
+
+
+def test_regression_sets_the_exit_status(tmp_path):
+    paths = []
+    for i, value in enumerate((100, 50)):
+        paths.append(str(tmp_path / 'results{}.json'.format(i)))
+        with open(paths[-1], 'w') as f:
+            json.dump(results(eval_a=value), f)
+    compare_run = [sys.executable, BENCHMARK, 'compare']
+    assert subprocess.run(compare_run + paths, capture_output=True).returncode == 1
+    assert subprocess.run(compare_run + paths[::-1], capture_output=True).returncode == 0
+
+
+def test_stored_baseline_covers_the_suite():
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+    assert baseline['settings']['depth'] == 5
+    assert baseline['settings']['expectimax_depth'] == 3
+    assert baseline['settings']['positions'] == sorted(CORPUS)
+    # every corpus position was measured
+    for name in CORPUS:
+        assert 'eval/bitboard/{}'.format(name) in baseline['metrics']
+    assert all(row[4] == 'ok' for row in compare(baseline, baseline)
+               if baseline['metrics'][row[0]]['higher_is_better'] is not None)
+
+
+def test_other_settings_are_not_judged(tmp_path):
+    baseline = results(eval_a=100)
+    new = results(eval_a=50)
+    new['settings'] = {'depth': 6, 'time': 'later'}
+    assert settings_differences(baseline, new) == [('depth', 5, 6)]
+    paths = []
+    for i, run in enumerate((baseline, new)):
+        paths.append(str(tmp_path / 'results{}.json'.format(i)))
+        with open(paths[-1], 'w') as f:
+            json.dump(run, f)
+    # a slowdown between runs of another depth is no regression
+    result = subprocess.run([sys.executable, BENCHMARK, 'compare'] + paths,
+                            capture_output=True, text=True)
+    assert result.returncode == 0
+    assert 'depth' in result.stdout
@@ -0,0 +1,193 @@
+# system libs
+import random
+
+# 3rd party libs
+import numpy as np
+import pytest
+
+# Local libs
+from BitBoard import BitBoard, batch_heuristic, connected_through
+from Player import Board
+
+
+# (rows, cols, connect) of the boards every check runs on
+SIZES = [(6, 7, 4), (4, 4, 4), (5, 6, 3), (7, 6, 4), (8, 9, 5)]
+POSITIONS = 100
+
+
+def random_game(rng, rows, cols, connect):
+    """
+    Plays random moves on a BitBoard and a numpy board side by side, wins
+    do not end the game so positions with runs of every length come up.
+
+    RETURNS:
+    (BitBoard, list of the numpy board after every move, columns played)
+    """
+    state = BitBoard(rows, cols, connect)
+    board = np.zeros([rows, cols], dtype=np.uint8)
+    boards = [board.copy()]
+    moves = []
+    for ply in range(rng.randint(0, rows * cols)):
+        col = rng.choice(state.possible_moves())
+        player = ply % 2 + 1
+        board[rows - 1 - state.heights[col], col] = player
+        state.play(col, player)
+        boards.append(board.copy())
+        moves.append(col)
+    return state, boards, moves
+
+
+def reference(board, connect, player):
+    return Board(board, connect).connected_heuristic(player)
+
+
+def positions(rows, cols, connect, seed=0):
+    rng = random.Random(seed)
+    for _ in range(POSITIONS):
+        yield random_game(rng, rows, cols, connect)
+
+
+@pytest.mark.parametrize('rows, cols, connect', SIZES)
+def test_incremental_matches_board(rows, cols, connect):
+    for state, boards, _ in positions(rows, cols, connect):
+        for player in (1, 2):
+            expected = reference(boards[-1], connect, player)
+            assert state.connected_heuristic(player) == expected
+            assert state.rescan_heuristic(player) == expected
+            assert state.has_won(player) == expected[1]
+
+
+@pytest.mark.parametrize('rows, cols, connect', SIZES)
+def test_incremental_matches_board_after_undo(rows, cols, connect):
+    rng = random.Random(1)
+    for state, boards, moves in positions(rows, cols, connect, seed=2):
+        for _ in range(rng.randint(0, len(moves))):
+            state.undo()
+            boards.pop()
+        for player in (1, 2):
+            expected = reference(boards[-1], connect, player)
+            assert state.connected_heuristic(player) == expected
+            assert state.rescan_heuristic(player) == expected
+
+
+@pytest.mark.parametrize('rows, cols, connect', SIZES)
+def test_undo_restores_the_board(rows, cols, connect):
+    rng = random.Random(4)
+    for state, boards, moves in positions(rows, cols, connect, seed=3):
+        for _ in range(rng.randint(0, len(moves))):
+            state.undo()
+            boards.pop()
+        assert (state.to_array() == boards[-1]).all()
+        moves = [col for col in range(cols) if boards[-1][0, col] == 0]
+        assert list(state.possible_moves()) == moves
+        assert list(state.center_moves()) == \
+            sorted(moves, key=lambda col: abs(2 * col - (cols - 1)))
+
+
+@pytest.mark.parametrize('rows, cols, connect', SIZES)
+def test_batch_matches_board(rows, cols, connect):
+    states, boards = [], []
+    for state, history, _ in positions(rows, cols, connect, seed=3):
+        states.append(tuple(state.bits))
+        boards.append(history[-1])
+    expected = [[reference(board, connect, player) for player in (1, 2)]
+                for board in boards]
+    for scores, wins in (batch_heuristic(np.array(boards), connect=connect),
+                         batch_heuristic(states, rows, cols, connect)):
+        assert scores.tolist() == [[score for score, _ in row] for row in expected]
+        assert wins.tolist() == [[over for _, over in row] for row in expected]
+
+
+@pytest.mark.parametrize('weights', [(2, 5, 100), (0.5, 3.0, 100.0)])
+def test_other_weights_agree(weights):
+    for _, boards, _ in positions(6, 7, 4, seed=6):
+        state = BitBoard.from_array(boards[-1], 4, weights)
+        scores, wins = batch_heuristic(np.array([boards[-1]]), weights=weights)
+        for player in (1, 2):
+            score, over = state.connected_heuristic(player)
+            assert state.rescan_heuristic(player) == (score, over)
+            assert (scores[0, player - 1], wins[0, player - 1]) == (score, over)
+
+
+def test_from_array_matches_play():
+    for state, boards, _ in positions(6, 7, 4, seed=5):
+        loaded = BitBoard.from_array(boards[-1])
+        assert loaded.bits == state.bits
+        assert loaded.heights == state.heights
+        assert loaded.key == state.key
+        assert loaded.scores == state.scores
+        assert loaded.possible_moves() is state.possible_moves()
+        assert (loaded.to_array() == boards[-1]).all()
+    # no per board dict, every attribute has its slot
+    assert not hasattr(BitBoard(), '__dict__')
+
+
+def full_scan(board, player, connect):
+    # Runs of connect discs of player anywhere on a numpy board, every
+    # window of every line looked at
+    rows, cols = board.shape
+    count = 0
+    for d_row, d_col in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+        for row in range(rows):
+            for col in range(cols):
+                end_row = row + d_row * (connect - 1)
+                end_col = col + d_col * (connect - 1)
+                if not (0 <= end_row < rows and 0 <= end_col < cols):
+                    continue
+                count += all(board[row + d_row * i, col + d_col * i] == player
+                             for i in range(connect))
+    return count
+
+
+@pytest.mark.parametrize('rows, cols, connect', SIZES)
+def test_win_checks_match_full_scan(rows, cols, connect):
+    for state, boards, moves in positions(rows, cols, connect, seed=6):
+        # replay the game, a move wins when it makes a run that was not there
+        state = BitBoard(rows, cols, connect)
+        for ply, col in enumerate(moves):
+            player = ply % 2 + 1
+            before, after = boards[ply], boards[ply + 1]
+            row = rows - 1 - state.heights[col]
+            state.play(col, player)
+            wins = full_scan(after, player, connect) > full_scan(before, player, connect)
+            assert state.wins_at(col) == wins
+            assert connected_through(after, row, col, player, connect) == wins
+            for p in (1, 2):
+                won = full_scan(after, p, connect) > 0
+                assert state.has_won(p) == won
+                assert reference(after, connect, p)[1] == won
+        assert state.is_full() == (len(moves) == rows * cols)
+
+
+@pytest.mark.parametrize('rows, cols, connect', SIZES)
+def test_wins_on_edges_and_diagonals(rows, cols, connect):
+    # every line of connect cells touching the border of the board, won by
+    # dropping the disc of each of its cells that can go last
+    lines = []
+    for d_row, d_col in [(0, 1), (1, 0), (1, 1), (1, -1)]:
+        for row in range(rows):
+            for col in range(cols):
+                cells = [(row + d_row * i, col + d_col * i) for i in range(connect)]
+                if all(0 <= r < rows and 0 <= c < cols for r, c in cells) and \
+                        any(r in (0, rows - 1) or c in (0, cols - 1) for r, c in cells):
+                    lines.append(cells)
+    assert lines
+    for cells in lines:
+        board = np.zeros([rows, cols], dtype=np.uint8)
+        for row, col in cells:
+            # discs of the other player hold the line up
+            board[row + 1:, col] = np.where(board[row + 1:, col] == 1, 1, 2)
+        for row, col in cells:
+            board[row, col] = 1
+        for row, col in cells:
+            if board[:row, col].any():
+                continue
+            state = BitBoard.from_array(board, connect)
+            assert state.wins_at(col)
+            assert connected_through(board, row, col, 1, connect)
+            board[row, col] = 0
+            state = BitBoard.from_array(board, connect)
+            assert not state.has_won(1)
+            board[row, col] = 1
+            state.play(col, 1)
+            assert state.wins_at(col)
@@ -0,0 +1,128 @@
+# system libs
+import os
+import time
+
+# 3rd party libs
+import numpy as np
+import pytest
+
+# Local libs
+from ConnectFour import AIWorker, CANCEL_GRACE, POLL_MS
+from MCTS import MCTSPlayer
+from Player import AIPlayer
+
+
+@pytest.fixture
+def board():
+    return np.zeros([6, 7], dtype=np.uint8)
+
+
+def test_worker_answers_every_move(board):
+    worker = AIWorker(AIPlayer(1, depth=3))
+    try:
+        process = worker.process
+        for _ in range(3):
+            move = worker.get_move(board, 'get_alpha_beta_move', 30)
+            assert move in range(7)
+            # the stats of the move come back with it
+            assert worker.stats.nodes
+            board[5 - np.count_nonzero(board[:, move]), move] = 1
+        # the same process searched every move
+        assert worker.process is process
+    finally:
+        worker.close()
+
+
+def test_request_does_not_wait_for_the_search(board):
+    worker = AIWorker(AIPlayer(1, depth=5))
+    try:
+        start = time.time()
+        worker.request(board, 'get_alpha_beta_move', 30)
+        assert time.time() - start < 0.5
+        progress = []
+        while True:
+            info, move = worker.poll()
+            progress += info
+            if move is not None:
+                break
+            time.sleep(POLL_MS / 1000)
+        # every finished depth was reported, the last one with the move
+        assert [depth for depth, _, _ in progress] == list(range(6))
+        assert progress[-1][1] == move
+        assert worker.poll() == ([], None)
+    finally:
+        worker.close()
+
+
+def test_progress_is_called_after_every_depth(board):
+    player = AIPlayer(1, depth=4, log_level='quiet')
+    progress = []
+    player.progress = lambda *info: progress.append(info)
+    move = player.get_alpha_beta_move(board)
+    assert [depth for depth, _, _ in progress] == list(range(5))
+    assert progress[-1][1] == move
+
+
+def test_mcts_player_searches_in_a_worker(board):
+    worker = AIWorker(MCTSPlayer(1, iterations=200))
+    try:
+        assert worker.get_move(board, 'get_move', 30) in range(7)
+    finally:
+        worker.close()
+
+
+def test_request_stops_pondering(board):
+    worker = AIWorker(AIPlayer(1, depth=5, log_level='quiet'))
+    try:
+        board[5, 3] = 1
+        worker.ponder(board, 'alpha_beta')
+        assert worker.pondering
+        time.sleep(0.3)
+        board[4, 3] = 2
+        start = time.time()
+        move = worker.get_move(board, 'get_alpha_beta_move', 30)
+        assert time.time() - start < CANCEL_GRACE
+        assert move in range(7)
+        assert not worker.pondering
+        # the reply played was the one pondered
+        assert worker.stats.pondered is not None
+    finally:
+        worker.close()
+
+
+def test_cancelled_search_returns_its_best_move(board):
+    # far too deep to finish, only the cancel event ends the search
+    worker = AIWorker(AIPlayer(1, depth=40))
+    try:
+        start = time.time()
+        move = worker.get_move(board, 'get_alpha_beta_move', 1)
+        assert time.time() - start < 1 + CANCEL_GRACE
+        assert move in range(7)
+    finally:
+        worker.close()
+
+
+def test_dead_worker_is_restarted(board):
+    worker = AIWorker(AIPlayer(1, depth=3))
+    try:
+        worker.process.terminate()
+        worker.process.join()
+        assert worker.get_move(board, 'get_expectimax_move', 30) in range(7)
+    finally:
+        worker.close()
+
+
+def test_worker_closes_its_player(tmp_path):
+    # a drawn pattern with the top two rows empty is in the solver's reach
+    board = np.array([[1 + (row + col // 2) % 2 for col in range(7)]
+                      for row in range(6)], dtype=np.uint8)
+    board[:2] = 0
+    path = str(tmp_path / 'endgame.npz')
+    worker = AIWorker(AIPlayer(1, depth=3, endgame=path, log_level='quiet'))
+    try:
+        assert worker.get_move(board, 'get_alpha_beta_move', 30) in range(7)
+        assert worker.stats.solved
+    finally:
+        worker.close()
+    # the endgames solved in the worker process were saved there
+    assert os.path.exists(path)
@@ -0,0 +1,146 @@
+# system libs
+import json
+import os
+import threading
+import time
+
+# 3rd party libs
+import numpy as np
+import pytest
+
+# Local libs
+from BitBoard import BitBoard
+from EngineServer import Engine, EngineClient, load_test, make_server
+
+
+@pytest.fixture
+def engine():
+    engine = Engine(tt_size_mb=1)
+    yield engine
+    engine.close()
+
+
+@pytest.fixture
+def client(engine):
+    # A server of engine on a free port, and a client of it
+    server = make_server('127.0.0.1:0', engine)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    client = EngineClient('{}:{}'.format(host, port), timeout=30)
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def board_of(moves, rows=6, cols=7):
+    # The Game encoding board after moves, wins are not checked
+    state = BitBoard(rows, cols)
+    for i, col in enumerate(moves):
+        state.play(int(col), i % 2 + 1)
+    return state.to_array().tolist()
+
+
+def test_go_with_moves_and_board(client):
+    for fields in ({'moves': '3324'}, {'board': board_of('3324')}):
+        reply = client.request('go', depth=3, **fields)
+        assert 'error' not in reply
+        assert reply['move'] in range(7)
+        assert not reply['cancelled']
+    # both forms of the same position get the same answer
+    assert client.go('3324', depth=3)['move'] == \
+        client.request('go', board=board_of('3324'), depth=3)['move']
+
+
+def test_finished_game_is_rejected(client):
+    # player 1 has four in column 0
+    assert 'game is over' in client.go('0101010')['error']
+    assert 'game is over' in client.request('go', board=board_of('0101010'))['error']
+
+
+def test_invalid_positions_are_rejected(client):
+    assert 'error' in client.go('37')
+    assert 'error' in client.go('0000000')
+    board = np.zeros([6, 7], dtype=np.uint8)
+    board[5, 0] = 2
+    assert 'error' in client.request('go', board=board.tolist())
+    board[5, 0] = 3
+    assert 'error' in client.request('go', board=board.tolist())
+    # the session still answers after the errors
+    assert client.request('ping')['pong']
+
+
+def test_stop_ends_the_search(engine, client):
+    engine.solver_cells = None
+    rid = client.send('go', moves='33', time=60, depth=40)
+    time.sleep(0.5)
+    assert client.request('stop')['stopped']
+    start = time.time()
+    reply = client.wait(rid)
+    assert time.time() - start < 5
+    assert reply['cancelled']
+    assert reply['move'] in range(7)
+    assert client.request('stats')['cancelled'] == 1
+
+
+def test_stop_ends_the_solver(engine, client):
+    # 40 empty cells are within the solver's reach but take far too long
+    engine.solver_cells = 40
+    rid = client.send('go', moves='33')
+    time.sleep(0.5)
+    client.send('stop')
+    start = time.time()
+    reply = client.wait(rid)
+    assert time.time() - start < 5
+    assert reply['cancelled']
+    assert reply['move'] in range(7)
+
+
+def test_endgame_table_per_board(tmp_path):
+    path = str(tmp_path / 'endgame.npz')
+    engine = Engine(tt_size_mb=1, endgame=path)
+    engine.endgame(6, 7, 4).scores[5] = 3
+    engine.endgame(5, 6, 4).scores[7] = -2
+    assert engine.stats()['endgames'] == {'6 7 4': 1, '5 6 4': 1}
+    engine.close()
+    assert os.path.exists(str(tmp_path / 'endgame-5x6x4.npz'))
+    engine = Engine(tt_size_mb=1, endgame=path)
+    assert engine.endgame(6, 7, 4).scores == {5: 3}
+    assert engine.endgame(5, 6, 4).scores == {7: -2}
+    engine.close()
+
+
+def test_progress_is_streamed(client):
+    rid = client.send('go', moves='3324', depth=4, progress=True)
+    depths = []
+    while True:
+        reply = json.loads(client.rfile.readline())
+        assert reply['id'] == rid
+        if 'info' not in reply:
+            break
+        depths.append(reply['info']['depth'])
+        assert reply['info']['move'] in range(7)
+    # every finished depth, the last one with the move of the reply
+    assert depths == list(range(5))
+    assert reply['depth'] == 4
+
+
+def test_sessions_share_the_tables(engine, client):
+    first = client.go('3324', depth=7)
+    host, port = client.sock.getpeername()
+    other = EngineClient('{}:{}'.format(host, port), timeout=30)
+    try:
+        second = other.go('3324', depth=7)
+    finally:
+        other.close()
+    assert second['move'] == first['move']
+    assert second['nodes'] < first['nodes'] / 10
+
+
+def test_load_test_answers_every_request(client):
+    host, port = client.sock.getpeername()
+    result = load_test('{}:{}'.format(host, port), clients=3, requests=4, depth=2)
+    assert result['errors'] == 0
+    assert result['requests'] == 12
+    assert result['p50'] <= result['p99'] <= result['max']
@@ -0,0 +1,113 @@
+# system libs
+import threading
+
+# 3rd party libs
+import numpy as np
+import pytest
+
+# Local libs
+from BitBoard import BitBoard
+from MCTS import MCTSPlayer, batch_rollouts
+
+
+GAMES = 4000
+
+
+def state_of(moves, rows=6, cols=7, connect=4):
+    state = BitBoard(rows, cols, connect)
+    for i, col in enumerate(moves):
+        state.play(int(col), i % 2 + 1)
+    return state
+
+
+def slow_rollouts(state, player, count, rng):
+    # batch_rollouts one game at a time on the BitBoard
+    wins = draws = 0
+    for _ in range(count):
+        played = 0
+        mover = player
+        result = 0
+        while state.possible_moves():
+            moves = state.possible_moves()
+            col = moves[int(rng.integers(len(moves)))]
+            state.play(col, mover)
+            played += 1
+            if state.wins_at(col):
+                result = mover
+                break
+            mover = 3 - mover
+        for _ in range(played):
+            state.undo()
+        if result == player:
+            wins += 1
+        elif result == 0:
+            draws += 1
+    return wins, draws
+
+
+# the last two need more than one uint64 word per game
+@pytest.mark.parametrize('rows, cols, connect',
+                         [(6, 7, 4), (5, 6, 3), (8, 9, 5), (10, 10, 4)])
+def test_batch_rollouts_match_slow_rollouts(rows, cols, connect):
+    for moves in ('', '3324', '343434'):
+        state = state_of(moves, rows, cols, connect)
+        if state.has_won(1):
+            # three stones in a column already end a connect-3 game
+            continue
+        player = len(moves) % 2 + 1
+        bits = list(state.bits)
+        wins, draws = batch_rollouts(state, player, GAMES, np.random.default_rng(0))
+        slow_wins, slow_draws = slow_rollouts(state, player, GAMES,
+                                              np.random.default_rng(1))
+        assert state.bits == bits
+        assert abs(wins - slow_wins) < GAMES * 0.05
+        assert abs(draws - slow_draws) < GAMES * 0.05
+
+
+def test_rollouts_of_a_settled_position():
+    # a full board nobody won, but for the top of the last column
+    board = np.array([[1 + (row + col // 2) % 2 for col in range(7)]
+                      for row in range(6)], dtype=np.uint8)
+    board[0, 6] = 0
+    state = BitBoard.from_array(board)
+    assert batch_rollouts(state, 2, 50, np.random.default_rng(0)) == (0, 50)
+    # player 1 wins with any move in column 3 on a board of its own
+    state = state_of('343434')
+    assert batch_rollouts(state, 1, 50, np.random.default_rng(0))[0] > 0
+
+
+@pytest.mark.parametrize('policy', ['uct', 'puct'])
+def test_player_takes_the_win(policy):
+    player = MCTSPlayer(1, iterations=50, policy=policy, log_level='quiet', seed=0)
+    assert player.get_move(state_of('343434').to_array()) == 3
+
+
+def test_tree_is_kept_between_moves():
+    player = MCTSPlayer(1, iterations=100, log_level='quiet', seed=0)
+    moves = [player.get_move(state_of('').to_array())]
+    moves.append((moves[0] + 1) % 7)
+    player.get_move(state_of(''.join(map(str, moves))).to_array())
+    assert player.stats.reused > 0
+
+
+def test_ponder_grows_the_tree_of_the_reply():
+    player = MCTSPlayer(1, iterations=50, log_level='quiet', seed=0)
+    player.cancel_event = threading.Event()
+    timer = threading.Timer(0.3, player.cancel_event.set)
+    timer.start()
+    player.ponder(state_of('3').to_array())
+    timer.join()
+    player.cancel_event = None
+    # the first real search starts from the games the ponder played
+    player.get_move(state_of('34').to_array())
+    assert player.stats.reused > 0
+
+
+def test_workers_add_up_their_trees():
+    player = MCTSPlayer(1, iterations=50, workers=2, log_level='quiet', seed=0)
+    try:
+        assert player.get_move(state_of('33').to_array()) in range(7)
+        # the worker played as many games as the player itself
+        assert player.stats.nodes == 2 * 50 * player.batch
+    finally:
+        player.close()
@@ -0,0 +1,67 @@
+# system libs
+import pickle
+import random
+
+# 3rd party libs
+import numpy as np
+import pytest
+
+# Local libs
+from BitBoard import BitBoard
+from OpeningBook import OpeningBook, book_positions, generate, write_book
+from Player import AIPlayer
+
+
+def test_lookup_finds_every_entry(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    rng = random.Random(0)
+    entries = {rng.getrandbits(64): (rng.randrange(7), rng.randint(-500, 500))
+               for _ in range(1000)}
+    write_book(path, entries)
+    book = OpeningBook(path)
+    try:
+        assert len(book) == len(entries)
+        state = BitBoard()
+        for key, entry in entries.items():
+            state.key = key
+            assert book.lookup(state) == entry
+        state.key = 12345
+        assert book.lookup(state) is None
+        # a board of another size is never in the book
+        assert book.lookup(BitBoard(7, 8)) is None
+        state = BitBoard(6, 7, 5)
+        state.key = key
+        assert book.lookup(state) is None
+    finally:
+        book.close()
+
+
+def test_not_a_book_is_rejected(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 64)
+    with pytest.raises(ValueError):
+        OpeningBook(path)
+
+
+def test_book_positions_reach_every_opening():
+    positions = book_positions(2)
+    # one position of every mirror pair, 3 and 33 are their own mirror
+    assert len(positions) == 1 + (7 + 1) // 2 + (7 * 7 + 1) // 2
+    for moves in positions.values():
+        assert len(moves) <= 2
+
+
+def test_player_plays_the_book_move(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    # the empty board and one of every mirror pair after a move
+    assert generate(path, 1, 3, processes=1) == 5
+    board = np.zeros([6, 7], dtype=np.uint8)
+    expected = AIPlayer(1, depth=3).get_alpha_beta_move(board)
+    ai = AIPlayer(1, depth=3, book=path)
+    assert ai.get_alpha_beta_move(board) == expected
+    assert ai.stats.nodes == 0
+    # the book is opened again after pickling into another process
+    ai = pickle.loads(pickle.dumps(ai))
+    assert ai.get_alpha_beta_move(board) == expected
+    assert ai.stats.nodes == 0
@@ -0,0 +1,255 @@
+# system libs
+import pstats
+import random
+import threading
+import time
+
+# 3rd party libs
+import numpy as np
+import pytest
+
+# Local libs
+from BitBoard import BitBoard
+from Player import AIPlayer, ORDERINGS
+
+
+def board_of(moves, rows=6, cols=7):
+    # The Game encoding board after moves, wins are not checked
+    state = BitBoard(rows, cols)
+    for i, col in enumerate(moves):
+        state.play(int(col), i % 2 + 1)
+    return state.to_array()
+
+
+def test_time_limit_is_kept():
+    board = np.zeros([6, 7], dtype=np.uint8)
+    for time_limit in (0.2, 1):
+        ai = AIPlayer(1, time_limit=time_limit)
+        start = time.time()
+        move = ai.get_alpha_beta_move(board)
+        assert time.time() - start < time_limit
+        assert move in range(7)
+
+
+def test_deepening_finds_the_win():
+    # player 1 wins in column 3, player 2 in column 4
+    board = board_of('343434')
+    for time_limit in (0.2, None):
+        assert AIPlayer(1, time_limit, 3).get_alpha_beta_move(board) == 3
+    # a win is worth no more than its heuristic score to expectimax, deeper
+    # searches against the random player may rate other moves higher
+    assert AIPlayer(1, None, 3).get_expectimax_move(board) == 3
+
+
+def test_last_empty_cell_is_searched():
+    # a full board nobody won, but for the top of the last column
+    board = np.array([[1 + (row + col // 2) % 2 for col in range(7)]
+                      for row in range(6)], dtype=np.uint8)
+    board[0, 6] = 0
+    for time_limit in (None, 0.5):
+        assert AIPlayer(2, time_limit).get_alpha_beta_move(board) == 6
+        assert AIPlayer(2, time_limit).get_expectimax_move(board) == 6
+
+
+def test_batch_leaves_pick_the_same_move():
+    rng = random.Random(0)
+    for _ in range(5):
+        moves = [rng.randrange(7) for _ in range(rng.randint(2, 12))]
+        board = board_of(moves)
+        state = BitBoard.from_array(board)
+        if state.has_won(1) or state.has_won(2) or not state.possible_moves():
+            continue
+        player = len(moves) % 2 + 1
+        for method in ('get_alpha_beta_move', 'get_expectimax_move'):
+            expected = getattr(AIPlayer(player, depth=3), method)(board)
+            ai = AIPlayer(player, depth=3, batch_leaves=True)
+            assert getattr(ai, method)(board) == expected
+
+
+def test_orderings_search_fewer_nodes():
+    rng = random.Random(1)
+    nodes = {}
+    for _ in range(5):
+        moves = [rng.randrange(7) for _ in range(rng.randint(2, 10))]
+        board = board_of(moves)
+        state = BitBoard.from_array(board)
+        if state.has_won(1) or state.has_won(2):
+            continue
+        player = len(moves) % 2 + 1
+        expected = None
+        for ordering in ((), ('center',), ('tt',), ORDERINGS):
+            ai = AIPlayer(player, depth=5, ordering=ordering)
+            move = ai.get_alpha_beta_move(board)
+            if expected is None:
+                expected = move
+            assert move == expected
+            nodes[ordering] = nodes.get(ordering, 0) + ai.stats.nodes
+    assert nodes[ORDERINGS] < nodes[('tt',)] < nodes[()]
+    assert nodes[('center',)] < nodes[()]
+
+
+def test_order_moves_puts_the_table_move_first():
+    ai = AIPlayer(1, ordering=('tt', 'center'))
+    state = BitBoard()
+    moves = ai.order_moves(state, state.possible_moves(), 1, 1, 6)
+    assert moves == [6, 3, 2, 4, 1, 5, 0]
+    with pytest.raises(ValueError):
+        AIPlayer(1, ordering=('random',))
+
+
+def test_stats_add_up():
+    board = board_of('3324')
+    for workers in (1, 2):
+        ai = AIPlayer(1, depth=5, solver_cells=None, log_level='quiet', workers=workers)
+        try:
+            ai.get_alpha_beta_move(board)
+        finally:
+            ai.close()
+        stats = ai.stats.as_dict()
+        assert sum(stats['ply_nodes']) == stats['nodes']
+        assert sum(stats['iteration_nodes']) == stats['nodes']
+        assert len(stats['iteration_times']) == len(stats['iteration_nodes']) == 6
+        # the root moves are ply 1 and depth 5 goes 5 plies below them
+        assert stats['max_depth'] == 6
+        assert 0 < stats['tt_hits'] <= stats['tt_probes']
+        assert 0 < stats['eval_calls'] <= stats['nodes']
+        assert stats['nodes_per_sec'] > 0
+
+
+def test_log_levels(capsys):
+    board = board_of('3324')
+    AIPlayer(1, depth=3, log_level='quiet').get_alpha_beta_move(board)
+    assert capsys.readouterr().out == ''
+    AIPlayer(1, depth=3, log_level='moves').get_alpha_beta_move(board)
+    assert 'picked play at column' in capsys.readouterr().out
+    with pytest.raises(ValueError):
+        AIPlayer(1, log_level='loud')
+
+
+def test_profile_is_written(tmp_path):
+    path = str(tmp_path / 'search.prof')
+    ai = AIPlayer(1, depth=3, log_level='quiet', profile=path)
+    ai.get_alpha_beta_move(board_of('33'))
+    stats = pstats.Stats(path)
+    assert any(name == 'min_value' for _, _, name in stats.stats)
+
+
+class FullWidthPlayer(AIPlayer):
+    # Expectimax without the window, every chance node averages all replies
+
+    def max_exp_val(self, state, depth, alpha=float('-inf'), beta=float('inf')):
+        return super().max_exp_val(state, depth)
+
+    def exp_value(self, state, depth, alpha=float('-inf'), beta=float('inf')):
+        return super().exp_value(state, depth)
+
+
+def random_boards(seed, count=5, plies=12):
+    # Boards of random games nobody has won yet, with the player to move
+    rng = random.Random(seed)
+    found = 0
+    while found < count:
+        state = BitBoard()
+        for ply in range(rng.randint(2, plies)):
+            state.play(rng.choice(state.possible_moves()), ply % 2 + 1)
+        if not (state.has_won(1) or state.has_won(2)):
+            found += 1
+            yield state.to_array(), state.mask.bit_count() % 2 + 1
+
+
+def test_pruned_expectimax_matches_full_width():
+    nodes = full_nodes = 0
+    for board, player in random_boards(2):
+        ai = AIPlayer(player, depth=4, solver_cells=None, log_level='quiet')
+        full = FullWidthPlayer(player, depth=4, solver_cells=None, log_level='quiet')
+        assert ai.get_expectimax_move(board) == full.get_expectimax_move(board)
+        assert ai.stats.score == pytest.approx(full.stats.score)
+        nodes += ai.stats.nodes
+        full_nodes += full.stats.nodes
+    assert nodes < full_nodes
+
+
+def leaf_range(ai, state, depth, player):
+    # Lowest and highest evaluation of the positions depth plies on
+    value, winner = ai.evaluation_function(state)
+    if winner or depth == 0 or state.is_full():
+        return value, value
+    low, high = float('inf'), float('-inf')
+    for col in state.possible_moves():
+        state.play(col, player)
+        child = leaf_range(ai, state, depth - 1, 3 - player)
+        state.undo()
+        low, high = min(low, child[0]), max(high, child[1])
+    return low, high
+
+
+def test_value_bounds_hold():
+    for board, player in random_boards(3, count=10, plies=20):
+        ai = AIPlayer(1, log_level='quiet')
+        state = BitBoard.from_array(board)
+        for depth in (1, 2, 3):
+            low, high = ai.value_bounds(state, depth, player == 1)
+            leaf_low, leaf_high = leaf_range(ai, state, depth, player)
+            assert low <= leaf_low <= leaf_high <= high
+
+
+def test_sampled_expectimax_keeps_the_time_limit():
+    board = board_of('3324')
+    ai = AIPlayer(1, time_limit=1, solver_cells=None, log_level='quiet', exp_samples=2)
+    start = time.time()
+    assert ai.get_expectimax_move(board) in range(7)
+    assert time.time() - start < 1
+
+
+def ponder_for(ai, board, seconds, **kwargs):
+    # Ponders board until a timer sets the cancel event
+    ai.cancel_event = threading.Event()
+    timer = threading.Timer(seconds, ai.cancel_event.set)
+    timer.start()
+    try:
+        return ai.ponder(board, **kwargs)
+    finally:
+        timer.cancel()
+        ai.cancel_event = None
+
+
+def test_ponder_stops_on_cancel():
+    board = board_of('3')
+    for mode, replies in (('alpha_beta', 'expected'), ('expectimax', 'all')):
+        ai = AIPlayer(1, depth=6, log_level='quiet')
+        start = time.time()
+        pondered = ponder_for(ai, board, 0.3, mode=mode)
+        assert time.time() - start < 1.3
+        # the expected reply alone or every reply of the opponent
+        assert len(pondered) == (1 if replies == 'expected' else 7)
+    with pytest.raises(ValueError):
+        ponder_for(ai, board, 0.1, replies='some')
+    with pytest.raises(ValueError):
+        ai.ponder(board)
+
+
+def test_ponder_saves_the_next_search():
+    ai = AIPlayer(1, depth=7, log_level='quiet')
+    pondered = ponder_for(ai, board_of('3'), 0.5, replies='all')
+    for reply in range(7):
+        board = board_of('3' + str(reply))
+        key = BitBoard.from_array(board).key
+        assert ai.get_alpha_beta_move(board) in range(7)
+        assert ai.stats.pondered == pondered[key]
+    # the pondered reply finds its early iterations in the table
+    board = board_of('33')
+    ai = AIPlayer(1, depth=7, log_level='quiet')
+    cold = AIPlayer(1, depth=7, log_level='quiet')
+    ponder_for(ai, board_of('3'), 0.5, replies='all')
+    ai.get_alpha_beta_move(board)
+    cold.get_alpha_beta_move(board)
+    assert ai.stats.nodes < cold.stats.nodes
+
+
+def test_ponder_prepares_once():
+    ai = AIPlayer(1, depth=4, log_level='quiet')
+    generation = ai.tt.generation
+    pondered = ponder_for(ai, board_of('3'), 0.3, replies='all')
+    # one table generation for every pondered reply and depth
+    assert max(pondered.values()) > 1
+    assert ai.tt.generation == generation + 1
@@ -0,0 +1,168 @@
+# system libs
+import multiprocessing as mp
+import random
+import sys
+import tracemalloc
+
+# 3rd party libs
+import numpy as np
+import pytest
+
+# Local libs
+from BitBoard import BitBoard
+import Player
+from Player import AIPlayer
+from Threats import Threats
+
+
+POSITIONS = 30
+ORDERINGS = [('tt', 'killer', 'history', 'center'), ('history', 'killer'), ()]
+
+
+class ListPlayer(AIPlayer):
+    # The search as it was before the move buffers, new lists at every node
+
+    def node_moves(self, state, depth, player, tt_move, masks=None):
+        moves = self.order_moves(state, state.possible_moves(), depth, player, tt_move)
+        if self.threats and depth > 1:
+            moves = Threats(state, player).moves(moves)
+        return moves, len(moves)
+
+
+class SearchingPlayer(AIPlayer):
+    # Searches the nodes the threats settle instead of valuing them at once
+
+    def forced_value(self, state, depth, player, masks):
+        return None
+
+
+def random_position(rng, rows=6, cols=7):
+    """
+    A position of a random game nobody has won yet.
+
+    RETURNS:
+    (board in the Game encoding, player to move)
+    """
+    state = BitBoard(rows, cols)
+    for ply in range(rng.randint(2, 24)):
+        player = ply % 2 + 1
+        options = []
+        for col in state.possible_moves():
+            state.play(col, player)
+            if not state.wins_at(col):
+                options.append(col)
+            state.undo()
+        if not options:
+            break
+        state.play(rng.choice(options), player)
+    return state.to_array(), state.mask.bit_count() % 2 + 1
+
+
+def search(cls, board, player, depth, **kwargs):
+    ai = cls(player, depth=depth, solver_cells=None, log_level='quiet', **kwargs)
+    move = ai.get_alpha_beta_move(board)
+    return move, ai.stats.score, ai.stats.nodes
+
+
+@pytest.mark.parametrize('ordering', ORDERINGS)
+def test_same_moves_as_list_search(ordering):
+    rng = random.Random(0)
+    for _ in range(POSITIONS):
+        board, player = random_position(rng)
+        for threats in (True, False):
+            expected = search(ListPlayer, board, player, 5, ordering=ordering,
+                              threats=threats)
+            assert search(AIPlayer, board, player, 5, ordering=ordering,
+                          threats=threats) == expected
+
+
+def test_same_moves_with_batch_leaves():
+    rng = random.Random(1)
+    for _ in range(POSITIONS):
+        board, player = random_position(rng)
+        assert search(AIPlayer, board, player, 5, batch_leaves=True) == \
+            search(ListPlayer, board, player, 5, batch_leaves=True)
+
+
+def test_forced_nodes_keep_moves():
+    rng = random.Random(2)
+    nodes = searched_nodes = 0
+    for _ in range(POSITIONS):
+        board, player = random_position(rng)
+        move, score, count = search(AIPlayer, board, player, 6)
+        expected = search(SearchingPlayer, board, player, 6)
+        assert (move, score) == expected[:2]
+        nodes += count
+        searched_nodes += expected[2]
+    assert nodes < searched_nodes
+
+
+def peak_memory(cls, board, player, depth):
+    """
+    Memory held at once during a search, over what was held before it: the
+    peak traced bytes and the peak of sys.getallocatedblocks, sampled at
+    every evaluation. A one slot transposition table keeps stored entries
+    out of the numbers, a first search builds what lasts between searches.
+
+    RETURNS:
+    (peak bytes, peak blocks)
+    """
+    ai = cls(player, depth=depth, tt_size_mb=0, solver_cells=None, log_level='quiet')
+    ai.get_alpha_beta_move(board)
+    peak = [0]
+    evaluate = ai.evaluation_function
+
+    def sampled(state):
+        peak[0] = max(peak[0], sys.getallocatedblocks())
+        return evaluate(state)
+
+    ai.evaluation_function = sampled
+    start = sys.getallocatedblocks()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        ai.get_alpha_beta_move(board)
+        peak_bytes = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return peak_bytes, peak[0] - start
+
+
+def test_less_memory_than_list_search():
+    board = np.zeros([6, 7], dtype=np.uint8)
+    board[5, 3] = 1
+    board[4, 3] = 2
+    buffers = peak_memory(AIPlayer, board, 1, 7)
+    lists = peak_memory(ListPlayer, board, 1, 7)
+    assert buffers[0] < lists[0]
+    assert buffers[1] < lists[1]
+
+
+def test_parallel_root_matches_serial():
+    rng = random.Random(3)
+    for _ in range(6):
+        board, player = random_position(rng)
+        expected = search(AIPlayer, board, player, 5)
+        ai = AIPlayer(player, depth=5, solver_cells=None, log_level='quiet', workers=2)
+        try:
+            # moves of the same value may come back in another order
+            move = ai.get_alpha_beta_move(board)
+            assert board[0, move] == 0
+            assert ai.stats.score == expected[1]
+        finally:
+            ai.close()
+
+
+def test_worker_prepares_once_per_search():
+    board, player = random_position(random.Random(4))
+    ai = AIPlayer(player, solver_cells=None, log_level='quiet')
+    Player._init_worker(ai.config, mp.Value('d', float('-inf')))
+    worker = Player._worker_player
+    for search_id in (1, 2):
+        for col in range(3):
+            col, value, alpha, stats = Player._search_worker(board, col, 3, 'alpha_beta',
+                                                             None, None, search_id)
+            assert value is not None
+            assert stats.nodes
+        # one new table generation for all the root moves of a search
+        assert worker.tt.generation == search_id
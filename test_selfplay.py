@@ -0,0 +1,92 @@
+# system libs
+import os
+import random
+
+# 3rd party libs
+import numpy as np
+import pytest
+
+# Local libs
+from BitBoard import BitBoard
+from Player import AIPlayer
+from SelfPlay import FIELDS, ShardDataset, ShardWriter, generate, play_record_game
+
+
+def record_of(count, game):
+    # A made up record of count positions
+    rng = np.random.default_rng(game)
+    return {'boards': rng.integers(0, 3, (count, 6, 7)).astype(np.uint8),
+            'to_move': np.full(count, 1, dtype=np.uint8),
+            'values': rng.random(count).astype(np.float32),
+            'solved': np.zeros(count, dtype=bool),
+            'moves': rng.integers(0, 7, count).astype(np.int8),
+            'outcomes': np.zeros(count, dtype=np.int8),
+            'games': np.full(count, game, dtype=np.int32)}
+
+
+def test_recorded_game_replays():
+    players = [AIPlayer(1, depth=2, log_level='quiet'),
+               AIPlayer(2, depth=2, log_level='quiet')]
+    record = play_record_game(*players, random_plies=2, rng=random.Random(0))
+    assert len({len(record[field]) for field in FIELDS}) == 1
+    for board, to_move, move in zip(record['boards'], record['to_move'],
+                                    record['moves']):
+        # the searched move is legal and the player to move is the right one
+        assert board[0, move] == 0
+        assert np.count_nonzero(board) % 2 + 1 == to_move
+    # the last position and its move decide the outcomes
+    state = BitBoard.from_array(record['boards'][-1])
+    state.play(int(record['moves'][-1]), int(record['to_move'][-1]))
+    winner = int(record['to_move'][-1])
+    if state.has_won(winner):
+        expected = np.where(record['to_move'] == winner, 1, -1)
+    else:
+        expected = np.zeros(len(record['moves']))
+    assert np.array_equal(record['outcomes'], expected)
+
+
+def test_shards_read_back(tmp_path):
+    writer = ShardWriter(str(tmp_path), shard_size=10)
+    records = [record_of(count, game) for game, count in enumerate((7, 12, 6))]
+    for record in records:
+        writer.add(record)
+    # only the part of a shard that is not full yet is held in memory
+    assert writer.buffered == 5
+    writer.close()
+    assert writer.positions == 25
+
+    data = ShardDataset(str(tmp_path))
+    assert [len(shard['moves']) for shard in data.shards] == [10, 10, 5]
+    assert len(data) == 25
+    assert data.geometry == (6, 7, 4)
+    for field in FIELDS:
+        expected = np.concatenate([record[field] for record in records])
+        assert np.array_equal(data.array(field), expected)
+    assert isinstance(data.shards[0]['boards'], np.memmap)
+    sizes = [len(batch['moves']) for batch in data.batches(('moves',), 4)]
+    assert sizes == [4, 4, 2, 4, 4, 2, 4, 1]
+
+
+def test_stale_cache_is_rebuilt(tmp_path):
+    writer = ShardWriter(str(tmp_path), shard_size=10)
+    writer.add(record_of(10, 0))
+    assert len(ShardDataset(str(tmp_path))) == 10
+    # a newer shard of the same name replaces the unpacked one
+    os.remove(os.path.join(str(tmp_path), 'shard-00000.npz'))
+    writer = ShardWriter(str(tmp_path), shard_size=4)
+    writer.add(record_of(4, 1))
+    cache = os.path.join(str(tmp_path), 'cache')
+    for name in os.listdir(cache):
+        os.utime(os.path.join(cache, name), (0, 0))
+    data = ShardDataset(str(tmp_path))
+    assert np.array_equal(data.array('games'), np.full(4, 1))
+
+
+def test_generate_writes_every_position(tmp_path):
+    count = generate(str(tmp_path), 'ai:depth=2', 'ai:depth=2', 3,
+                     shard_size=20, processes=2)
+    data = ShardDataset(str(tmp_path))
+    assert len(data) == count
+    assert set(data.array('games')) == {0, 1, 2}
+    with pytest.raises(ValueError):
+        generate(str(tmp_path), 'ai', 'random', 1)
@@ -0,0 +1,142 @@
+# system libs
+import random
+
+# 3rd party libs
+import numpy as np
+import pytest
+
+# Local libs
+from BitBoard import BitBoard
+from Player import AIPlayer
+from Solver import EndgameTable, Solver
+
+
+# (rows, cols, connect) of the boards the solver is checked on
+SIZES = [(4, 4, 3), (4, 4, 4), (4, 5, 3), (4, 5, 4), (5, 5, 3), (5, 5, 4)]
+POSITIONS = 25
+# Empty cells left in the positions, few enough for the exhaustive search
+MAX_EMPTY = 10
+
+
+def negamax(state, rows, cols):
+    """
+    Score of the player to move by searching every move to the end of the
+    game, in the Solver's convention.
+    """
+    cells = rows * cols
+    discs = state.mask.bit_count()
+    player = discs % 2 + 1
+    best = None
+    for col in state.possible_moves():
+        state.play(col, player)
+        if state.wins_at(col):
+            score = (cells + 1 - discs) // 2
+        elif discs + 1 == cells:
+            score = 0
+        else:
+            score = -negamax(state, rows, cols)
+        state.undo()
+        if best is None or score > best:
+            best = score
+    return best
+
+
+def positions(rows, cols, connect, seed=0):
+    # Seeded random games nobody has won yet with a few empty cells left
+    rng = random.Random(seed)
+    found = 0
+    while found < POSITIONS:
+        state = BitBoard(rows, cols, connect)
+        empty = rng.randint(2, min(MAX_EMPTY, rows * cols - 1))
+        over = False
+        while rows * cols - state.mask.bit_count() > empty:
+            col = rng.choice(state.possible_moves())
+            state.play(col, state.mask.bit_count() % 2 + 1)
+            if state.wins_at(col):
+                over = True
+                break
+        if not over:
+            found += 1
+            yield state
+
+
+@pytest.mark.parametrize('rows, cols, connect', SIZES)
+def test_solver_matches_negamax(rows, cols, connect):
+    solver = Solver(rows, cols, tt_size_mb=1, connect=connect)
+    for state in positions(rows, cols, connect):
+        expected = negamax(state, rows, cols)
+        current, mask, discs = solver.position(state)
+        assert solver.solve(current, mask, discs) == expected
+        col, score = solver.best_move(state)
+        assert score == expected
+        # the move played gets the score it was given
+        player = state.mask.bit_count() % 2 + 1
+        state.play(col, player)
+        if state.wins_at(col):
+            assert score == (rows * cols + 1 - discs) // 2
+        elif state.possible_moves():
+            assert -negamax(state, rows, cols) == score
+        else:
+            assert score == 0
+        state.undo()
+
+
+@pytest.mark.parametrize('rows, cols, connect', [(4, 5, 4), (5, 5, 4)])
+def test_endgame_table_matches_negamax(rows, cols, connect):
+    endgame = EndgameTable(6, rows=rows, cols=cols, connect=connect)
+    solver = Solver(rows, cols, tt_size_mb=1, endgame=endgame, connect=connect)
+    for state in positions(rows, cols, connect, seed=1):
+        assert solver.best_move(state)[1] == negamax(state, rows, cols)
+    assert len(endgame)
+
+
+def test_endgame_table_round_trip(tmp_path):
+    path = str(tmp_path / 'endgame.npz')
+    endgame = EndgameTable(6, rows=4, cols=5, connect=4)
+    solver = Solver(4, 5, tt_size_mb=1, endgame=endgame, connect=4)
+    for state in positions(4, 5, 4, seed=2):
+        solver.best_move(state)
+    endgame.save(path)
+    loaded = EndgameTable(rows=4, cols=5, connect=4)
+    loaded.load(path)
+    assert loaded.cells == 6
+    assert loaded.scores == endgame.scores
+
+
+def test_endgame_table_keys_over_64_bits(tmp_path):
+    path = str(tmp_path / 'endgame.npz')
+    endgame = EndgameTable(rows=8, cols=9, connect=5)
+    rng = random.Random(3)
+    endgame.scores = {rng.getrandbits(9 * 9 + 1): rng.randint(-20, 20)
+                      for _ in range(50)}
+    endgame.save(path)
+    assert EndgameTable(path=path, rows=8, cols=9, connect=5).scores == endgame.scores
+
+
+def test_endgame_table_rejects_other_geometry(tmp_path):
+    path = str(tmp_path / 'endgame.npz')
+    EndgameTable(rows=4, cols=5, connect=4).save(path)
+    for rows, cols, connect in ((4, 5, 3), (5, 4, 4), (6, 7, 4)):
+        with pytest.raises(ValueError):
+            EndgameTable(path=path, rows=rows, cols=cols, connect=connect)
+    with pytest.raises(ValueError):
+        Solver(6, 7, tt_size_mb=1, endgame=EndgameTable(rows=4, cols=5, connect=4))
+    # a file of before the geometry was recorded
+    np.savez_compressed(path, cells=8, keys=np.zeros([0, 4], dtype=np.uint8),
+                        scores=np.zeros(0, dtype=np.int8))
+    with pytest.raises(ValueError):
+        EndgameTable(path=path, rows=4, cols=5, connect=4)
+
+
+@pytest.mark.parametrize('connect', [3, 4])
+def test_player_plays_the_solved_move(connect):
+    for state in positions(4, 5, connect, seed=3):
+        player = state.mask.bit_count() % 2 + 1
+        ai = AIPlayer(player, depth=1, tt_size_mb=1, connect=connect)
+        col = ai.get_alpha_beta_move(state.to_array())
+        assert ai.stats.solved
+        assert ai.stats.score == negamax(state, 4, 5)
+        state.play(col, player)
+        if not state.wins_at(col) and state.possible_moves():
+            assert -negamax(state, 4, 5) == ai.stats.score
+        state.undo()
@@ -0,0 +1,144 @@
+# system libs
+import random
+
+# 3rd party libs
+import numpy as np
+import pytest
+
+# Local libs
+from BitBoard import BitBoard
+from OpeningBook import OpeningBook, book_positions, write_book
+from Player import AIPlayer
+from Solver import Solver
+from Transposition import EXACT
+
+
+# (rows, cols, connect) of the boards every check runs on
+SIZES = [(6, 7, 4), (5, 6, 4), (8, 9, 5)]
+POSITIONS = 50
+
+
+def random_state(rng, rows=6, cols=7, connect=4):
+    # A position of a random game nobody has won yet
+    state = BitBoard(rows, cols, connect)
+    for ply in range(rng.randint(1, rows * cols // 2)):
+        player = ply % 2 + 1
+        options = []
+        for col in state.possible_moves():
+            state.play(col, player)
+            if not state.wins_at(col):
+                options.append(col)
+            state.undo()
+        if not options:
+            break
+        state.play(rng.choice(options), player)
+    return state
+
+
+def mirrored(state):
+    return BitBoard.from_array(np.fliplr(state.to_array()), state.connect)
+
+
+def asymmetric_states(seed, count=POSITIONS, rows=6, cols=7, connect=4):
+    # Random positions that differ from their mirror image
+    rng = random.Random(seed)
+    found = 0
+    while found < count:
+        state = random_state(rng, rows, cols, connect)
+        if state.key != state.mirror_key:
+            found += 1
+            yield state
+
+
+@pytest.mark.parametrize('rows, cols, connect', SIZES)
+def test_mirror_key_is_key_of_mirrored_board(rows, cols, connect):
+    rng = random.Random(0)
+    for _ in range(POSITIONS):
+        state = random_state(rng, rows, cols, connect)
+        image = mirrored(state)
+        assert image.key == state.mirror_key
+        assert image.mirror_key == state.key
+        key, flipped = state.canonical()
+        image_key, image_flipped = image.canonical()
+        assert key == image_key
+        if state.key != state.mirror_key:
+            assert flipped != image_flipped
+        # keys kept by play and undo match the ones of a fresh board
+        loaded = BitBoard.from_array(state.to_array(), connect)
+        assert (loaded.key, loaded.mirror_key) == (state.key, state.mirror_key)
+
+
+def test_solver_canonical_key_of_mirrored_board():
+    rng = random.Random(1)
+    solver = Solver(tt_size_mb=1)
+    for _ in range(POSITIONS):
+        state = random_state(rng)
+        current, mask, _ = solver.position(state)
+        image_current, image_mask, _ = solver.position(mirrored(state))
+        assert solver.canonical(current + mask) == \
+            solver.canonical(image_current + image_mask)
+
+
+def test_table_entry_found_from_mirror_image():
+    ai = AIPlayer(1, tt_size_mb=1, solver_cells=None, log_level='quiet')
+    for state in asymmetric_states(2):
+        image = mirrored(state)
+        move = random.Random(state.key).choice(state.possible_moves())
+        # stored through one orientation with its own move
+        key, flipped = ai.table_key(state)
+        ai.tt.store(key, 3, 1.5, EXACT, state.mirror_col(move) if flipped else move)
+        # probed through the other
+        image_key, image_flipped = ai.table_key(image)
+        assert image_key == key
+        _, value, flag, stored = ai.tt.probe(image_key)
+        if image_flipped:
+            stored = image.mirror_col(stored)
+        assert (value, flag) == (1.5, EXACT)
+        assert stored == image.mirror_col(move)
+
+
+def test_search_of_mirror_image_reuses_the_table():
+    nodes = image_nodes = 0
+    for state in asymmetric_states(3, count=10):
+        board = state.to_array()
+        player = state.mask.bit_count() % 2 + 1
+        ai = AIPlayer(player, depth=5, solver_cells=None, log_level='quiet')
+        move = ai.get_alpha_beta_move(board)
+        score = ai.stats.score
+        nodes += ai.stats.nodes
+        image_move = ai.get_alpha_beta_move(np.fliplr(board))
+        assert image_move == state.mirror_col(move)
+        assert ai.stats.score == score
+        image_nodes += ai.stats.nodes
+    # the second search starts from the entries of the first
+    assert image_nodes < nodes / 2
+
+
+def test_book_finds_mirror_image(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    states = list(asymmetric_states(4, count=20))
+    entries = {}
+    for state in states:
+        move = random.Random(state.key).choice(state.possible_moves())
+        entries[state.key] = (move, 7)
+    write_book(path, entries)
+    book = OpeningBook(path)
+    try:
+        for state in states:
+            move, score = entries[state.key]
+            assert book.lookup(state) == (move, score)
+            assert book.lookup(mirrored(state)) == (state.mirror_col(move), score)
+    finally:
+        book.close()
+
+
+def test_book_keeps_one_of_every_mirror_pair():
+    positions = book_positions(4)
+    seen = set()
+    for moves in positions.values():
+        state = BitBoard()
+        for i, col in enumerate(moves):
+            state.play(col, i % 2 + 1)
+        assert state.mirror_key not in seen or state.mirror_key == state.key
+        seen.add(state.key)
+        assert state.canonical()[0] in positions
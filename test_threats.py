@@ -0,0 +1,125 @@
+# system libs
+import random
+
+# 3rd party libs
+import pytest
+
+# Local libs
+from BitBoard import BitBoard, connected_through
+from Player import AIPlayer
+from Threats import Threats, threat_cells
+
+
+SIZES = [(6, 7, 4), (5, 6, 3), (7, 8, 5)]
+
+
+def positions(rows, cols, connect, seed, count=60):
+    """
+    States of random games nobody has won yet, with the player to move.
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        state = BitBoard(rows, cols, connect)
+        for ply in range(rng.randint(0, rows * cols - 1)):
+            player = ply % 2 + 1
+            options = []
+            for col in state.possible_moves():
+                state.play(col, player)
+                if not state.wins_at(col):
+                    options.append(col)
+                state.undo()
+            if not options:
+                break
+            state.play(rng.choice(options), player)
+        yield state, state.mask.bit_count() % 2 + 1
+
+
+def cell(state, row, col):
+    # The bit of a cell of the Game encoding board
+    return 1 << (state.geometry.bottom_bits[col] + state.rows - 1 - row)
+
+
+def wins_after(state, col, player):
+    # Tells if player wins by dropping a disc in col
+    state.play(col, player)
+    won = state.wins_at(col)
+    state.undo()
+    return won
+
+
+@pytest.mark.parametrize('rows, cols, connect', SIZES)
+def test_threat_cells_match_a_board_scan(rows, cols, connect):
+    for state, _ in positions(rows, cols, connect, seed=0):
+        board = state.to_array()
+        for player in (1, 2):
+            expected = 0
+            for row in range(rows):
+                for col in range(cols):
+                    if board[row, col] == 0 and \
+                            connected_through(board, row, col, player, connect):
+                        expected |= cell(state, row, col)
+            assert threat_cells(state, player) == expected
+
+
+@pytest.mark.parametrize('rows, cols, connect', SIZES)
+def test_moves_keep_what_matters(rows, cols, connect):
+    for state, player in positions(rows, cols, connect, seed=1):
+        moves = list(state.center_moves())
+        threats = Threats(state, player)
+        kept = threats.moves(moves)
+        assert kept and set(kept) <= set(moves)
+        wins = [col for col in moves if wins_after(state, col, player)]
+        blocks = [col for col in moves if wins_after(state, col, 3 - player)]
+        if wins:
+            assert set(kept) <= set(wins)
+            continue
+        if blocks:
+            assert set(kept) <= set(blocks)
+            continue
+        # a disc right below an opponent threat lets the opponent win
+        safe = []
+        for col in moves:
+            state.play(col, player)
+            if not any(wins_after(state, reply, 3 - player)
+                       for reply in state.possible_moves()):
+                safe.append(col)
+            state.undo()
+        if safe:
+            assert kept == safe
+
+
+@pytest.mark.parametrize('rows, cols, connect', SIZES)
+def test_lost_matches_the_replies(rows, cols, connect):
+    for state, player in positions(rows, cols, connect, seed=2):
+        threats = Threats(state, player)
+        if not threats.blocks:
+            assert not threats.lost()
+            continue
+        # every move leaves the opponent a win
+        lost = True
+        for col in state.possible_moves():
+            state.play(col, player)
+            if state.wins_at(col) or not any(
+                    wins_after(state, reply, 3 - player)
+                    for reply in state.possible_moves()):
+                lost = False
+            state.undo()
+        assert threats.lost() == lost
+
+
+def test_search_plays_a_kept_move():
+    nodes = {False: 0, True: 0}
+    for state, player in positions(6, 7, 4, seed=3, count=20):
+        board = state.to_array()
+        for threats in (False, True):
+            ai = AIPlayer(player, depth=5, solver_cells=None, threats=threats,
+                          log_level='quiet')
+            move = ai.get_alpha_beta_move(board)
+            nodes[threats] += ai.stats.nodes
+        threats = Threats(state, player)
+        if threats.wins:
+            # any of several wins will do
+            assert wins_after(state, move, player)
+        elif not threats.lost():
+            assert move in threats.moves(list(state.center_moves()))
+    assert nodes[True] < nodes[False]
@@ -0,0 +1,69 @@
+# system libs
+import csv
+import json
+import random
+
+# 3rd party libs
+import pytest
+
+# Local libs
+from BitBoard import BitBoard
+from Tournament import elo_difference, make_player, play_game, run_tournament
+
+
+def test_make_player_reads_the_spec():
+    player = make_player('ai:depth=3,time=0.5,workers=2,tt=4', 2)
+    assert (player.player_number, player.depth, player.time_limit, player.workers) == \
+        (2, 3, 0.5, 2)
+    player = make_player('mcts:time=0.5,policy=puct,batch=8,workers=2,c=1', 1)
+    assert (player.type, player.policy, player.batch, player.exploration) == \
+        ('mcts', 'puct', 8, 1)
+    assert make_player('random', 1).type == 'random'
+    for spec in ('human', 'ai:speed=3', 'mcts:depth=3'):
+        with pytest.raises(ValueError):
+            make_player(spec, 1)
+
+
+def test_game_record_replays():
+    random.seed(0)
+    for _ in range(10):
+        record = play_game(make_player('random', 1), make_player('random', 2))
+        state = BitBoard()
+        for ply, col in enumerate(record['moves']):
+            state.play(col, ply % 2 + 1)
+        winner = 1 if state.has_won(1) else 2 if state.has_won(2) else 0
+        assert record['winner'] == winner
+        assert len(record['think_times']) == len(record['nodes']) == len(record['moves'])
+
+
+def test_games_on_other_boards():
+    random.seed(1)
+    for rows, cols, connect in ((5, 6, 3), (7, 8, 5)):
+        players = [make_player('random', 1, connect), make_player('ai:depth=2', 2, connect)]
+        record = play_game(*players, rows, cols, connect)
+        state = BitBoard(rows, cols, connect)
+        for ply, col in enumerate(record['moves']):
+            state.play(col, ply % 2 + 1)
+        winner = 1 if state.has_won(1) else 2 if state.has_won(2) else 0
+        assert record['winner'] == winner
+
+
+@pytest.mark.parametrize('suffix', ['jsonl', 'csv'])
+def test_tournament_streams_every_game(tmp_path, suffix):
+    path = str(tmp_path / 'games.{}'.format(suffix))
+    summary = run_tournament('ai:depth=2', 'random', 4, output=path, processes=2)
+    assert summary['wins'] + summary['draws'] + summary['losses'] == 4
+    with open(path) as f:
+        if suffix == 'csv':
+            records = list(csv.DictReader(f))
+        else:
+            records = [json.loads(line) for line in f]
+    assert sorted(int(record['game']) for record in records) == [0, 1, 2, 3]
+    # the sides alternate
+    assert [record['first'] for record in records].count('random') == 2
+
+
+def test_elo_difference():
+    assert elo_difference(0.5) == 0
+    assert elo_difference(0.75) == pytest.approx(-elo_difference(0.25))
+    assert elo_difference(1) == float('inf')
@@ -0,0 +1,77 @@
+# system libs
+import random
+
+# Local libs
+from BitBoard import BitBoard
+from Player import AIPlayer
+from Transposition import EXACT, LOWER, UPPER, TranspositionTable
+
+
+POSITIONS = 5
+
+
+def test_probe_returns_the_stored_entry():
+    tt = TranspositionTable(1)
+    assert tt.probe(12345) is None
+    tt.store(12345, 3, 1.5, LOWER, 2)
+    assert tt.probe(12345) == (3, 1.5, LOWER, 2)
+    # the same position stored again replaces its entry
+    tt.store(12345, 1, -4, UPPER, 0)
+    assert tt.probe(12345) == (1, -4, UPPER, 0)
+    stats = tt.stats()
+    assert (stats['hits'], stats['misses'], stats['stores']) == (2, 1, 2)
+
+
+def test_depth_replacement_keeps_the_deeper_entry():
+    # a one slot table, every other key collides
+    tt = TranspositionTable(0)
+    assert tt.size == 1
+    tt.store(1, 5, 10, EXACT)
+    tt.store(2, 3, 20, EXACT)
+    assert tt.probe(2) is None
+    assert tt.probe(1) == (5, 10, EXACT, None)
+    assert tt.stats()['collisions'] == 1
+    # entries of an earlier search give way
+    tt.new_search()
+    tt.store(2, 3, 20, EXACT)
+    assert tt.probe(2) == (3, 20, EXACT, None)
+    assert tt.stats()['overwrites'] == 1
+
+
+def test_always_replacement_keeps_the_newest_entry():
+    tt = TranspositionTable(0, replacement='always')
+    tt.store(1, 5, 10, EXACT)
+    tt.store(2, 3, 20, EXACT)
+    assert tt.probe(2) == (3, 20, EXACT, None)
+    assert tt.probe(1) is None
+
+
+def test_keys_follow_play_and_undo():
+    rng = random.Random(0)
+    state = BitBoard()
+    keys = [state.key]
+    for ply in range(30):
+        state.play(rng.choice(state.possible_moves()), ply % 2 + 1)
+        keys.append(state.key)
+        assert BitBoard.from_array(state.to_array()).key == state.key
+    # every position of the game has its own key
+    assert len(set(keys)) == len(keys)
+    for key in reversed(keys[:-1]):
+        state.undo()
+        assert state.key == key
+
+
+def test_search_picks_the_same_move_without_the_table():
+    rng = random.Random(1)
+    for _ in range(POSITIONS):
+        state = BitBoard()
+        for ply in range(rng.randint(2, 12)):
+            state.play(rng.choice(state.possible_moves()), ply % 2 + 1)
+        if state.has_won(1) or state.has_won(2):
+            continue
+        board = state.to_array()
+        player = state.mask.bit_count() % 2 + 1
+        # a one slot table keeps next to nothing
+        moves = [AIPlayer(player, tt_size_mb=size).get_alpha_beta_move(board)
+                 for size in (16, 0)]
+        assert moves[0] == moves[1]
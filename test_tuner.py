@@ -0,0 +1,100 @@
+# system libs
+import os
+import subprocess
+import sys
+
+# 3rd party libs
+import numpy as np
+import pytest
+
+# Local libs
+from BitBoard import RUN_WEIGHTS, batch_heuristic
+from Player import AIPlayer, DEFENSE, load_weights, save_weights, valid_weights
+from Tuner import evaluate, features, fit_scale, texel_error, tune
+
+
+# The tuner script, run on a directory without shards
+TUNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Tuner.py')
+# Weights the synthetic results are drawn from
+TRUE_RUNS = (3, 6, 100)
+TRUE_DEFENSE = 1.5
+TRUE_SCALE = 0.05
+
+
+def synthetic(count=5000, seed=0):
+    """
+    Random run counts and results whose win probability is the logistic of
+    the evaluation with the true weights.
+
+    RETURNS:
+    (features, targets)
+    """
+    rng = np.random.default_rng(seed)
+    feats = rng.integers(0, 8, size=(count, 2, 3)).astype(np.int16)
+    # stored positions never hold a win
+    feats[:, :, 2] = 0
+    values = TRUE_SCALE * evaluate(feats, TRUE_RUNS, TRUE_DEFENSE)
+    targets = (rng.random(count) < 1 / (1 + np.exp(-values))).astype(np.float64)
+    return feats, targets
+
+
+def test_features_match_the_heuristic():
+    rng = np.random.default_rng(1)
+    boards = rng.integers(0, 3, size=(200, 6, 7)).astype(np.uint8)
+    to_move = rng.integers(1, 3, size=200)
+    scores, _ = batch_heuristic(boards)
+    own = np.where(to_move == 1, scores[:, 0], scores[:, 1])
+    other = np.where(to_move == 1, scores[:, 1], scores[:, 0])
+    values = evaluate(features(boards, to_move), RUN_WEIGHTS, DEFENSE)
+    assert np.array_equal(values, own - other)
+
+
+def test_fit_scale_finds_the_best_scale():
+    feats, targets = synthetic()
+    scale = fit_scale(feats, targets, RUN_WEIGHTS, DEFENSE)
+    error = texel_error(feats, targets, RUN_WEIGHTS, DEFENSE, scale)
+    for factor in (0.5, 0.8, 1.25, 2):
+        assert error <= texel_error(feats, targets, RUN_WEIGHTS, DEFENSE,
+                                    scale * factor)
+
+
+def test_tune_lowers_the_error():
+    feats, targets = synthetic()
+    scale = fit_scale(feats, targets, RUN_WEIGHTS, DEFENSE)
+    before = texel_error(feats, targets, RUN_WEIGHTS, DEFENSE, scale)
+    runs, defense, scale, error = tune(feats, targets, scale=scale, iterations=30,
+                                       log=False)
+    assert error < before
+    assert texel_error(feats, targets, runs, defense, scale) < before
+    assert valid_weights(runs, defense)
+    # the win weight is not tuned
+    assert runs[2] == RUN_WEIGHTS[2]
+
+
+def test_players_load_the_weights(tmp_path):
+    path = str(tmp_path / 'weights.json')
+    save_weights(path, (2, 7, 100), 1.25, error=0.2)
+    assert load_weights(path) == ((2, 7, 100), 1.25, 4)
+    ai = AIPlayer(1, depth=2, weights=path, log_level='quiet')
+    assert (ai.weights, ai.defense) == ((2, 7, 100), 1.25)
+    assert ai.get_alpha_beta_move(np.zeros([6, 7], dtype=np.uint8)) in range(7)
+    with pytest.raises(ValueError):
+        AIPlayer(1, weights=path, connect=5)
+
+
+def test_weights_out_of_range_are_rejected(tmp_path):
+    path = str(tmp_path / 'weights.json')
+    for runs, defense in (((0, 7, 100), 1), ((8, 7, 100), 1), ((2, 700, 100), 1),
+                          ((2, 7, 100), 0)):
+        assert not valid_weights(runs, defense)
+        save_weights(path, runs, defense)
+        with pytest.raises(ValueError):
+            load_weights(path)
+
+
+def test_empty_data_is_rejected(tmp_path):
+    result = subprocess.run([sys.executable, TUNER, str(tmp_path)],
+                            capture_output=True, text=True)
+    assert result.returncode != 0
+    assert 'ValueError' in result.stderr
+    assert 'holds no positions' in result.stderr